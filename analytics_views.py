@@ -3,10 +3,10 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from transactions.models import Transaction
 from budgets.models import MonthlyBudget, BudgetAlertEvent
-from transactions.rewards import calculate_total_rewards
-from django.db.models import Sum
+from transactions.rewards import calculate_total_rewards, calculate_total_rewards_in_database
+from transactions.rollups import month_totals
+from django.conf import settings
 from datetime import datetime
-from decimal import Decimal
 
 class DashboardView(APIView):
     permission_classes = [IsAuthenticated]
@@ -23,13 +23,15 @@ class DashboardView(APIView):
             created_at__month=now.month
         )
         
-        total_spent = this_month_transactions.aggregate(
-            total=Sum('amount')
-        )['total'] or Decimal('0.00')
+        # This month's spend and rewards come from the monthly rollups
+        total_spent, rewards_earned = month_totals(user, current_month)
         
-        # Calculate rewards earned this month
+        # Calculate rewards earned this month (cap-aware / SQL paths recompute from transactions)
         month_start = datetime(now.year, now.month, 1)
-        rewards_earned = calculate_total_rewards(user, start_date=month_start)
+        if getattr(settings, 'REWARDS_APPLY_CAPS', False):
+            rewards_earned = calculate_total_rewards(user, start_date=month_start, apply_caps=True)
+        elif getattr(settings, 'REWARDS_SQL_PUSHDOWN', False):
+            rewards_earned = calculate_total_rewards_in_database(user, start_date=month_start)
         
         # Get current budget
         try:
@@ -169,6 +169,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (CSV import jobs keep their upload here until processed)
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -183,3 +186,20 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
 }
+
+# Rewards
+# Compute the dashboard and card rewards totals with a single SQL aggregate
+# query instead of loading the month's transactions into Python.
+REWARDS_SQL_PUSHDOWN = False
+# Honor each reward rule's annual cap_amount (bonus rate stops once the cap's
+# spend is reached). Takes precedence over REWARDS_SQL_PUSHDOWN.
+REWARDS_APPLY_CAPS = False
+
+# CSV imports
+# Worker threads for background import jobs (POST import-csv/ with background=true)
+CSV_IMPORT_WORKERS = 2
+# Processes validating row chunks for imports posted with parallel=true
+CSV_IMPORT_VALIDATION_WORKERS = 4
+# Seconds since a RUNNING job last saved its progress before `manage.py run_import_jobs`
+# takes it over (until then it may still be running in a web process)
+CSV_IMPORT_JOB_LEASE = 600
@@ -12,6 +12,7 @@ from .serializers import (
     BudgetHistoryItemSerializer
 )
 from .services import mtd_spend, evaluate_thresholds, compute_user_month_window, get_user_timezone
+from transactions.rollups import monthly_spend
 
 
 # Check API health
@@ -236,12 +237,15 @@ class BudgetsHistoryView(APIView):
         # Get budgets for these months
         budgets = {b.year_month: b for b in MonthlyBudget.objects.filter(user=user, year_month__in=months)}
         
+        # Spend for all months in one query on the monthly rollups
+        spend_by_month = monthly_spend(user, months)
+        
         # Build response
         history = []
         for year_month in months:
             budget_obj = budgets.get(year_month)
             budget_amount = budget_obj.amount if budget_obj else None
-            actual_spend = mtd_spend(user, year_month)
+            actual_spend = spend_by_month[year_month]
             if budget_amount and budget_amount > 0:
                 percent_used = float(actual_spend / budget_amount)
             else:
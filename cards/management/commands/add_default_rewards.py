@@ -1,6 +1,6 @@
 # AI generated script
 from django.core.management.base import BaseCommand
-from cards.models import Card, RewardRule
+from cards.models import Card, RewardRule, RewardRuleCategory
 
 class Command(BaseCommand):
     help = 'Add default 1x OTHER category reward rule to all cards that don\'t have one'
@@ -22,14 +22,13 @@ class Command(BaseCommand):
         
         self.stdout.write(f"Processing {cards.count()} cards...")
         
+        # Cards that already have an OTHER category reward rule (indexed lookup)
+        cards_with_other = set(
+            RewardRuleCategory.objects.filter(category='OTHER').values_list('card_id', flat=True)
+        )
+        
         for card in cards:
-            # Check if this card already has an OTHER category reward rule
-            existing_other_rule = RewardRule.objects.filter(
-                card=card,
-                category__contains='OTHER'
-            ).exists()
-            
-            if existing_other_rule:
+            if card.id in cards_with_other:
                 self.stdout.write(
                     self.style.WARNING(f"Card '{card}' already has OTHER category rule - skipping")
                 )
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_rule_categories(apps, schema_editor):
+    """Create a RewardRuleCategory row for every category of every existing rule."""
+    RewardRule = apps.get_model('cards', 'RewardRule')
+    RewardRuleCategory = apps.get_model('cards', 'RewardRuleCategory')
+
+    links = []
+    for rule_id, card_id, categories in RewardRule.objects.values_list('id', 'card_id', 'category'):
+        if isinstance(categories, str):
+            categories = [cat.strip() for cat in categories.split(',')]
+        for category in dict.fromkeys(cat for cat in categories if cat):
+            links.append(RewardRuleCategory(rule_id=rule_id, card_id=card_id, category=category))
+    RewardRuleCategory.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0017_alter_cardbenefit_benefits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RewardRuleCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('SELECTED_CATEGORIES', 'Selected Categories'), ('RENT', 'Rent'), ('ONLINE_SHOPPING', 'Online Shopping'), ('DINING', 'Dining'), ('GROCERIES', 'Groceries'), ('PHARMACY', 'Pharmacy'), ('GAS', 'Gas'), ('GENERAL_TRAVEL', 'General Travel'), ('AIRLINE_TRAVEL', 'Airline Travel'), ('HOTEL_TRAVEL', 'Hotel Travel'), ('TRANSIT', 'Transit'), ('ENTERTAINMENT', 'Entertainment'), ('OTHER', 'Other')], max_length=255)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reward_rule_categories', to='cards.card')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_links', to='cards.rewardrule')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'card'], name='cards_rewar_categor_4f5a1b_idx')],
+                'constraints': [models.UniqueConstraint(fields=('rule', 'category'), name='uniq_reward_rule_category')],
+            },
+        ),
+        migrations.RunPython(populate_rule_categories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0018_rewardrulecategory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RewardRateVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -83,4 +83,32 @@ class RewardRule(models.Model):
         max_choices=len(CATEGORY_CHOICES),
     )
     cap_amount = models.DecimalField("Cap Amount (annual $)", max_digits=6, decimal_places=0, null=True, blank=True)
-    notes = models.TextField(blank=True, null=True)
\ No newline at end of file
+    notes = models.TextField(blank=True, null=True)
+
+# One row per (reward rule, category), kept in sync with RewardRule.category
+# by cards/signals.py so category lookups can use an index instead of LIKE scans
+class RewardRuleCategory(models.Model):
+    rule = models.ForeignKey(RewardRule, on_delete=models.CASCADE, related_name="category_links")
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name="reward_rule_categories")
+    category = models.CharField(max_length=255, choices=RewardRule.CATEGORY_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["rule", "category"], name="uniq_reward_rule_category")
+        ]
+        indexes = [
+            models.Index(fields=["category", "card"]),
+        ]
+
+    def __str__(self):
+        return f"{self.card.name} · {self.category}"
+
+
+# Single-row counter bumped by cards/signals.py on every RewardRule change.
+# Compiled rate tables (cards/rates.py) remember the version they were built
+# from, so a process can tell its in-memory table is stale before persisting rewards.
+class RewardRateVersion(models.Model):
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Reward rates v{self.version}"
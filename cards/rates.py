@@ -0,0 +1,214 @@
+"""
+Compiled reward rate table.
+Maps (card_id, category) to the best reward multiplier for that pair, with the
+card's OTHER (base rate) fallback already applied. The table is built once from
+all RewardRule rows (through their RewardRuleCategory rows) and kept in process memory, so reward calculations don't
+have to query and re-split rules for every transaction.
+
+The table is invalidated by the RewardRule/Card signals in cards/signals.py and
+rebuilt lazily on the next lookup. Each table also records the RewardRateVersion
+it was built from; writes call get_rate_table(verify=True), which compares that
+version with the database, so rule changes saved by another process are picked
+up before any reward is persisted.
+"""
+import threading
+import time
+from decimal import Decimal
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+from cards.models import RewardRule, RewardRuleCategory, RewardRateVersion
+
+ZERO = Decimal('0.00')
+BASE_CATEGORY = "OTHER"
+CATEGORIES = [choice[0] for choice in RewardRule.CATEGORY_CHOICES]
+
+# Safety net for multi-process deployments: signals only reach the process that
+# saved the rule, so other workers pick the change up after this many seconds.
+DEFAULT_TTL_SECONDS = 300
+
+
+class RewardRateTable:
+    """Best multiplier per (card_id, category), OTHER fallback included."""
+
+    def __init__(self, rules, version=None):
+        """
+        Args:
+            rules: iterable of (rule_id, card_id, categories, multiplier, cap_amount) tuples
+            version: RewardRateVersion the rules were read at (None if unknown)
+        """
+        self.version = version
+        best = {}
+        matching = {}
+        for rule_id, card_id, categories, multiplier, cap_amount in rules:
+            if not multiplier:
+                continue
+            if isinstance(categories, str):
+                categories = [cat.strip() for cat in categories.split(',')]
+            cap_cents = int(cap_amount * 100) if cap_amount is not None else None
+            for category in categories:
+                key = (card_id, category)
+                if multiplier > best.get(key, ZERO):
+                    best[key] = multiplier
+                matching.setdefault(key, []).append((int(multiplier * 100), cap_cents, rule_id))
+
+        self.card_ids = sorted({card_id for card_id, _category in best})
+        self._matrix = None
+        self._base = {}
+        self._rates = {}
+        for card_id in self.card_ids:
+            base = best.get((card_id, BASE_CATEGORY), ZERO)
+            self._base[card_id] = base
+            for category in CATEGORIES:
+                # No specific category bonus → fall back to OTHER (base rate)
+                self._rates[(card_id, category)] = best.get((card_id, category), ZERO) or base
+        # Same rates as integer basis points (3.00 → 300) for the fixed-point reward path
+        self._bps = {key: int(multiplier * 100) for key, multiplier in self._rates.items()}
+        self._base_bps = {card_id: int(base * 100) for card_id, base in self._base.items()}
+
+        self._matching = {
+            key: sorted(rules, key=lambda rule: rule[0], reverse=True)
+            for key, rules in matching.items()
+        }
+        self._chains = {}
+
+    @classmethod
+    def build(cls):
+        # Version first: a change committed while the rules are read only
+        # makes this table look older than it is, never newer
+        version = current_version()
+        # One row per (rule, category) from the normalized category table
+        links = RewardRuleCategory.objects.values_list(
+            "rule_id", "card_id", "category", "rule__multiplier", "rule__cap_amount"
+        ).order_by("rule_id", "id")
+        return cls(
+            (
+                (rule_id, card_id, [category], multiplier, cap_amount)
+                for rule_id, card_id, category, multiplier, cap_amount in links
+            ),
+            version=version,
+        )
+
+    def multiplier(self, card_id, category):
+        """Best multiplier for a card in a category (0.00 if the card has no rules)."""
+        if not card_id or not category:
+            return ZERO
+        return self._rates.get((card_id, category), self._base.get(card_id, ZERO))
+
+    def bps(self, card_id, category):
+        """multiplier() in basis points, as an int (0 if the card has no rules)."""
+        if not card_id or not category:
+            return 0
+        bps = self._bps.get((card_id, category))
+        if bps is None:
+            return self._base_bps.get(card_id, 0)
+        return bps
+
+    def rule_chain(self, card_id, category):
+        """
+        Rules a purchase falls through once bonus caps are used up, best first:
+        the category's own rules, then the card's OTHER (base rate) rules, ending
+        at the first uncapped rule.
+
+        Returns:
+            tuple of (bps, cap_cents or None, rule_id), where cap_cents is the
+            annual spend cap of that rule in cents
+        """
+        key = (card_id, category)
+        chain = self._chains.get(key)
+        if chain is None:
+            chain = []
+            candidates = self._matching.get(key, [])
+            if category != BASE_CATEGORY:
+                candidates = candidates + self._matching.get((card_id, BASE_CATEGORY), [])
+            for rule in candidates:
+                chain.append(rule)
+                if rule[1] is None:
+                    break
+            chain = self._chains[key] = tuple(chain)
+        return chain
+
+    def items(self):
+        """((card_id, category), multiplier) pairs for every category in CATEGORY_CHOICES."""
+        return self._rates.items()
+
+    def base_rates(self):
+        """{card_id: OTHER multiplier}, used for categories outside CATEGORY_CHOICES."""
+        return dict(self._base)
+
+    def bps_matrix(self):
+        """
+        Rates as a NumPy matrix in basis points (multiplier 3.00 → 300).
+
+        Returns:
+            (row_index, column_index, matrix) where row_index maps card_id and
+            column_index maps category to matrix positions. Row 0 is all zeros
+            (no card / card without rules); the last column holds each card's
+            base (OTHER) rate for categories outside CATEGORY_CHOICES.
+        """
+        if self._matrix is None:
+            row_index = {card_id: row for row, card_id in enumerate(self.card_ids, start=1)}
+            column_index = {category: col for col, category in enumerate(CATEGORIES)}
+            matrix = np.zeros((len(self.card_ids) + 1, len(CATEGORIES) + 1), dtype=np.int64)
+            for (card_id, category), multiplier in self._rates.items():
+                matrix[row_index[card_id], column_index[category]] = int(multiplier * 100)
+            for card_id, base in self._base.items():
+                matrix[row_index[card_id], -1] = int(base * 100)
+            self._matrix = (row_index, column_index, matrix)
+        return self._matrix
+
+
+_lock = threading.Lock()
+_table = None
+_built_at = 0.0
+_generation = 0
+
+
+def _is_fresh(table, built_at):
+    """Whether a (table, built_at) snapshot of the globals can still be served."""
+    ttl = getattr(settings, "REWARD_RATE_TABLE_TTL", DEFAULT_TTL_SECONDS)
+    return table is not None and (ttl is None or time.monotonic() - built_at < ttl)
+
+
+def current_version():
+    """The RewardRateVersion in the database (0 before any rule change)."""
+    return RewardRateVersion.objects.filter(pk=1).values_list("version", flat=True).first() or 0
+
+
+def bump_version():
+    """Mark every compiled rate table (in every process) as stale."""
+    if not RewardRateVersion.objects.filter(pk=1).update(version=F("version") + 1):
+        RewardRateVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+
+
+def get_rate_table(verify=False):
+    """
+    Return the compiled rate table, building it if it is missing or expired.
+    With verify=True the table is also checked against the database version
+    (one query) and rebuilt if another process changed the rules since.
+    """
+    global _table, _built_at
+    version = current_version() if verify else None
+    # Read the globals once: another thread may publish or drop a table meanwhile
+    table, built_at = _table, _built_at
+    if _is_fresh(table, built_at) and version in (None, table.version):
+        return table
+
+    with _lock:
+        table, built_at = _table, _built_at
+        if _is_fresh(table, built_at) and version in (None, table.version):
+            return table
+        generation = _generation
+        table = RewardRateTable.build()
+        # Don't publish a table that was built while an invalidation happened
+        if generation == _generation:
+            _table = table
+            _built_at = time.monotonic()
+    return table
+
+
+def invalidate_rate_table():
+    """Drop the compiled table; the next lookup rebuilds it."""
+    global _table, _generation
+    _generation += 1
+    _table = None
@@ -0,0 +1,51 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Card, RewardRule, RewardRuleCategory
+from .rates import invalidate_rate_table, bump_version
+
+
+def invalidate_after_commit(invalidate):
+    """Invalidate now, and again once the surrounding DB transaction commits
+    (a rebuild that happens in between would otherwise see uncommitted rows)."""
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def sync_rule_categories(rule):
+    """Make the rule's RewardRuleCategory rows match rule.category (and rule.card)."""
+    categories = rule.category
+    if isinstance(categories, str):
+        categories = [cat.strip() for cat in categories.split(',')]
+    categories = list(dict.fromkeys(cat for cat in categories if cat))
+    links = RewardRuleCategory.objects.filter(rule=rule)
+    if set(links.values_list("card_id", "category")) == {(rule.card_id, cat) for cat in categories}:
+        return
+    links.delete()
+    RewardRuleCategory.objects.bulk_create([
+        RewardRuleCategory(rule=rule, card_id=rule.card_id, category=category) for category in categories
+    ])
+
+
+# Registered before reward_rules_changed, so the category rows are current
+# by the time anything rebuilds the rate table
+@receiver(post_save, sender=RewardRule)
+def reward_rule_saved(sender, instance, **kwargs):
+    """Keep the normalized (rule, category) rows in sync with the rule."""
+    sync_rule_categories(instance)
+
+
+@receiver(post_save, sender=RewardRule)
+@receiver(post_delete, sender=RewardRule)
+def reward_rule_version(sender, instance, **kwargs):
+    """Bump the rate version so other processes drop their compiled tables before writing."""
+    bump_version()
+
+
+@receiver(post_save, sender=RewardRule)
+@receiver(post_delete, sender=RewardRule)
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=Card)
+def reward_rules_changed(sender, instance, **kwargs):
+    """When a reward rule or card changes, drop the compiled rate table."""
+    invalidate_after_commit(invalidate_rate_table)
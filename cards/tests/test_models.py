@@ -3,7 +3,9 @@ from decimal import Decimal
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
-from cards.models import Card, CardBenefit, UserCard, RewardRule
+from io import StringIO
+from django.core.management import call_command
+from cards.models import Card, CardBenefit, UserCard, RewardRule, RewardRuleCategory
 
 User = get_user_model()
 
@@ -35,6 +37,11 @@ RewardRule
 - 'multiplier' and 'cap_amount' stored as Decimal.
 - 'cap_amount' and 'notes' optional (nullable/blank).
 - Cascade delete when the Card is deleted.
+
+RewardRuleCategory
+- One row per (rule, category), created and updated with the rule (including card changes).
+- Removed with the rule.
+- add_default_rewards finds existing OTHER rules through it.
 '''
 
 # ---------- Card ----------
@@ -121,5 +128,36 @@ class TestRewardRuleModel(TestCase):
         with self.assertRaises(ValidationError):
             rr.full_clean()
 
+
+# ---------- RewardRuleCategory ----------
+class TestRewardRuleCategory(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.other_card = Card.objects.create(name="Gold", issuer="AMEX", annual_fee=250)
+
+    def links(self):
+        return set(RewardRuleCategory.objects.values_list("rule_id", "card_id", "category"))
+
+    def test_kept_in_sync_with_rule(self):
+        rr = RewardRule.objects.create(card=self.card, multiplier=Decimal("3.00"), category=["DINING", "GROCERIES"])
+        self.assertEqual(self.links(), {(rr.id, self.card.id, "DINING"), (rr.id, self.card.id, "GROCERIES")})
+
+        rr.category = ["GROCERIES", "GAS"]
+        rr.card = self.other_card
+        rr.save()
+        self.assertEqual(self.links(), {(rr.id, self.other_card.id, "GROCERIES"), (rr.id, self.other_card.id, "GAS")})
+
+        rr.delete()
+        self.assertEqual(self.links(), set())
+
+    def test_add_default_rewards_skips_cards_with_other(self):
+        RewardRule.objects.create(card=self.card, multiplier=Decimal("1.50"), category=["DINING", "OTHER"])
+        call_command("add_default_rewards", stdout=StringIO())
+        self.assertEqual(RewardRule.objects.filter(card=self.card).count(), 1)
+        self.assertTrue(
+            RewardRuleCategory.objects.filter(card=self.other_card, category="OTHER").exists()
+        )
+
+
 # To run the tests:
 # python manage.py test cards.tests.test_models
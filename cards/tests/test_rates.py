@@ -0,0 +1,93 @@
+from decimal import Decimal
+from django.test import TestCase
+from cards.models import Card, RewardRule
+from cards.rates import RewardRateTable, get_rate_table
+
+'''
+Expectations
+------------
+RewardRateTable
+- Maps (card_id, category) to the best multiplier among the card's rules.
+- Falls back to the card's best OTHER multiplier when no category bonus exists.
+- Cards without rules (or unknown cards) get 0.00.
+- Rules with a comma-separated category string are split like the MultiSelectField list.
+- rule_chain lists category rules then OTHER rules, best first, up to the first uncapped rule.
+
+get_rate_table
+- Builds the table once and serves lookups without queries.
+- Rebuilds after a RewardRule or Card is saved or deleted.
+'''
+
+
+class TestRewardRateTable(TestCase):
+    def test_best_multiplier_and_other_fallback(self):
+        table = RewardRateTable([
+            (1, 1, ["DINING", "GAS"], Decimal("3.00"), None),
+            (2, 1, ["DINING"], Decimal("4.00"), None),
+            (3, 1, ["OTHER"], Decimal("1.00"), None),
+            (4, 1, ["OTHER"], Decimal("1.50"), None),
+            (5, 2, "GROCERIES, OTHER", Decimal("2.00"), None),
+        ])
+        self.assertEqual(table.multiplier(1, "DINING"), Decimal("4.00"))
+        self.assertEqual(table.multiplier(1, "GAS"), Decimal("3.00"))
+        self.assertEqual(table.multiplier(1, "RENT"), Decimal("1.50"))
+        self.assertEqual(table.multiplier(2, "GROCERIES"), Decimal("2.00"))
+        self.assertEqual(table.multiplier(2, "TRANSIT"), Decimal("2.00"))
+        self.assertEqual(table.bps(1, "DINING"), 400)
+        self.assertEqual(table.bps(1, "RENT"), 150)
+        self.assertEqual(table.bps(2, "NOT_A_CATEGORY"), 200)
+        self.assertEqual(table.bps(99, "DINING"), 0)
+
+    def test_missing_card_or_rules(self):
+        table = RewardRateTable([(1, 1, ["DINING"], Decimal("3.00"), None), (2, 2, ["GAS"], None, None)])
+        self.assertEqual(table.multiplier(1, "GAS"), Decimal("0.00"))
+        self.assertEqual(table.multiplier(2, "GAS"), Decimal("0.00"))
+        self.assertEqual(table.multiplier(99, "DINING"), Decimal("0.00"))
+        self.assertEqual(table.multiplier(None, "DINING"), Decimal("0.00"))
+
+    def test_rule_chain(self):
+        table = RewardRateTable([
+            (1, 1, ["GROCERIES"], Decimal("6.00"), Decimal("6000")),
+            (2, 1, ["GROCERIES"], Decimal("3.00"), Decimal("100")),
+            (3, 1, ["OTHER"], Decimal("1.00"), None),
+            (4, 1, ["OTHER"], Decimal("0.50"), None),
+        ])
+        self.assertEqual(
+            table.rule_chain(1, "GROCERIES"),
+            ((600, 600000, 1), (300, 10000, 2), (100, None, 3)),
+        )
+        self.assertEqual(table.rule_chain(1, "GAS"), ((100, None, 3),))
+        self.assertEqual(table.rule_chain(1, "OTHER"), ((100, None, 3),))
+        self.assertEqual(table.rule_chain(2, "GAS"), ())
+
+
+class TestGetRateTable(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.rule = RewardRule.objects.create(card=self.card, multiplier=Decimal("3.00"), category=["DINING"])
+
+    def test_lookups_do_not_query(self):
+        get_rate_table()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_rate_table().multiplier(self.card.id, "DINING"), Decimal("3.00"))
+
+    def test_rebuilds_after_rule_changes(self):
+        self.assertEqual(get_rate_table().multiplier(self.card.id, "GAS"), Decimal("0.00"))
+        other = RewardRule.objects.create(card=self.card, multiplier=Decimal("1.00"), category=["OTHER"])
+        self.assertEqual(get_rate_table().multiplier(self.card.id, "GAS"), Decimal("1.00"))
+
+        self.rule.multiplier = Decimal("5.00")
+        self.rule.save()
+        self.assertEqual(get_rate_table().multiplier(self.card.id, "DINING"), Decimal("5.00"))
+
+        other.delete()
+        self.assertEqual(get_rate_table().multiplier(self.card.id, "GAS"), Decimal("0.00"))
+
+    def test_rebuilds_after_card_delete(self):
+        card_id = self.card.id
+        self.assertEqual(get_rate_table().multiplier(card_id, "DINING"), Decimal("3.00"))
+        self.card.delete()
+        self.assertEqual(get_rate_table().multiplier(card_id, "DINING"), Decimal("0.00"))
+
+# To run the tests:
+# python manage.py test cards.tests.test_rates
@@ -1,9 +1,11 @@
 # cards/tests/test_views.py
 from decimal import Decimal
 from django.contrib.auth import get_user_model
+from django.test import override_settings
 from rest_framework.test import APITestCase
 from rest_framework import status
 from cards.models import Card, RewardRule, UserCard, CardBenefit
+from transactions.models import Transaction
 
 '''
 Expectations
@@ -32,6 +34,10 @@ UserCardViewSet
 CardBenefitViewSet (optional)
 - Authenticated users can list card benefits.
 - Anonymous users cannot access this endpoint.
+
+CardRewardsView
+- Returns this month's rewards per wallet card.
+- Same numbers whether computed in Python or pushed down to SQL (REWARDS_SQL_PUSHDOWN).
 '''
 
 User = get_user_model()
@@ -114,5 +120,33 @@ class TestRewardRulesAndUserCards(APITestCase):
         self.assertEqual(r_dup.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class TestCardRewardsView(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="a", email="a@e.com", password="pw")
+        self.card = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0, ftf=True)
+        RewardRule.objects.create(card=self.card, multiplier=Decimal("3.00"), category=["DINING"])
+        RewardRule.objects.create(card=self.card, multiplier=Decimal("1.00"), category=["OTHER"])
+        UserCard.objects.create(user=self.user, card=self.card, is_active=True)
+        for amount, category in [("10.00", "DINING"), ("0.50", "DINING"), ("20.00", "GAS")]:
+            Transaction.objects.create(
+                user=self.user, card_actually_used=self.card, merchant="M",
+                amount=Decimal(amount), category=category,
+            )
+
+    def _rewards(self):
+        self.client.force_authenticate(self.user)
+        r = self.client.get("/api/cards/rewards/")
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        return r.data['data']
+
+    def test_rewards_python_and_sql_agree(self):
+        python_result = self._rewards()
+        with override_settings(REWARDS_SQL_PUSHDOWN=True):
+            sql_result = self._rewards()
+        self.assertEqual(python_result, sql_result)
+        # 0.30 + 0.02 (0.015 rounded half-even) + 0.20
+        self.assertEqual(python_result[0]["rewards_earned"], 0.52)
+
+
 # To run the tests:
 # python manage.py test cards.tests.test_views
\ No newline at end of file
@@ -5,7 +5,9 @@ from rest_framework.response import Response
 from rest_framework import status, viewsets, permissions
 from .models import Card, RewardRule, UserCard, CardBenefit
 from .serializers import CardSerializer, RewardRuleSerializer, UserCardSerializer, CardBenefitSerializer
-from transactions.rewards import calculate_rewards_by_card
+from transactions.rewards import calculate_rewards_by_card, calculate_rewards_by_card_in_database
+from transactions.rollups import month_rewards_by_card
+from django.conf import settings
 from datetime import datetime
 
 # Create your views here.
@@ -101,7 +103,12 @@ class CardRewardsView(APIView):
         
         # Calculate rewards for current month
         month_start = datetime(now.year, now.month, 1)
-        rewards_by_card = calculate_rewards_by_card(user, start_date=month_start)
+        if getattr(settings, 'REWARDS_APPLY_CAPS', False):
+            rewards_by_card = calculate_rewards_by_card(user, start_date=month_start, apply_caps=True)
+        elif getattr(settings, 'REWARDS_SQL_PUSHDOWN', False):
+            rewards_by_card = calculate_rewards_by_card_in_database(user, start_date=month_start)
+        else:
+            rewards_by_card = month_rewards_by_card(user, now.strftime('%Y-%m'))
         
         # Format response with card details
         user_cards = UserCard.objects.filter(user=user).select_related('card')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class OptimizerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'optimizer'
+
+    def ready(self):
+        """Import signals when app is ready to avoid circular imports."""
+        import optimizer.signals
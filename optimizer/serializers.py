@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
+from cards.models import Card, RewardRule
 from .models import UserCategorySelection
 
 class UserCategorySelectionSerializer(serializers.ModelSerializer):
@@ -15,3 +16,38 @@ class UserCategorySelectionSerializer(serializers.ModelSerializer):
                 message="You have already selected this category.",
             )
         ]
+
+
+class WalletSimulationSerializer(serializers.Serializer):
+    """Candidate wallets for POST /api/optimizer/simulate-wallets/."""
+    MAX_WALLETS = 1000
+
+    wallets = serializers.ListField(
+        child=serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False),
+        allow_empty=False,
+        max_length=MAX_WALLETS,
+    )
+
+    def validate_wallets(self, value):
+        card_ids = {card_id for wallet in value for card_id in wallet}
+        known = set(Card.objects.filter(id__in=card_ids).values_list("id", flat=True))
+        unknown = sorted(card_ids - known)
+        if unknown:
+            raise serializers.ValidationError(f"Unknown card id(s): {', '.join(map(str, unknown))}")
+        return value
+
+
+class BestWalletQuerySerializer(serializers.Serializer):
+    """Query params for GET /api/optimizer/best-wallet/."""
+    k = serializers.IntegerField(min_value=1, max_value=10, default=3)
+
+
+class NotOwnedQuerySerializer(serializers.Serializer):
+    """Query params for GET /api/optimizer/best-cards-not-owned/."""
+    category = serializers.ChoiceField(choices=RewardRule.CATEGORY_CHOICES)
+    limit = serializers.IntegerField(min_value=1, max_value=10, default=3)
+
+
+class MarginalValueQuerySerializer(serializers.Serializer):
+    """Query params for GET /api/optimizer/card-marginal-values/."""
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
@@ -1,5 +1,18 @@
+from datetime import timedelta
 from decimal import Decimal
-from cards.models import RewardRule, UserCard, Card
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+from django.db.models.functions import ExtractYear
+from budgets.services import get_user_timezone
+from cards.models import RewardRule, RewardRuleCategory, Card
+from cards.rates import get_rate_table
+from transactions.models import Transaction
+from transactions.cap_usage import cap_usage
+from transactions.cents import cents_to_decimal, round_half_even, round_half_even_array, to_cents
+from transactions.rewards import CapLedger
 
 
 # Most of code logic are generated by AI, but with human fix the code and correct logic.
@@ -10,13 +23,15 @@ SELECTED = "SELECTED_CATEGORIES"
 BASE_ANYWHERE = "OTHER"
 BIG = Decimal("1000000000")  # treat None cap as "very large"
 
+def _rank_key(item):
+    # Sort by: higher multiplier → higher cap → lower annual fee → issuer/name (with reverse=True)
+    card, multiplier, cap = item[:3]
+    return (multiplier, cap, -float(card.annual_fee or 0), card.issuer, card.name)
+
+
 def _rank(items):
     # items: list of (card, multiplier_float, cap_or_BIG)
-    # Sort by: higher multiplier → higher cap → lower annual fee → issuer/name
-    items.sort(
-        key=lambda t: (t[1], t[2], -float(t[0].annual_fee or 0), t[0].issuer, t[0].name),
-        reverse=True,
-    )
+    items.sort(key=_rank_key, reverse=True)
 
     # Best card = first after sort
     best_card, best_mult, _ = items[0]
@@ -37,12 +52,49 @@ def _rank(items):
     return best_card, best_mult, top3
 
 
-def best_cards_for_category(category_tag: str, user) -> dict:
-    # 0) user's active cards
-    my_card_ids = list(
-        UserCard.objects.filter(user=user, is_active=True).values_list("card_id", flat=True)
+CATEGORY_TAGS = [choice[0] for choice in RewardRule.CATEGORY_CHOICES]
+CACHE_KEY = "optimizer:best-cards:{user_id}"
+# Safety net for multi-process deployments (signals only clear the local cache)
+DEFAULT_CACHE_TTL = 300
+
+
+def _wallet_snapshot(user):
+    """
+    The user's active cards and their reward rules, in two queries.
+    Rules that include SELECTED_CATEGORIES are left out, as in the recommendations.
+
+    Returns:
+        (cards, rules): {card_id: Card} and a list of
+        (card, multiplier_float, cap_or_BIG, categories, rule_id) in rule id order
+    """
+    cards = {
+        card.id: card
+        for card in Card.objects.filter(user_cards__user=user, user_cards__is_active=True)
+    }
+    # Categories come from the normalized (rule, category) rows, one query for all rules
+    by_rule = {}
+    links = (
+        RewardRuleCategory.objects
+        .filter(card_id__in=list(cards))
+        .select_related("rule")
+        .order_by("rule_id", "id")
     )
-    if not my_card_ids:
+    for link in links:
+        by_rule.setdefault(link.rule_id, (link.rule, []))[1].append(link.category)
+
+    rules = []
+    for r, categories in by_rule.values():
+        if SELECTED in categories:
+            continue
+        cap = r.cap_amount if r.cap_amount is not None else BIG
+        rules.append((cards[r.card_id], float(r.multiplier or 0), cap, categories, r.id))
+    return cards, rules
+
+
+def _recommend(category_tag, cards, rules):
+    """Best card for a category from a wallet snapshot (see _wallet_snapshot)."""
+    # 0) user's active cards
+    if not cards:
         return {
             "best_card": None,
             "multiplier": 1.0,
@@ -51,17 +103,7 @@ def best_cards_for_category(category_tag: str, user) -> dict:
         }
 
     # 1) exact category among user's cards
-    qs = (
-        RewardRule.objects
-        .exclude(category__contains=SELECTED)
-        .filter(category__contains=category_tag, card_id__in=my_card_ids)
-        .select_related("card")
-    )
-    primary = []
-    for r in qs:
-        m = float(r.multiplier or 0)
-        cap = r.cap_amount if r.cap_amount is not None else BIG
-        primary.append((r.card, m, cap))
+    primary = [(c, m, cap) for (c, m, cap, categories, _rule_id) in rules if category_tag in categories]
 
     if primary:
         best_card, best_mult, top3 = _rank(primary)
@@ -73,19 +115,11 @@ def best_cards_for_category(category_tag: str, user) -> dict:
         }
 
     # 2) fallback: use only each card's base/anywhere rate (OTHER)
-    alt_qs = (
-        RewardRule.objects
-        .exclude(category__contains=SELECTED)
-        .filter(card_id__in=my_card_ids, category__contains=BASE_ANYWHERE)
-        .select_related("card")
-    )
-
     # pick the best OTHER rule per card (dedupe by card)
     by_card = {}
-    for r in alt_qs:
-        c = r.card
-        m = float(r.multiplier or 0)
-        cap = r.cap_amount if r.cap_amount is not None else BIG
+    for (c, m, cap, categories, _rule_id) in rules:
+        if BASE_ANYWHERE not in categories:
+            continue
         cur = by_card.get(c.id)
         if cur is None or (m, cap) > (cur[1], cur[2]):
             by_card[c.id] = (c, m, cap)
@@ -104,18 +138,496 @@ def best_cards_for_category(category_tag: str, user) -> dict:
         }
 
     # 3) final fallback: baseline 1.0× on lowest-AF card
-    any_card = (
-        Card.objects.filter(id__in=my_card_ids).order_by("annual_fee", "issuer", "name").first()
-    )
+    any_card = min(cards.values(), key=lambda c: (c.annual_fee, c.issuer, c.name))
     return {
-        "best_card": (
-            {"card_id": any_card.id, "card_name": f"{any_card.issuer} {any_card.name}"}
-            if any_card else None
-        ),
+        "best_card": {"card_id": any_card.id, "card_name": f"{any_card.issuer} {any_card.name}"},
         "multiplier": 1.0,
         "rationale": (
             f"No base (OTHER) rates found for your cards. Showing baseline 1.0×"
-            f"{' on ' + any_card.name if any_card else ''}."
+            f" on {any_card.name}."
         ),
         "top3": [],
     }
+
+
+def _cached_wallet(user):
+    """
+    Per-user cache entry: the wallet snapshot plus the recommendation for every
+    category in CATEGORY_CHOICES. Built with two queries on a miss; cleared by
+    optimizer/signals.py when the user's cards or their reward rules change.
+    """
+    key = CACHE_KEY.format(user_id=user.pk)
+    entry = cache.get(key)
+    if entry is None:
+        cards, rules = _wallet_snapshot(user)
+        entry = {
+            "wallet": (cards, rules),
+            "by_category": {tag: _recommend(tag, cards, rules) for tag in CATEGORY_TAGS},
+        }
+        cache.set(key, entry, getattr(settings, "BEST_CARDS_CACHE_TTL", DEFAULT_CACHE_TTL))
+    return entry
+
+
+def invalidate_best_cards(user_ids):
+    """Drop the cached recommendations of these users."""
+    cache.delete_many([CACHE_KEY.format(user_id=user_id) for user_id in set(user_ids)])
+
+
+CATALOG_CACHE_KEY = "optimizer:catalog-top"
+# Cards kept per category; requests that filter out more owned cards than this re-rank in full
+DEFAULT_CATALOG_TOP_K = 25
+
+
+def _catalog_rates():
+    """
+    Every catalog card's rate per category, in one query: the best rule for the
+    category, else the card's best OTHER rule (SELECTED rules left out, as in the
+    wallet recommendations).
+
+    Returns:
+        {category_tag: [(card, multiplier_float, cap_or_BIG), ...]} for every tag
+        in CATEGORY_CHOICES; cards without any usable rule are left out
+    """
+    links = RewardRuleCategory.objects.select_related("rule", "card").order_by("rule_id", "id")
+    by_rule = {}
+    for link in links:
+        by_rule.setdefault(link.rule_id, (link.rule, link.card, []))[2].append(link.category)
+
+    best = {}  # (card_id, category) → (card, multiplier, cap)
+    for rule, card, categories in by_rule.values():
+        if SELECTED in categories:
+            continue
+        item = (card, float(rule.multiplier or 0), rule.cap_amount if rule.cap_amount is not None else BIG)
+        for category in categories:
+            current = best.get((card.id, category))
+            if current is None or item[1:] > current[1:]:
+                best[(card.id, category)] = item
+
+    cards = {card.id: card for card, _m, _cap in best.values()}
+    rates = {}
+    for tag in CATEGORY_TAGS:
+        items = []
+        for card_id in cards:
+            item = best.get((card_id, tag)) or best.get((card_id, BASE_ANYWHERE))
+            if item is not None:
+                items.append(item)
+        rates[tag] = items
+    return rates
+
+
+def _catalog_entry(card, multiplier, cap):
+    return {
+        "card_id": card.id,
+        "card_name": f"{card.issuer} {card.name}",
+        "multiplier": multiplier,
+        "cap_amount": None if cap is BIG else float(cap),
+        "annual_fee": float(card.annual_fee or 0),
+    }
+
+
+def catalog_top_cards():
+    """
+    Precomputed top-K catalog ranking per category, in the _rank tie-break order.
+    Built with one query and cached until a card or reward rule changes
+    (optimizer/signals.py) or the TTL runs out.
+
+    Returns:
+        {category_tag: {"cards": [entry, ...], "complete": bool}}, where complete
+        means every ranked catalog card fits in the list
+    """
+    ranking = cache.get(CATALOG_CACHE_KEY)
+    if ranking is None:
+        top_k = getattr(settings, "CATALOG_TOP_K", DEFAULT_CATALOG_TOP_K)
+        ranking = {}
+        for tag, items in _catalog_rates().items():
+            items.sort(key=_rank_key, reverse=True)
+            ranking[tag] = {
+                "cards": [_catalog_entry(*item) for item in items[:top_k]],
+                "complete": len(items) <= top_k,
+            }
+        cache.set(CATALOG_CACHE_KEY, ranking, getattr(settings, "BEST_CARDS_CACHE_TTL", DEFAULT_CACHE_TTL))
+    return ranking
+
+
+def invalidate_catalog_top_cards():
+    """Drop the precomputed catalog ranking; the next lookup rebuilds it."""
+    cache.delete(CATALOG_CACHE_KEY)
+
+
+def best_cards_not_owned(category_tag: str, user, limit=3) -> list:
+    """
+    Best catalog cards for a category that aren't in the user's active wallet,
+    best first. Filters the precomputed top-K list; only re-ranks the whole
+    catalog for the tag if the user owns so many of its top cards that fewer
+    than limit are left.
+    """
+    cards, _rules = _cached_wallet(user)["wallet"]
+    ranking = catalog_top_cards().get(category_tag)
+    if ranking is None:
+        # Tags outside CATEGORY_CHOICES earn each card's base (OTHER) rate
+        ranking = catalog_top_cards()[BASE_ANYWHERE]
+    picks = [entry for entry in ranking["cards"] if entry["card_id"] not in cards]
+    if len(picks) < limit and not ranking["complete"]:
+        tag = category_tag if category_tag in CATEGORY_TAGS else BASE_ANYWHERE
+        items = sorted(_catalog_rates()[tag], key=_rank_key, reverse=True)
+        picks = [_catalog_entry(*item) for item in items if item[0].id not in cards]
+    return picks[:limit]
+
+
+def best_cards_for_category(category_tag: str, user) -> dict:
+    return best_cards_for_categories([category_tag], user)[category_tag]
+
+
+def best_cards_for_categories(category_tags, user) -> dict:
+    """
+    best_cards_for_category for many tags at once: {tag: recommendation}.
+    Every tag is ranked in memory from the same wallet snapshot, so the query
+    count doesn't depend on the number of tags (0 when cached, 2 otherwise).
+    """
+    entry = _cached_wallet(user)
+    results = {}
+    for tag in category_tags:
+        if tag in entry["by_category"]:
+            results[tag] = entry["by_category"][tag]
+        else:
+            # Tags outside CATEGORY_CHOICES: computed from the cached wallet snapshot
+            results[tag] = _recommend(tag, *entry["wallet"])
+    return results
+
+
+def best_cards_for_purchases(purchases, user) -> list:
+    """
+    Amount-aware recommendations for (category_tag, amount) purchases.
+    Each wallet card is scored by what the purchase would actually earn on it:
+    bonus rates only apply to the cap headroom left this year (RewardCapUsage
+    counters), the rest earns the next rule's rate, as in CapLedger. Cards are
+    ranked by that blended effective rate; "multiplier" is the blended rate and
+    "estimated_reward" the reward in dollars.
+
+    Purchases are charged in order against a scratch copy of the counters, so in
+    a basket of line items later items only see the headroom earlier items left
+    on their recommended card. Purchases without a positive amount get the plain
+    best_cards_for_categories recommendation. Adds one counter query per call to
+    the cached wallet lookup.
+    """
+    entry = _cached_wallet(user)
+    cards, rules = entry["wallet"]
+    ledger = None
+    results = []
+    for tag, amount in purchases:
+        cents = to_cents(Decimal(amount)) if amount else 0
+        recommendation = None
+        if cents > 0 and rules:
+            if ledger is None:
+                year = timezone.now().astimezone(get_user_timezone(user)).year
+                ledger = _headroom_ledger(user, year, rules)
+            recommendation = _recommend_purchase(tag, cents, cards, rules, ledger, year)
+            if recommendation is not None:
+                ledger.charge(recommendation["best_card"]["card_id"], tag, cents, year,
+                              rule_ids={rule[4] for rule in rules})
+        if recommendation is None:
+            recommendation = best_cards_for_categories([tag], user)[tag]
+        results.append(recommendation)
+    return results
+
+
+def _headroom_ledger(user, year, rules):
+    """CapLedger seeded with the user's cap usage counters for the year."""
+    ledger = CapLedger(get_rate_table())
+    card_by_rule = {rule_id: card.id for (card, _m, _cap, _categories, rule_id) in rules}
+    for rule_id, used_cents in cap_usage(user, year, set(card_by_rule.values())).items():
+        if rule_id in card_by_rule:
+            ledger.used[(card_by_rule[rule_id], rule_id, year)] = used_cents
+    return ledger
+
+
+def _recommend_purchase(category_tag, cents, cards, rules, ledger, year):
+    """Best wallet card for one purchase by blended effective rate (None if nothing earns)."""
+    rule_ids = {rule[4] for rule in rules}
+    scored = {}
+    for card in cards.values():
+        units = ledger.quote(card.id, category_tag, cents, year, rule_ids=rule_ids)
+        if units:
+            # Blended multiplier: reward ÷ amount × 100 (units are cents × bps)
+            scored[card.id] = (card, units / cents / 100, units)
+    if not scored:
+        return None
+
+    # Cap headroom left on the best rule breaks ties between equal effective rates
+    items = [(card, rate, _headroom(ledger, card.id, category_tag, year, rule_ids))
+             for card, rate, _units in scored.values()]
+    best_card, best_rate, top3 = _rank(items)
+    units = scored[best_card.id][2]
+    for alternative in top3:
+        alternative["multiplier"] = round(alternative["multiplier"], 2)
+    best_rate = round(best_rate, 2)
+    estimated = cents_to_decimal(round_half_even(units, 10000))
+    top_bps = next(
+        (bps for bps, _cap, rule_id in ledger.table.rule_chain(best_card.id, category_tag) if rule_id in rule_ids),
+        0,
+    )
+    rationale = f"{best_rate}× effective on ${cents_to_decimal(cents)} of {category_tag} (from your wallet)."
+    if units < cents * top_bps:
+        rationale += f" Bonus cap nearly used up: only part of it earns {top_bps / 100}×."
+    return {
+        "best_card": {"card_id": best_card.id, "card_name": f"{best_card.issuer} {best_card.name}"},
+        "multiplier": best_rate,
+        "rationale": rationale,
+        "top3": top3,
+        "estimated_reward": float(estimated),
+    }
+
+
+def _headroom(ledger, card_id, category_tag, year, rule_ids):
+    """Cap headroom left on the card's first rule for the category, in cents (BIG if uncapped)."""
+    for _bps, cap_cents, rule_id in ledger.table.rule_chain(card_id, category_tag):
+        if rule_id in rule_ids:
+            if cap_cents is None:
+                return BIG
+            return max(cap_cents - ledger.used.get((card_id, rule_id, year), 0), 0)
+    return 0
+
+
+def category_spend_matrix(user, table=None):
+    """
+    Replay input for wallet simulations: the user's whole transaction history
+    summed per (year, category), in cents. One grouped query.
+
+    Returns:
+        (years, matrix) where matrix rows follow `years` and columns follow the
+        rate table's bps_matrix() columns (last column: categories outside
+        CATEGORY_CHOICES, earning each card's base rate).
+    """
+    table = table or get_rate_table()
+    _row_index, column_index, rates = table.bps_matrix()
+
+    totals = list(
+        Transaction.objects
+        .filter(user=user)
+        .annotate(year=ExtractYear("created_at", tzinfo=get_user_timezone(user)))
+        .values_list("year", "category")
+        .annotate(total=Sum("amount"))
+        .order_by()
+    )
+    years = sorted({year for year, _category, _total in totals})
+    year_index = {year: row for row, year in enumerate(years)}
+
+    matrix = np.zeros((len(years), rates.shape[1]), dtype=np.int64)
+    for year, category, total in totals:
+        col = column_index.get(category, rates.shape[1] - 1)
+        matrix[year_index[year], col] += int(total * 100)
+    return years, matrix
+
+
+def simulate_wallets(user, wallets, table=None):
+    """
+    "What if I had held these cards": replay the user's history against each
+    candidate wallet, assuming every purchase went on the wallet's best card for
+    its category. Spend is bucketed once (category_spend_matrix) and all wallets
+    are scored together as matrix operations. Bonus caps are not applied.
+
+    Args:
+        user: User whose transactions are replayed
+        wallets: list of card id lists (catalog cards, not necessarily owned)
+
+    Returns:
+        list of dicts (one per wallet, same order) with card_ids, annual_fee,
+        total_rewards, total_net and a per-year breakdown of spend, rewards,
+        annual fee and net (rewards - annual fees)
+    """
+    table = table or get_rate_table()
+    row_index, _column_index, rates = table.bps_matrix()
+    years, spend = category_spend_matrix(user, table)
+
+    wallets = [list(dict.fromkeys(wallet)) for wallet in wallets]
+    fees = dict(
+        Card.objects
+        .filter(id__in={card_id for wallet in wallets for card_id in wallet})
+        .values_list("id", "annual_fee")
+    )
+
+    # Wallet rows padded with row 0 (all zeros), so max() over a wallet is its best rate per column
+    rows = np.zeros((len(wallets), max((len(wallet) for wallet in wallets), default=0) or 1), dtype=np.int64)
+    for i, wallet in enumerate(wallets):
+        rows[i, :len(wallet)] = [row_index.get(card_id, 0) for card_id in wallet]
+    wallet_rates = rates[rows].max(axis=1)                      # (wallets, columns) in bps
+    reward_cents = round_half_even_array(spend @ wallet_rates.T, 10000)  # (years, wallets)
+    spend_cents = spend.sum(axis=1)
+
+    results = []
+    for i, wallet in enumerate(wallets):
+        fee = sum((fees.get(card_id) or Decimal("0") for card_id in wallet), Decimal("0"))
+        breakdown = []
+        for row, year in enumerate(years):
+            rewards = cents_to_decimal(reward_cents[row, i])
+            breakdown.append({
+                "year": year,
+                "spend": cents_to_decimal(spend_cents[row]),
+                "rewards": rewards,
+                "annual_fee": fee,
+                "net": rewards - fee,
+            })
+        total_rewards = sum((item["rewards"] for item in breakdown), Decimal("0.00"))
+        results.append({
+            "card_ids": wallet,
+            "annual_fee": fee,
+            "total_rewards": total_rewards,
+            "total_net": total_rewards - fee * len(years),
+            "years": breakdown,
+        })
+    return results
+
+
+def trailing_category_spend(user, days=365, table=None):
+    """
+    The user's spend per category over the last `days` days, in cents, as a
+    vector over the rate table's bps_matrix() columns. One grouped query.
+    """
+    table = table or get_rate_table()
+    _row_index, column_index, rates = table.bps_matrix()
+    totals = (
+        Transaction.objects
+        .filter(user=user, created_at__gte=timezone.now() - timedelta(days=days))
+        .values_list("category")
+        .annotate(total=Sum("amount"))
+        .order_by()
+    )
+    spend = np.zeros(rates.shape[1], dtype=np.int64)
+    for category, total in totals:
+        spend[column_index.get(category, rates.shape[1] - 1)] += int(total * 100)
+    return spend
+
+
+def card_marginal_values(user, table=None):
+    """
+    Extra annual rewards each catalog card would add to the user's active wallet
+    for their trailing 12-month category spend, scored in one vectorized pass:
+    (max(wallet rate, card rate) - wallet rate) · spend, for every card at once.
+
+    Returns:
+        list of dicts (card_id, card_name, annual_fee, extra_rewards, net), best
+        net first, for catalog cards not in the wallet; money values are Decimal
+        dollars per year and net = extra_rewards - annual_fee
+    """
+    table = table or get_rate_table()
+    row_index, _column_index, rates = table.bps_matrix()
+    spend = trailing_category_spend(user, table=table)
+    owned, _rules = _cached_wallet(user)["wallet"]
+
+    # Row 0 (all zeros) keeps the max defined for an empty wallet
+    current = rates[[0] + [row_index[card_id] for card_id in owned if card_id in row_index]].max(axis=0)
+    candidates = [card_id for card_id in table.card_ids if card_id not in owned]
+    if not candidates:
+        return []
+    card_rates = rates[[row_index[card_id] for card_id in candidates]]
+    # Units: cents × basis points, rounded to cents once per card
+    extra = round_half_even_array((np.maximum(card_rates, current) - current) @ spend, 10000)
+
+    cards = Card.objects.in_bulk(candidates)
+    results = []
+    for card_id, cents in zip(candidates, extra):
+        card = cards.get(card_id)
+        if card is None:
+            continue
+        extra_rewards = cents_to_decimal(cents)
+        results.append({
+            "card_id": card_id,
+            "card_name": f"{card.issuer} {card.name}",
+            "annual_fee": card.annual_fee,
+            "extra_rewards": extra_rewards,
+            "net": extra_rewards - card.annual_fee,
+        })
+    results.sort(key=lambda result: (-result["net"], -result["extra_rewards"], result["card_id"]))
+    return results
+
+
+def best_wallet(user, k, table=None, max_nodes=100000):
+    """
+    Pick the wallet of at most k catalog cards that maximizes expected annual
+    rewards minus annual fees for the user's trailing 12-month category spend.
+
+    Branch-and-bound over the card×category rate matrix. Wallet value is
+    spend · (best rate per category) - fees, which is submodular, so a wallet
+    extended by r more cards is worth at most its value plus the r largest
+    marginal gains; branches whose bound can't beat the best wallet so far are
+    cut. Cards that lose money even on an empty wallet are dropped up front
+    (their gain only shrinks as cards are added).
+
+    Returns:
+        dict with card_ids, expected_rewards, annual_fees, net (all Decimal,
+        dollars per year), assignments ({category: card_id} for categories with
+        spend) and optimal (False if the search stopped at max_nodes)
+    """
+    table = table or get_rate_table()
+    row_index, column_index, rates = table.bps_matrix()
+    spend = trailing_category_spend(user, table=table)
+
+    card_ids = np.array(table.card_ids, dtype=np.int64)
+    fees = dict(Card.objects.filter(id__in=table.card_ids).values_list("id", "annual_fee"))
+    # Value unit: cents × basis points (spend_cents · bps), fees converted to match
+    fee_units = np.array([int((fees.get(card_id) or 0) * 100) * 10000 for card_id in card_ids], dtype=np.int64)
+    card_rates = rates[[row_index[card_id] for card_id in card_ids]] if len(card_ids) else rates[:0]
+
+    def gains(current, candidates):
+        return (np.maximum(card_rates[candidates], current) - current) @ spend - fee_units[candidates]
+
+    empty = np.zeros(rates.shape[1], dtype=np.int64)
+    first_gain = gains(empty, np.arange(len(card_ids)))
+    # Most promising cards first; ties → lower fee → lower id
+    order = sorted(np.flatnonzero(first_gain > 0), key=lambda i: (-first_gain[i], fee_units[i], card_ids[i]))
+    candidates = np.array(order, dtype=np.int64)
+
+    # Greedy wallet as the starting incumbent
+    best_value, best_set, current = 0, [], empty
+    for _ in range(min(k, len(candidates))):
+        remaining = np.array([i for i in candidates if i not in best_set], dtype=np.int64)
+        step = gains(current, remaining)
+        if not len(step) or step.max() <= 0:
+            break
+        pick = remaining[int(step.argmax())]
+        best_set.append(pick)
+        best_value += int(step.max())
+        current = np.maximum(current, card_rates[pick])
+
+    nodes = 0
+    stack = [(0, [], empty, 0)]  # (next candidate position, chosen, best rates, value)
+    while stack:
+        nodes += 1
+        if nodes > max_nodes:
+            break
+        position, chosen, current, value = stack.pop()
+        if value > best_value:
+            best_value, best_set = value, chosen
+        slots = k - len(chosen)
+        rest = candidates[position:]
+        if not slots or not len(rest):
+            continue
+        step = gains(current, rest)
+        top = np.sort(step[step > 0])[::-1][:slots]
+        if value + int(top.sum()) <= best_value:
+            continue
+        # Exclude branch first on the stack, so the include branch is explored first
+        stack.append((position + 1, chosen, current, value))
+        if step[0] > 0:
+            card = rest[0]
+            stack.append((position + 1, chosen + [card], np.maximum(current, card_rates[card]), value + int(step[0])))
+
+    best_set = sorted(best_set, key=lambda i: card_ids[i])
+    wallet_rates = card_rates[best_set].max(axis=0) if best_set else empty
+    columns = {col: category for category, col in column_index.items()}
+    assignments = {}
+    for col in np.flatnonzero(spend):
+        if col in columns and best_set and wallet_rates[col] > 0:
+            best = best_set[int(card_rates[best_set, col].argmax())]
+            assignments[columns[col]] = int(card_ids[best])
+
+    fee_total = sum((fees.get(int(card_ids[i])) or Decimal("0") for i in best_set), Decimal("0"))
+    rewards = cents_to_decimal(round_half_even(int(spend @ wallet_rates), 10000))
+    return {
+        "card_ids": [int(card_ids[i]) for i in best_set],
+        "expected_rewards": rewards,
+        "annual_fees": fee_total,
+        "net": rewards - fee_total,
+        "assignments": assignments,
+        "optimal": nodes <= max_nodes,
+    }
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from cards.models import Card, RewardRule, UserCard
+from cards.signals import invalidate_after_commit
+from .services import invalidate_best_cards, invalidate_catalog_top_cards
+
+
+@receiver(post_save, sender=UserCard)
+@receiver(post_delete, sender=UserCard)
+def user_card_changed(sender, instance, **kwargs):
+    """When a card is added to, changed in or removed from a wallet, drop that user's recommendations."""
+    user_ids = [instance.user_id]
+    invalidate_after_commit(lambda: invalidate_best_cards(user_ids))
+
+
+@receiver(post_save, sender=RewardRule)
+@receiver(post_delete, sender=RewardRule)
+@receiver(post_save, sender=Card)
+def card_rules_changed(sender, instance, **kwargs):
+    """When a card or one of its reward rules changes, drop the recommendations of everyone holding it."""
+    card_id = instance.id if sender is Card else instance.card_id
+    user_ids = list(UserCard.objects.filter(card_id=card_id).values_list("user_id", flat=True))
+    if user_ids:
+        invalidate_after_commit(lambda: invalidate_best_cards(user_ids))
+
+
+@receiver(post_save, sender=RewardRule)
+@receiver(post_delete, sender=RewardRule)
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=Card)
+def catalog_changed(sender, instance, **kwargs):
+    """When any card or reward rule changes, drop the precomputed catalog ranking."""
+    invalidate_after_commit(invalidate_catalog_top_cards)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_created(sender, instance, created, **kwargs):
+    """New users start without a cache entry (ids can be reused after a delete)."""
+    if created:
+        invalidate_best_cards([instance.pk])
@@ -0,0 +1,385 @@
+import random
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from itertools import combinations
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from cards.models import Card, RewardRule, UserCard
+from cards.rates import get_rate_table
+from transactions.models import Transaction
+from optimizer.services import (
+    category_spend_matrix, simulate_wallets, best_wallet, best_cards_for_category, best_cards_for_purchases,
+    catalog_top_cards, best_cards_not_owned, invalidate_catalog_top_cards, card_marginal_values,
+)
+
+'''
+Expectations
+------------
+best_cards_for_category
+- Best active wallet card for the category; ties (same multiplier) listed in top3.
+- Falls back to the best OTHER rate, then to the lowest-fee card at 1.0×, then to no card.
+- Rules that include SELECTED_CATEGORIES are ignored.
+- All categories are computed and cached per user at once (two queries); lookups take no queries.
+- The cache is cleared when the user's UserCards, or a Card / RewardRule they hold, change.
+
+best_cards_for_purchases
+- Ranks wallet cards by the blended rate a purchase earns given the cap headroom
+  left this year (RewardCapUsage counters); SELECTED rules are still ignored.
+- Purchases are charged in order: later items only see the headroom earlier items left.
+- Purchases without a positive amount get the best_cards_for_category result.
+
+catalog_top_cards / best_cards_not_owned
+- Top-K catalog cards per category in the _rank order (multiplier, cap, fee, issuer, name),
+  using each card's OTHER rate where it has no bonus for the category.
+- Built with one query and cached until a card or reward rule changes.
+- Cards in the user's active wallet are filtered out; the full catalog is only
+  re-ranked if too few cards are left in the top-K list.
+
+card_marginal_values
+- Extra yearly rewards of adding each catalog card to the active wallet, for the last
+  12 months of spend, scored for all cards at once; same as simulating wallet + card.
+- Owned cards are left out; results are sorted by rewards minus annual fee.
+
+category_spend_matrix
+- One grouped query: spend in cents per (year, category) over the user's whole history.
+- Columns follow the rate table's bps_matrix(); unknown categories go to the last column.
+
+simulate_wallets
+- Scores every wallet against the same spend matrix.
+- Each purchase earns the best rate in the wallet for its category (OTHER fallback included).
+- Yearly net = rewards - sum of the wallet's annual fees; duplicate card ids count once.
+- Cards without reward rules earn nothing but still charge their fee.
+
+best_wallet
+- Uses the last 12 months of spend.
+- Returns the at-most-k card wallet with the highest rewards - fees (same as brute force).
+- Cards that can't pay for their own fee are never picked; an empty wallet is a valid answer.
+- assignments maps each category with spend to the wallet card that earns the most on it.
+'''
+
+User = get_user_model()
+
+
+class TestWalletSimulation(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="u1", email="u1@example.com", password="pw")
+        self.freedom = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.gold = Card.objects.create(name="Gold", issuer="AMEX", annual_fee=250)
+        self.bare = Card.objects.create(name="Bare", issuer="CITI", annual_fee=95)
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("3.00"), category=["DINING"])
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("1.50"), category=["OTHER"])
+        RewardRule.objects.create(card=self.gold, multiplier=Decimal("4.00"), category=["DINING", "GROCERIES"])
+        RewardRule.objects.create(card=self.gold, multiplier=Decimal("1.00"), category=["OTHER"])
+
+        self._tx("1000.00", "DINING", 2024)
+        self._tx("2000.00", "GROCERIES", 2024)
+        self._tx("500.00", "GAS", 2025)
+
+    def _tx(self, amount, category, year):
+        tx = Transaction.objects.create(user=self.user, merchant="Store", amount=Decimal(amount), category=category)
+        tx.created_at = datetime(year, 6, 1, tzinfo=dt_timezone.utc)
+        tx.save(update_fields=["created_at"])
+
+    def test_spend_matrix(self):
+        get_rate_table()  # built once per process, not per call
+        with self.assertNumQueries(1):  # one grouped query
+            years, matrix = category_spend_matrix(self.user)
+        self.assertEqual(years, [2024, 2025])
+        self.assertEqual(matrix.sum(), 350000)
+        self.assertEqual(list(matrix.sum(axis=1)), [300000, 50000])
+
+    def test_scores_wallets(self):
+        solo, both, bare = simulate_wallets(
+            self.user, [[self.freedom.id], [self.freedom.id, self.gold.id, self.gold.id], [self.bare.id]]
+        )
+
+        # Freedom alone: 3% dining, 1.5% everything else
+        self.assertEqual([y["rewards"] for y in solo["years"]], [Decimal("60.00"), Decimal("7.50")])
+        self.assertEqual(solo["total_net"], Decimal("67.50"))
+
+        # Freedom + Gold: 4% dining and groceries, 1.5% gas; $250 fee each year
+        self.assertEqual(both["card_ids"], [self.freedom.id, self.gold.id])
+        self.assertEqual([y["rewards"] for y in both["years"]], [Decimal("120.00"), Decimal("7.50")])
+        self.assertEqual([y["net"] for y in both["years"]], [Decimal("-130.00"), Decimal("-242.50")])
+        self.assertEqual(both["total_net"], Decimal("127.50") - 500)
+
+        self.assertEqual(bare["total_rewards"], Decimal("0.00"))
+        self.assertEqual(bare["total_net"], Decimal("-190"))
+
+    def test_no_history(self):
+        Transaction.objects.all().delete()
+        result, = simulate_wallets(self.user, [[self.gold.id]])
+        self.assertEqual(result["years"], [])
+        self.assertEqual(result["total_net"], Decimal("0"))
+
+
+class TestBestWallet(TestCase):
+    CATEGORIES = ["DINING", "GROCERIES", "GAS", "GENERAL_TRAVEL", "ENTERTAINMENT", "OTHER"]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="u1", email="u1@example.com", password="pw")
+
+    def _tx(self, amount, category, created_at=None):
+        tx = Transaction.objects.create(user=self.user, merchant="Store", amount=Decimal(amount), category=category)
+        if created_at:
+            tx.created_at = created_at
+            tx.save(update_fields=["created_at"])
+
+    def _card(self, name, fee, rates):
+        card = Card.objects.create(name=name, issuer="OTHER", annual_fee=fee)
+        for category, multiplier in rates.items():
+            RewardRule.objects.create(card=card, multiplier=Decimal(multiplier), category=[category])
+        return card
+
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        cards = {}
+        for i in range(12):
+            rates = {category: rng.choice(["1.00", "1.50", "2.00", "3.00", "5.00"]) for category in rng.sample(self.CATEGORIES, 3)}
+            card = self._card(f"Card {i}", rng.choice([0, 95, 250, 550]), rates)
+            cards[card.id] = (card.annual_fee, rates)
+        for category in self.CATEGORIES:
+            self._tx(str(rng.randint(500, 9000)), category)
+
+        spend = {category: Decimal(amount) for category, amount in
+                 Transaction.objects.values_list("category", "amount")}
+
+        def net(wallet):
+            rewards = Decimal("0")
+            for category, amount in spend.items():
+                best = Decimal("0")
+                for card_id in wallet:
+                    rates = cards[card_id][1]
+                    best = max(best, Decimal(rates.get(category) or rates.get("OTHER") or "0"))
+                rewards += amount * best / 100
+            return rewards - sum((cards[card_id][0] for card_id in wallet), Decimal("0"))
+
+        for k in (1, 2, 3):
+            brute = max(
+                (net(wallet) for size in range(k + 1) for wallet in combinations(cards, size)),
+            )
+            result = best_wallet(self.user, k)
+            self.assertTrue(result["optimal"])
+            self.assertLessEqual(len(result["card_ids"]), k)
+            self.assertEqual(result["net"], brute.quantize(Decimal("0.01")))
+            self.assertEqual(result["net"], net(result["card_ids"]).quantize(Decimal("0.01")))
+
+    def test_skips_cards_that_cost_more_than_they_earn(self):
+        cheap = self._card("Cheap", 0, {"OTHER": "2.00"})
+        self._card("Premium", 550, {"DINING": "4.00", "OTHER": "1.00"})
+        self._tx("1000.00", "DINING")
+        self._tx("1000.00", "GAS")
+        self._tx("9000.00", "DINING", created_at=datetime(2020, 1, 1, tzinfo=dt_timezone.utc))  # outside 12 months
+
+        result = best_wallet(self.user, 2)
+        self.assertEqual(result["card_ids"], [cheap.id])
+        self.assertEqual(result["expected_rewards"], Decimal("40.00"))
+        self.assertEqual(result["assignments"], {"DINING": cheap.id, "GAS": cheap.id})
+
+    def test_empty_wallet_when_nothing_pays_off(self):
+        self._card("Premium", 550, {"DINING": "4.00"})
+        self._tx("10.00", "DINING")
+        result = best_wallet(self.user, 3)
+        self.assertEqual(result["card_ids"], [])
+        self.assertEqual(result["net"], Decimal("0.00"))
+
+
+class TestBestCardsForCategory(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="u1", email="u1@example.com", password="pw")
+        self.freedom = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.gold = Card.objects.create(name="Gold", issuer="AMEX", annual_fee=250)
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("3.00"), category=["DINING", "PHARMACY"])
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("1.50"), category=["OTHER"])
+        RewardRule.objects.create(card=self.gold, multiplier=Decimal("3.00"), category=["DINING"])
+        RewardRule.objects.create(card=self.gold, multiplier=Decimal("5.00"), category=["SELECTED_CATEGORIES", "GAS"])
+        UserCard.objects.create(user=self.user, card=self.freedom)
+        UserCard.objects.create(user=self.user, card=self.gold)
+
+    def test_recommendations(self):
+        dining = best_cards_for_category("DINING", self.user)
+        self.assertEqual(dining["best_card"]["card_id"], self.freedom.id)  # tie → lower annual fee
+        self.assertEqual(dining["multiplier"], 3.0)
+        self.assertEqual([alt["card_id"] for alt in dining["top3"]], [self.gold.id])
+
+        gas = best_cards_for_category("GAS", self.user)  # SELECTED rule ignored → OTHER fallback
+        self.assertEqual(gas["best_card"]["card_id"], self.freedom.id)
+        self.assertEqual(gas["multiplier"], 1.5)
+        self.assertIn("No GAS bonus", gas["rationale"])
+
+        UserCard.objects.filter(card=self.freedom).update(is_active=False)
+        UserCard.objects.get(card=self.gold).save()  # signal clears the cache
+        rent = best_cards_for_category("RENT", self.user)
+        self.assertEqual(rent["best_card"]["card_id"], self.gold.id)
+        self.assertEqual(rent["multiplier"], 1.0)
+
+        UserCard.objects.all().delete()
+        self.assertIsNone(best_cards_for_category("DINING", self.user)["best_card"])
+
+    def test_cached_lookups_take_no_queries(self):
+        with self.assertNumQueries(2):
+            best_cards_for_category("DINING", self.user)
+        with self.assertNumQueries(0):
+            for tag in ("DINING", "GAS", "RENT", "NOT_A_CATEGORY"):
+                best_cards_for_category(tag, self.user)
+
+    def test_invalidated_on_rule_and_card_changes(self):
+        self.assertEqual(best_cards_for_category("GROCERIES", self.user)["multiplier"], 1.5)
+
+        rule = RewardRule.objects.create(card=self.gold, multiplier=Decimal("4.00"), category=["GROCERIES"])
+        self.assertEqual(best_cards_for_category("GROCERIES", self.user)["best_card"]["card_id"], self.gold.id)
+
+        self.gold.name = "Gold Rewards"
+        self.gold.save()
+        self.assertEqual(best_cards_for_category("GROCERIES", self.user)["best_card"]["card_name"], "AMEX Gold Rewards")
+
+        rule.delete()
+        self.assertEqual(best_cards_for_category("GROCERIES", self.user)["multiplier"], 1.5)
+
+
+class TestBestCardsForPurchases(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="u1", email="u1@example.com", password="pw")
+        self.freedom = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.custom = Card.objects.create(name="Custom Cash", issuer="CITI", annual_fee=0)
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("3.00"), category=["GROCERIES"])
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("1.00"), category=["OTHER"])
+        RewardRule.objects.create(
+            card=self.custom, multiplier=Decimal("5.00"), category=["GROCERIES"], cap_amount=Decimal("500")
+        )
+        RewardRule.objects.create(card=self.custom, multiplier=Decimal("1.00"), category=["OTHER"])
+        UserCard.objects.create(user=self.user, card=self.freedom)
+        UserCard.objects.create(user=self.user, card=self.custom)
+
+    def test_ranks_by_headroom(self):
+        fresh, = best_cards_for_purchases([("GROCERIES", Decimal("100.00"))], self.user)
+        self.assertEqual(fresh["best_card"]["card_id"], self.custom.id)
+        self.assertEqual(fresh["multiplier"], 5.0)
+        self.assertEqual(fresh["estimated_reward"], 5.0)
+
+        # $450 of the $500 cap used: $50 at 5× + $50 at 1× = 3× blended, ties with Freedom
+        Transaction.objects.create(user=self.user, card_actually_used=self.custom, merchant="Store",
+                                   amount=Decimal("450.00"), category="GROCERIES")
+        nearly, = best_cards_for_purchases([("GROCERIES", Decimal("100.00"))], self.user)
+        self.assertEqual(nearly["multiplier"], 3.0)
+        self.assertEqual(nearly["best_card"]["card_id"], self.freedom.id)  # more headroom left
+        self.assertEqual(nearly["top3"][0]["card_id"], self.custom.id)
+
+        small, large = best_cards_for_purchases(
+            [("GROCERIES", Decimal("20.00")), ("GROCERIES", Decimal("400.00"))], self.user
+        )
+        self.assertEqual(small["best_card"]["card_id"], self.custom.id)  # fits in the headroom
+        self.assertEqual(large["best_card"]["card_id"], self.freedom.id)
+
+        UserCard.objects.filter(card=self.freedom).update(is_active=False)
+        UserCard.objects.get(card=self.custom).save()  # signal clears the cache
+        only, = best_cards_for_purchases([("GROCERIES", Decimal("100.00"))], self.user)
+        self.assertEqual(only["best_card"]["card_id"], self.custom.id)
+        self.assertEqual(only["estimated_reward"], 3.0)
+        self.assertIn("cap nearly used up", only["rationale"])
+
+    def test_items_share_headroom_in_order(self):
+        # $500 cap: the first $400 item fits, the second only has $100 of headroom left
+        first, second = best_cards_for_purchases(
+            [("GROCERIES", Decimal("400.00")), ("GROCERIES", Decimal("400.00"))], self.user
+        )
+        self.assertEqual(first["best_card"]["card_id"], self.custom.id)
+        self.assertEqual(first["estimated_reward"], 20.0)
+        self.assertEqual(second["best_card"]["card_id"], self.freedom.id)
+        self.assertEqual(second["estimated_reward"], 12.0)
+
+    def test_without_amount_matches_category_ranking(self):
+        plain, = best_cards_for_purchases([("GROCERIES", Decimal("0"))], self.user)
+        self.assertEqual(plain, best_cards_for_category("GROCERIES", self.user))
+        self.assertNotIn("estimated_reward", plain)
+
+    def test_one_counter_query(self):
+        best_cards_for_category("GROCERIES", self.user)  # warm the wallet cache
+        get_rate_table()
+        with self.assertNumQueries(1):
+            best_cards_for_purchases([("GROCERIES", Decimal("10.00")), ("GAS", Decimal("5.00"))], self.user)
+
+
+class TestCatalogTopCards(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="u1", email="u1@example.com", password="pw")
+        self.freedom = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.gold = Card.objects.create(name="Gold", issuer="AMEX", annual_fee=250)
+        self.savor = Card.objects.create(name="Savor", issuer="CAPITALONE", annual_fee=0)
+        self.double = Card.objects.create(name="Double Cash", issuer="CITI", annual_fee=0)
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("3.00"), category=["DINING"])
+        RewardRule.objects.create(card=self.gold, multiplier=Decimal("4.00"), category=["DINING", "GROCERIES"])
+        RewardRule.objects.create(card=self.savor, multiplier=Decimal("3.00"), category=["DINING"], cap_amount=500)
+        RewardRule.objects.create(card=self.double, multiplier=Decimal("2.00"), category=["OTHER"])
+        UserCard.objects.create(user=self.user, card=self.gold)
+
+    def test_ranking_order(self):
+        dining = [entry["card_id"] for entry in catalog_top_cards()["DINING"]["cards"]]
+        # 4× first; 3× uncapped beats 3× capped; OTHER fallback last
+        self.assertEqual(dining, [self.gold.id, self.freedom.id, self.savor.id, self.double.id])
+        self.assertEqual([entry["card_id"] for entry in catalog_top_cards()["GAS"]["cards"]], [self.double.id])
+
+    def test_not_owned_filters_wallet(self):
+        picks = best_cards_not_owned("DINING", self.user, limit=2)
+        self.assertEqual([entry["card_id"] for entry in picks], [self.freedom.id, self.savor.id])
+        self.assertEqual(picks[0]["multiplier"], 3.0)
+        self.assertEqual(picks[1]["cap_amount"], 500.0)
+        with self.assertNumQueries(0):
+            best_cards_not_owned("GROCERIES", self.user)
+
+    def test_rebuilt_on_rule_change(self):
+        catalog_top_cards()
+        RewardRule.objects.create(card=self.double, multiplier=Decimal("5.00"), category=["DINING"])
+        self.assertEqual(catalog_top_cards()["DINING"]["cards"][0]["card_id"], self.double.id)
+
+    def test_falls_back_to_full_ranking(self):
+        with self.settings(CATALOG_TOP_K=1):
+            invalidate_catalog_top_cards()
+            self.assertFalse(catalog_top_cards()["DINING"]["complete"])
+            picks = best_cards_not_owned("DINING", self.user, limit=3)
+        self.assertEqual([entry["card_id"] for entry in picks], [self.freedom.id, self.savor.id, self.double.id])
+
+
+class TestCardMarginalValues(TestCase):
+    CATEGORIES = ["DINING", "GROCERIES", "GAS", "GENERAL_TRAVEL", "OTHER"]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="u1", email="u1@example.com", password="pw")
+
+    def test_matches_wallet_simulation(self):
+        rng = random.Random(11)
+        cards = []
+        for i in range(10):
+            card = Card.objects.create(name=f"Card {i}", issuer="OTHER", annual_fee=rng.choice([0, 95, 250]))
+            for category in rng.sample(self.CATEGORIES, 2):
+                RewardRule.objects.create(card=card, multiplier=Decimal(rng.choice(["1.00", "2.00", "3.00", "5.00"])),
+                                          category=[category])
+            cards.append(card)
+        for card in cards[:2]:
+            UserCard.objects.create(user=self.user, card=card)
+        for category in self.CATEGORIES + ["RENT"]:
+            Transaction.objects.create(user=self.user, merchant="Store", amount=Decimal(rng.randint(100, 5000)),
+                                       category=category)
+
+        results = card_marginal_values(self.user)
+        wallet = [card.id for card in cards[:2]]
+        base, *with_card = simulate_wallets(self.user, [wallet] + [wallet + [r["card_id"]] for r in results])
+        self.assertEqual({r["card_id"] for r in results}, {card.id for card in cards[2:]})
+        for result, simulated in zip(results, with_card):
+            self.assertEqual(result["extra_rewards"], simulated["total_rewards"] - base["total_rewards"])
+        nets = [r["net"] for r in results]
+        self.assertEqual(nets, sorted(nets, reverse=True))
+
+    def test_empty_wallet_and_old_spend(self):
+        card = Card.objects.create(name="Flat", issuer="CITI", annual_fee=0)
+        RewardRule.objects.create(card=card, multiplier=Decimal("2.00"), category=["OTHER"])
+        tx = Transaction.objects.create(user=self.user, merchant="Store", amount=Decimal("100.00"), category="GAS")
+        tx.created_at = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+        tx.save(update_fields=["created_at"])
+        Transaction.objects.create(user=self.user, merchant="Store", amount=Decimal("50.00"), category="GAS")
+        result, = card_marginal_values(self.user)
+        self.assertEqual(result["extra_rewards"], Decimal("1.00"))
+
+
+# To run the tests:
+# python manage.py test optimizer.tests.test_services
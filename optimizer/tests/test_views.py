@@ -4,11 +4,17 @@ from rest_framework import status
 from rest_framework.test import APIRequestFactory, force_authenticate
 from unittest.mock import patch
 
+from cards.models import Card, RewardRule, UserCard
+from transactions.models import Transaction
 from optimizer.models import UserCategorySelection
 from optimizer.views import (
     HealthCheckView,
     UserCategorySelectionViewSet,
     MyOptimizerDashboardView,
+    WalletSimulationView,
+    BestWalletView,
+    BestCardsNotOwnedView,
+    CardMarginalValueView,
 )
 
 '''
@@ -27,7 +33,23 @@ UserCategorySelectionViewSet
 MyOptimizerDashboardView
 - Requires authentication.
 - GET returns a list where each item corresponds to a saved category_tag for the user.
-- For each tag, calls best_cards_for_category(tag, user) and merges its dict into the item.
+- Calls best_cards_for_categories(tags, user) once and merges each tag's dict into its item.
+- Query count does not grow with the number of selected tags.
+
+WalletSimulationView
+- Requires authentication.
+- POST {"wallets": [[card ids], ...]} returns one simulation result per wallet.
+- Empty wallet lists or unknown card ids are rejected with a 400.
+
+BestWalletView
+- GET ?k=N returns the best wallet of at most N catalog cards; k must be 1-10.
+
+BestCardsNotOwnedView
+- GET ?category=TAG&limit=N returns the best catalog cards for the category outside the user's wallet.
+- Unknown categories are rejected with a 400.
+
+CardMarginalValueView
+- GET ?limit=N returns the N catalog cards that add the most to the wallet (rewards minus fee).
 '''
 
 
@@ -124,12 +146,12 @@ class TestMyOptimizerDashboardView(TestCase):
         UserCategorySelection.objects.create(user=self.user, category_tag="DINING")
         UserCategorySelection.objects.create(user=self.user, category_tag="GAS")
 
-    @patch("optimizer.views.best_cards_for_category")
-    def test_dashboard_calls_service_per_tag_and_merges(self, mock_best):
-        mock_best.side_effect = [
-            {"best_card": "CardA", "multiplier": 4, "top3": ["A","B","C"]},
-            {"best_card": "CardB", "multiplier": 3, "top3": ["B","A","C"]},
-        ]
+    @patch("optimizer.views.best_cards_for_categories")
+    def test_dashboard_calls_service_once_and_merges(self, mock_best):
+        mock_best.return_value = {
+            "DINING": {"best_card": "CardA", "multiplier": 4, "top3": ["A","B","C"]},
+            "GAS": {"best_card": "CardB", "multiplier": 3, "top3": ["B","A","C"]},
+        }
         view = MyOptimizerDashboardView.as_view()
         req = self.rf.get("/optimizer/my-dashboard/")
         from rest_framework.test import force_authenticate
@@ -145,11 +167,134 @@ class TestMyOptimizerDashboardView(TestCase):
             self.assertIn("best_card", row)
             self.assertIn("multiplier", row)
             self.assertIn("top3", row)
-        # ensure service called with (tag, user)
-        calls = [call.args for call in mock_best.call_args_list]
-        called_tags = {args[0] for args in calls}
-        self.assertEqual(called_tags, {"DINING", "GAS"})
-        self.assertTrue(all(args[1] == self.user for args in calls))
+        # ensure service called once with (tags, user)
+        mock_best.assert_called_once()
+        tags_arg, user_arg = mock_best.call_args.args
+        self.assertEqual(set(tags_arg), {"DINING", "GAS"})
+        self.assertEqual(user_arg, self.user)
+
+    def test_query_count_independent_of_selected_tags(self):
+        card = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        RewardRule.objects.create(card=card, multiplier=3, category=["DINING"])
+        UserCard.objects.create(user=self.user, card=card)
+        view = MyOptimizerDashboardView.as_view()
+
+        def fetch():
+            req = self.rf.get("/optimizer/my-dashboard/")
+            force_authenticate(req, self.user)
+            return view(req)
+
+        # selections + active cards + rules
+        with self.assertNumQueries(3):
+            self.assertEqual(len(fetch().data), 2)
+        for tag in ("GROCERIES", "RENT", "TRANSIT", "OTHER"):
+            UserCategorySelection.objects.create(user=self.user, category_tag=tag)
+        UserCard.objects.get(user=self.user).save()  # clear the cached wallet
+        with self.assertNumQueries(3):
+            body = fetch().data
+        self.assertEqual(len(body), 6)
+        self.assertEqual(next(row for row in body if row["category_tag"] == "DINING")["multiplier"], 3.0)
+
+
+class TestWalletSimulationView(TestCase):
+    def setUp(self):
+        self.rf = APIRequestFactory()
+        self.user = User.objects.create_user(username="sim", email="sim@example.com", password="pw")
+        self.card = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        RewardRule.objects.create(card=self.card, multiplier=2, category=["OTHER"])
+        Transaction.objects.create(user=self.user, merchant="Store", amount=100, category="GAS")
+
+    def _post(self, payload):
+        req = self.rf.post("/optimizer/simulate-wallets/", payload, format="json")
+        force_authenticate(req, self.user)
+        return WalletSimulationView.as_view()(req)
+
+    def test_simulates_wallets(self):
+        resp = self._post({"wallets": [[self.card.id]]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        result = resp.data["data"][0]
+        self.assertEqual(result["card_ids"], [self.card.id])
+        self.assertEqual(result["total_rewards"], 2.0)
+        self.assertEqual(result["years"][0]["spend"], 100.0)
+
+    def test_rejects_unknown_cards(self):
+        resp = self._post({"wallets": [[self.card.id, 99999]]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("99999", str(resp.data["errors"]["wallets"]))
+        self.assertEqual(self._post({"wallets": []}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestBestWalletView(TestCase):
+    def setUp(self):
+        self.rf = APIRequestFactory()
+        self.user = User.objects.create_user(username="best", email="best@example.com", password="pw")
+        self.card = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        RewardRule.objects.create(card=self.card, multiplier=2, category=["OTHER"])
+        Transaction.objects.create(user=self.user, merchant="Store", amount=100, category="GAS")
+
+    def _get(self, query=""):
+        req = self.rf.get(f"/optimizer/best-wallet/{query}")
+        force_authenticate(req, self.user)
+        return BestWalletView.as_view()(req)
+
+    def test_returns_best_wallet(self):
+        resp = self._get("?k=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.data["data"]
+        self.assertEqual([card["card_id"] for card in data["cards"]], [self.card.id])
+        self.assertEqual(data["expected_rewards"], 2.0)
+        self.assertEqual(data["assignments"], {"GAS": self.card.id})
+
+    def test_rejects_bad_k(self):
+        self.assertEqual(self._get("?k=0").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._get("?k=abc").status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestBestCardsNotOwnedView(TestCase):
+    def setUp(self):
+        self.rf = APIRequestFactory()
+        self.user = User.objects.create_user(username="cat", email="cat@example.com", password="pw")
+        self.owned = Card.objects.create(name="Gold", issuer="AMEX", annual_fee=250)
+        self.other = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        RewardRule.objects.create(card=self.owned, multiplier=4, category=["DINING"])
+        RewardRule.objects.create(card=self.other, multiplier=3, category=["DINING"])
+        UserCard.objects.create(user=self.user, card=self.owned)
+
+    def _get(self, query):
+        req = self.rf.get(f"/optimizer/best-cards-not-owned/{query}")
+        force_authenticate(req, self.user)
+        return BestCardsNotOwnedView.as_view()(req)
+
+    def test_returns_cards_not_owned(self):
+        resp = self._get("?category=DINING")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([card["card_id"] for card in resp.data["data"]["cards"]], [self.other.id])
+
+    def test_rejects_unknown_category(self):
+        self.assertEqual(self._get("?category=DINNING").status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestCardMarginalValueView(TestCase):
+    def setUp(self):
+        self.rf = APIRequestFactory()
+        self.user = User.objects.create_user(username="mv", email="mv@example.com", password="pw")
+        self.card = Card.objects.create(name="Flat", issuer="CITI", annual_fee=0)
+        RewardRule.objects.create(card=self.card, multiplier=2, category=["OTHER"])
+        Transaction.objects.create(user=self.user, merchant="Store", amount=100, category="GAS")
+
+    def _get(self, query=""):
+        req = self.rf.get(f"/optimizer/card-marginal-values/{query}")
+        force_authenticate(req, self.user)
+        return CardMarginalValueView.as_view()(req)
+
+    def test_returns_marginal_values(self):
+        resp = self._get("?limit=5")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data["data"], [{
+            "card_id": self.card.id, "card_name": "CITI Flat", "annual_fee": 0.0, "extra_rewards": 2.0, "net": 2.0,
+        }])
+        self.assertEqual(self._get("?limit=0").status_code, status.HTTP_400_BAD_REQUEST)
+
 
 # To run the tests:
-# python manage.py test optimizer.tests.test_views
\ No newline at end of file
+# python manage.py test optimizer.tests.test_views
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from . import views
 from rest_framework.routers import DefaultRouter
-from .views import UserCategorySelectionViewSet, MyOptimizerDashboardView, HealthCheckView
+from .views import UserCategorySelectionViewSet, MyOptimizerDashboardView, HealthCheckView, WalletSimulationView, BestWalletView, BestCardsNotOwnedView, CardMarginalValueView
 
 router = DefaultRouter()
 router.register(r'user-category-selections', UserCategorySelectionViewSet, basename='user-category-selections')
@@ -10,4 +10,8 @@ urlpatterns = [
     path('', include(router.urls)),
     path('health/', HealthCheckView.as_view(), name='health'),
     path('my-optimizer-dashboard/', MyOptimizerDashboardView.as_view(), name='my-optimizer-dashboard'),
+    path('simulate-wallets/', WalletSimulationView.as_view(), name='simulate-wallets'),
+    path('best-wallet/', BestWalletView.as_view(), name='best-wallet'),
+    path('best-cards-not-owned/', BestCardsNotOwnedView.as_view(), name='best-cards-not-owned'),
+    path('card-marginal-values/', CardMarginalValueView.as_view(), name='card-marginal-values'),
 ]
\ No newline at end of file
@@ -2,9 +2,15 @@ from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, viewsets, permissions
+from cards.models import Card
 from .models import UserCategorySelection
-from .serializers import UserCategorySelectionSerializer
-from .services import best_cards_for_category
+from .serializers import (
+    UserCategorySelectionSerializer, WalletSimulationSerializer, BestWalletQuerySerializer, NotOwnedQuerySerializer,
+    MarginalValueQuerySerializer,
+)
+from .services import (
+    best_cards_for_categories, simulate_wallets, best_wallet, best_cards_not_owned, card_marginal_values,
+)
 
 # Create your views here.
 # Check API health
@@ -28,14 +34,132 @@ class MyOptimizerDashboardView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        tags = (UserCategorySelection.objects
-                .filter(user=request.user)
-                .values_list("category_tag", flat=True))
+        tags = list(UserCategorySelection.objects
+                    .filter(user=request.user)
+                    .values_list("category_tag", flat=True))
 
+        # One wallet snapshot for all tags (ranked in memory)
+        recommendations = best_cards_for_categories(tags, request.user)
         results = []
         for tag in tags:
             results.append({
                 "category_tag": tag,
-                **best_cards_for_category(tag, request.user)  # ← pass user here
+                **recommendations[tag]
             })
-        return Response(results)
\ No newline at end of file
+        return Response(results)
+
+class WalletSimulationView(APIView):
+    """POST /api/optimizer/simulate-wallets/ - Replay the user's history against candidate wallets"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = WalletSimulationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = simulate_wallets(request.user, serializer.validated_data["wallets"])
+        return Response({
+            "success": True,
+            "data": [
+                {
+                    "card_ids": result["card_ids"],
+                    "annual_fee": float(result["annual_fee"]),
+                    "total_rewards": float(result["total_rewards"]),
+                    "total_net": float(result["total_net"]),
+                    "years": [
+                        {key: (value if key == "year" else float(value)) for key, value in year.items()}
+                        for year in result["years"]
+                    ],
+                }
+                for result in results
+            ]
+        }, status=status.HTTP_200_OK)
+
+
+class BestWalletView(APIView):
+    """GET /api/optimizer/best-wallet/?k=3 - Best K catalog cards for the user's last 12 months of spend"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        serializer = BestWalletQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        k = serializer.validated_data["k"]
+        result = best_wallet(request.user, k)
+        cards = {card.id: card for card in Card.objects.filter(id__in=result["card_ids"])}
+        return Response({
+            "success": True,
+            "data": {
+                "k": k,
+                "cards": [
+                    {
+                        "card_id": card_id,
+                        "card_name": f"{cards[card_id].issuer} {cards[card_id].name}",
+                        "annual_fee": float(cards[card_id].annual_fee),
+                    }
+                    for card_id in result["card_ids"]
+                ],
+                "expected_rewards": float(result["expected_rewards"]),
+                "annual_fees": float(result["annual_fees"]),
+                "net": float(result["net"]),
+                "assignments": result["assignments"],
+                "optimal": result["optimal"],
+            }
+        }, status=status.HTTP_200_OK)
+
+
+class BestCardsNotOwnedView(APIView):
+    """GET /api/optimizer/best-cards-not-owned/?category=DINING&limit=3 - Best catalog cards the user doesn't hold yet"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        serializer = NotOwnedQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        category = serializer.validated_data["category"]
+        return Response({
+            "success": True,
+            "data": {
+                "category": category,
+                "cards": best_cards_not_owned(category, request.user, serializer.validated_data["limit"]),
+            }
+        }, status=status.HTTP_200_OK)
+
+
+class CardMarginalValueView(APIView):
+    """GET /api/optimizer/card-marginal-values/?limit=10 - Extra yearly rewards each catalog card would add to the wallet"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        serializer = MarginalValueQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(
+                {"success": False, "errors": serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = card_marginal_values(request.user)[:serializer.validated_data["limit"]]
+        return Response({
+            "success": True,
+            "data": [
+                {
+                    "card_id": result["card_id"],
+                    "card_name": result["card_name"],
+                    "annual_fee": float(result["annual_fee"]),
+                    "extra_rewards": float(result["extra_rewards"]),
+                    "net": float(result["net"]),
+                }
+                for result in results
+            ]
+        }, status=status.HTTP_200_OK)
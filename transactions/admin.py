@@ -1,6 +1,10 @@
 from django.contrib import admin
-from .models import Transaction
+from .models import Transaction, MonthlyRewardRollup, RewardCapUsage, RewardBackfillRequest, CSVImportJob
 
 admin.site.register(Transaction)
+admin.site.register(MonthlyRewardRollup)
+admin.site.register(RewardCapUsage)
+admin.site.register(RewardBackfillRequest)
+admin.site.register(CSVImportJob)
 
 # Register your models here.
@@ -0,0 +1,196 @@
+"""
+Reward cap usage counters.
+Keeps RewardCapUsage rows (capped-bonus spend used per user, rule and year) in
+step with Transaction writes, so cap-aware recommendations read the remaining
+headroom from a few counter rows instead of replaying the year's transactions.
+Charges follow CapLedger in transactions/rewards.py exactly.
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import F, Q
+from .rollups import lock_user_rollups
+
+# (user_id, year) pairs waiting for a rebuild when the current DB transaction commits
+_pending = threading.local()
+
+
+def usage_year(user, created_at):
+    """Cap year of a purchase (calendar year in the user's timezone)."""
+    from budgets.services import get_user_timezone
+
+    return created_at.astimezone(get_user_timezone(user)).year
+
+
+def reward_card_id(transaction):
+    """Card whose caps a purchase consumes: the card actually used, else the recommended card."""
+    return transaction.card_actually_used_id or transaction.recommended_card_id
+
+
+def cap_inputs_changed(previous, transaction):
+    """True if an update changed anything cap charges depend on (user, date, amount, category, card)."""
+    amount = transaction._meta.get_field('amount')
+    return (
+        previous.user_id != transaction.user_id
+        or previous.created_at != transaction.created_at
+        or previous.category != transaction.category
+        or reward_card_id(previous) != reward_card_id(transaction)
+        or amount.to_python(previous.amount) != amount.to_python(transaction.amount)
+    )
+
+
+def record_cap_usage(transaction):
+    """
+    Charge a newly created transaction against its card's capped rules.
+    Charging in place only matches a full replay when nothing on the same card
+    comes later in the year; a backdated insert schedules a replay of its year instead.
+    """
+    from budgets.services import get_user_timezone
+    from cards.rates import get_rate_table
+    from transactions.models import Transaction, RewardCapUsage
+    from transactions.rewards import CapLedger
+    from transactions.cents import to_cents
+
+    card_id = reward_card_id(transaction)
+    if not card_id or not transaction.category:
+        return
+    table = get_rate_table()
+    capped = [rule_id for _bps, cap_cents, rule_id in table.rule_chain(card_id, transaction.category)
+              if cap_cents is not None]
+    if not capped:
+        return
+
+    year = usage_year(transaction.user, transaction.created_at)
+    later = Transaction.objects.filter(
+        Q(card_actually_used=card_id) | Q(card_actually_used__isnull=True, recommended_card=card_id),
+        user_id=transaction.user_id,
+        created_at__gt=transaction.created_at,
+        created_at__lt=datetime(year + 1, 1, 1, tzinfo=get_user_timezone(transaction.user)),
+    )
+    if later.exists():
+        schedule_cap_usage_rebuild(transaction.user_id, [year])
+        return
+
+    ledger = CapLedger(table)
+    for rule_id, used_cents in RewardCapUsage.objects.filter(
+        user_id=transaction.user_id, rule_id__in=capped, year=year
+    ).values_list('rule_id', 'used_cents'):
+        ledger.used[(card_id, rule_id, year)] = used_cents
+    before = dict(ledger.used)
+
+    amount = transaction._meta.get_field('amount').to_python(transaction.amount)
+    ledger.charge(card_id, transaction.category, to_cents(amount), year)
+    for key, used_cents in ledger.used.items():
+        delta = used_cents - before.get(key, 0)
+        if delta:
+            _add_cap_usage(transaction.user_id, card_id, key[1], year, delta)
+
+
+def _add_cap_usage(user_id, card_id, rule_id, year, delta):
+    """Add delta cents to one counter row with an F() expression, creating it if needed."""
+    from transactions.models import RewardCapUsage
+
+    rows = RewardCapUsage.objects.filter(user_id=user_id, rule_id=rule_id, year=year)
+    if rows.update(used_cents=F('used_cents') + delta):
+        return
+    try:
+        with db_transaction.atomic():
+            RewardCapUsage.objects.create(
+                user_id=user_id, card_id=card_id, rule_id=rule_id, year=year, used_cents=delta,
+            )
+    except IntegrityError:
+        # Created concurrently; add to the existing row instead
+        rows.update(used_cents=F('used_cents') + delta)
+
+
+def schedule_cap_usage_rebuild(user_id, years):
+    """
+    Rebuild the user's counters for these years once the current DB transaction
+    commits, once per (user, year) however many writes asked for it.
+    """
+    pending = getattr(_pending, 'keys', None)
+    if pending is None:
+        pending = _pending.keys = set()
+    pending.update((user_id, year) for year in years)
+    # Every request registers a callback: the first one to run drains the set, and a
+    # rolled-back request only leaves keys behind for a harmless extra rebuild
+    db_transaction.on_commit(_run_scheduled_rebuilds)
+
+
+def _run_scheduled_rebuilds():
+    keys = getattr(_pending, 'keys', None)
+    _pending.keys = None
+    years_by_user = defaultdict(set)
+    for user_id, year in keys or ():
+        years_by_user[user_id].add(year)
+    for user_id, years in years_by_user.items():
+        rebuild_cap_usage([user_id], years)
+
+
+def rebuild_cap_usage(user_ids=None, years=None):
+    """
+    Replay transactions through a CapLedger and rewrite the counters for the
+    given users (all users if None), optionally limited to some years.
+
+    Returns:
+        int: Number of counter rows written
+    """
+    from django.contrib.auth import get_user_model
+    from django.db.models.functions import Coalesce
+    from budgets.services import get_user_timezone
+    from transactions.models import Transaction, RewardCapUsage
+    from transactions.rewards import CapLedger
+    from transactions.cents import to_cents
+
+    users = get_user_model().objects.all()
+    if user_ids is not None:
+        users = users.filter(id__in=list(user_ids))
+    years = sorted(set(years)) if years is not None else None
+
+    written = 0
+    for user in users.iterator():
+        tz = get_user_timezone(user)
+        transactions = Transaction.objects.filter(user=user)
+        existing = RewardCapUsage.objects.filter(user=user)
+        if years is not None:
+            in_years = Q()
+            for year in years:
+                in_years |= Q(created_at__gte=datetime(year, 1, 1, tzinfo=tz),
+                              created_at__lt=datetime(year + 1, 1, 1, tzinfo=tz))
+            transactions = transactions.filter(in_years)
+            existing = existing.filter(year__in=years)
+        rows = (
+            transactions
+            .annotate(reward_card_id=Coalesce('card_actually_used', 'recommended_card'))
+            .order_by('created_at', 'id')
+            .values_list('created_at', 'amount', 'category', 'reward_card_id')
+        )
+
+        with db_transaction.atomic():
+            # Read and rewrite under the user's lock (see rollups.lock_user_rollups)
+            lock_user_rollups(user.pk)
+            ledger = CapLedger()
+            for created_at, amount, category, card_id in rows.iterator(chunk_size=2000):
+                if card_id and category:
+                    ledger.charge(card_id, category, to_cents(amount), created_at.astimezone(tz).year)
+
+            counters = [
+                RewardCapUsage(user=user, card_id=card_id, rule_id=rule_id, year=year, used_cents=used_cents)
+                for (card_id, rule_id, year), used_cents in ledger.used.items()
+                if used_cents
+            ]
+            existing.delete()
+            RewardCapUsage.objects.bulk_create(counters)
+        written += len(counters)
+    return written
+
+
+def cap_usage(user, year, card_ids=None):
+    """{rule_id: used cents} for one user and year."""
+    from transactions.models import RewardCapUsage
+
+    rows = RewardCapUsage.objects.filter(user=user, year=year)
+    if card_ids is not None:
+        rows = rows.filter(card_id__in=list(card_ids))
+    return dict(rows.values_list('rule_id', 'used_cents'))
@@ -0,0 +1,58 @@
+"""
+Fixed-point reward arithmetic.
+Rewards are computed in integer cents: amount in cents × multiplier in basis
+points (3.00 → 300) ÷ 10000, rounded half-even exactly like
+Decimal.quantize(Decimal('0.01')). Decimals are only built at the boundary,
+with cents_to_decimal.
+"""
+from decimal import Decimal
+import numpy as np
+
+CENT = Decimal('0.01')
+
+
+def round_half_even(numerator, denominator):
+    """Integer division of ints rounded like Decimal.quantize (ROUND_HALF_EVEN)."""
+    quotient, remainder = divmod(numerator, denominator)
+    twice = remainder * 2
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def round_half_even_array(numerator, denominator):
+    """round_half_even for NumPy integer arrays."""
+    quotient, remainder = np.divmod(numerator, denominator)
+    half = denominator // 2
+    quotient += (remainder > half) | ((remainder == half) & (quotient % 2 == 1))
+    return quotient
+
+
+def decimals_to_cents_array(values):
+    """Two-decimal-place amounts (e.g. DecimalField values) → int64 cents array, any shape."""
+    # Exact: float64 represents every cent amount below 2**53 / 100 closely enough for rint
+    return np.rint(np.array(values, dtype=np.float64) * 100).astype(np.int64)
+
+
+def to_cents(amount):
+    """Whole cents in an amount (Decimal or int), rounded half-even past the second decimal place."""
+    numerator, denominator = amount.as_integer_ratio()
+    return round_half_even(numerator * 100, denominator)
+
+
+def reward_cents(amount, bps):
+    """
+    Reward for an amount at a rate in basis points, in cents:
+    amount × multiplier ÷ 100, quantized to cents (exact for any Decimal amount).
+    """
+    if not bps:
+        return 0
+    # amount × 100 cents × bps ÷ 10000 = amount × bps ÷ 100
+    numerator, denominator = amount.as_integer_ratio()
+    return round_half_even(numerator * bps, denominator * 100)
+
+
+def cents_to_decimal(cents):
+    """Integer cents → Decimal dollars with two decimal places (150 → Decimal('1.50'))."""
+    # Exact: integers well below the 28-digit context precision
+    return Decimal(int(cents)) * CENT
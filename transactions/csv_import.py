@@ -0,0 +1,698 @@
+"""
+CSV transaction import.
+Uploads are decoded and parsed incrementally from the file's chunks, so memory
+stays bounded by the chunk size rather than the size of the export; a decode-only
+first pass refuses a file that isn't UTF-8 before any of it is imported. Valid rows
+are inserted a chunk at a time with bulk_create; the rollup, cap usage and
+budget updates the Transaction signals would make per row are applied once
+per chunk / once per import instead. Rows are validated by
+TransactionCSVRowSerializer, or column by column with pandas (COLUMNAR
+engine). A dry run validates and aggregates an ImportPreview without writing.
+Rows carry a fingerprint, so re-importing
+an overlapping export skips the rows already stored. Big files can run as background
+CSVImportJobs on a small thread pool.
+"""
+import codecs
+import csv
+import hashlib
+import logging
+import multiprocessing
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import islice
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction as db_transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the upload at a time
+CHUNK_SIZE = 64 * 1024
+# Rows validated and inserted per bulk_create
+IMPORT_CHUNK_ROWS = 500
+
+# Validation engines: per-row serializer (default) or pandas columns
+SERIALIZER = "serializer"
+COLUMNAR = "columnar"
+ENGINES = (SERIALIZER, COLUMNAR)
+# Amounts the columnar engine parses without the serializer's per-value check
+PLAIN_AMOUNT = r"[+-]?(?:\d+\.?\d*|\.\d+)"
+
+
+class CSVEncodingError(Exception):
+    """The upload is not valid UTF-8. row is the first row that could not be read."""
+
+    def __init__(self, error, row):
+        super().__init__(str(error))
+        self.row = row
+
+
+def _decoded_lines(uploaded_file, chunk_size=CHUNK_SIZE):
+    """Yield the upload's text one line at a time (line endings kept, as csv expects)."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    # Not uploaded_file.chunks(): in-memory uploads return everything as one chunk
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(chunk_size), b''):
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def check_encoding(uploaded_file, chunk_size=CHUNK_SIZE):
+    """
+    Decode the whole upload without parsing it, so an import can refuse a file that
+    isn't UTF-8 before writing any of its rows. Memory stays bounded by the chunk size.
+
+    Raises:
+        CSVEncodingError: at the first invalid byte; row is the line it's on (header is 1)
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    line = 1
+    uploaded_file.seek(0)
+    try:
+        for chunk in iter(lambda: uploaded_file.read(chunk_size), b''):
+            line += decoder.decode(chunk).count('\n')
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError as e:
+        raise CSVEncodingError(e, line + e.object[:e.start].count(b'\n')) from e
+
+
+def iter_csv_rows(uploaded_file, chunk_size=CHUNK_SIZE):
+    """
+    Yield (row number, row dict) for each data row of an uploaded CSV file.
+    Row numbers count the header as row 1.
+
+    Raises:
+        CSVEncodingError: when a chunk is not valid UTF-8, before any of its rows are yielded
+    """
+    row_num = 1
+    reader = csv.DictReader(_decoded_lines(uploaded_file, chunk_size))
+    while True:
+        try:
+            row_data = next(reader)
+        except StopIteration:
+            return
+        except UnicodeDecodeError as e:
+            raise CSVEncodingError(e, row_num + 1) from e
+        row_num += 1
+        yield row_num, row_data
+
+
+def iter_csv_frames(uploaded_file, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Yield the upload as DataFrames of up to chunk_rows rows, every column as str,
+    indexed by row number (header is row 1), like iter_csv_rows.
+
+    Raises:
+        CSVEncodingError: when the file is not valid UTF-8
+        csv.Error: when pandas can't parse the file
+    """
+    import pandas as pd
+
+    uploaded_file.seek(0)
+    next_row = 2
+    try:
+        for frame in pd.read_csv(uploaded_file, dtype=str, keep_default_na=False, index_col=False,
+                                 chunksize=chunk_rows, encoding='utf-8'):
+            frame.index = pd.RangeIndex(next_row, next_row + len(frame))
+            next_row += len(frame)
+            yield frame
+    except pd.errors.EmptyDataError:
+        return
+    except UnicodeDecodeError as e:
+        raise CSVEncodingError(e, next_row) from e
+    except pd.errors.ParserError as e:
+        raise csv.Error(str(e)) from e
+
+
+def validate_frame(frame, wallet):
+    """
+    validate_chunk for a DataFrame: the same validated data and error dicts as
+    TransactionCSVRowSerializer, checked one column at a time. Values a vectorized
+    check rejects go through the serializer's own validate_<field> for the message.
+    One difference: pandas reads the missing trailing fields of a short row as blank,
+    so they get "may not be blank" where the serializer says "may not be null".
+    """
+    import pandas as pd
+    from rest_framework import serializers
+    from cards.models import RewardRule
+    from .serializers import TransactionCSVRowSerializer
+
+    scalar = TransactionCSVRowSerializer()
+    errors = defaultdict(dict)
+    values = {}
+
+    def check_each(name, column, validate):
+        results = {}
+        for row_num, value in column.items():
+            try:
+                results[row_num] = validate(value)
+            except serializers.ValidationError as e:
+                errors[row_num][name] = list(e.detail)
+        return pd.Series(results, index=column.index, dtype=object)
+
+    def combine(*parts):
+        # Empty parts would make pd.concat warn (they'll count toward its dtype in pandas 3)
+        parts = [part for part in parts if not part.empty]
+        return pd.concat(parts) if parts else pd.Series(dtype=object)
+
+    for name, field in scalar.fields.items():
+        if name not in frame.columns:
+            if field.required:
+                for row_num in frame.index:
+                    errors[row_num][name] = [field.error_messages['required']]
+            continue
+        column = frame[name].str.strip()
+        blank = column == ''
+        if not field.allow_blank:
+            for row_num in column.index[blank]:
+                errors[row_num][name] = [field.error_messages['blank']]
+
+        if name == 'card':
+            resolved = {}
+            for value in column[~blank].unique():
+                try:
+                    resolved[value] = wallet.resolve(value)
+                except serializers.ValidationError as e:
+                    resolved[value] = e
+            for row_num, value in column[~blank].items():
+                if isinstance(resolved[value], serializers.ValidationError):
+                    errors[row_num][name] = list(resolved[value].detail)
+            values[name] = column.map(lambda value: None if value == '' else resolved[value])
+        elif name == 'amount':
+            plain = column.str.fullmatch(PLAIN_AMOUNT)
+            parsed = column[plain].map(Decimal)
+            # Other number formats and negatives get the serializer's check (and its message)
+            unusual = check_each(name, column[~plain & ~blank], scalar.validate_amount)
+            check_each(name, column[parsed.index[parsed < 0]], scalar.validate_amount)
+            cents = parsed.map(lambda amount: amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+            values[name] = combine(unusual, cents)
+        elif name == 'category':
+            valid = column.isin([choice[0] for choice in RewardRule.CATEGORY_CHOICES])
+            check_each(name, column[~valid & ~blank], scalar.validate_category)
+            values[name] = column
+        elif name == 'date':
+            parsed = pd.to_datetime(column.where(~blank), format="%Y-%m-%d", errors='coerce')
+            dates = check_each(name, column[parsed.isna() & ~blank], scalar.validate_date)
+            aware = parsed[parsed.notna()].map(lambda date: timezone.make_aware(date.to_pydatetime()))
+            values[name] = combine(dates, aware)
+        else:
+            # merchant: blank already rejected; notes: blank means none
+            values[name] = column.where(~blank, None) if name == 'notes' else column
+
+    validated = []
+    for row_num in frame.index:
+        if row_num in errors:
+            validated.append((row_num, None, errors[row_num]))
+        else:
+            validated.append((row_num, {name: column.get(row_num) for name, column in values.items()}, None))
+    return validated
+
+
+def row_fingerprint(user_id, purchase_date, merchant, amount, card_id, occurrence):
+    """
+    Hash identifying an imported row. occurrence numbers identical rows within one
+    file (1, 2, ...), so two real purchases that look alike are both kept, and both
+    recognized when the file is imported again.
+    """
+    key = "|".join(str(part) for part in (
+        user_id, purchase_date.isoformat(), merchant, amount, card_id or "", occurrence,
+    ))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class WalletLookup:
+    """
+    The user's active cards keyed by id and by case-folded name, loaded once per
+    import so card columns resolve in memory. Errors match the per-row lookups
+    TransactionCSVRowSerializer.validate_card used to run.
+    """
+
+    def __init__(self, user):
+        from django.db.models.functions import Lower
+        from cards.models import Card, UserCard
+
+        cards = [uc.card for uc in UserCard.objects.filter(user=user, is_active=True).select_related('card')]
+        self.by_id = {card.id: card for card in cards}
+        self.by_name = {card.name.casefold(): card for card in cards}
+        # A name shared by several catalog cards can't pick one, even if one of them is in the wallet
+        names = Counter(name.casefold() for name in Card.objects.annotate(lower_name=Lower('name')).filter(
+            lower_name__in={card.name.lower() for card in cards}
+        ).values_list('name', flat=True))
+        self.ambiguous = {name for name, count in names.items() if count > 1}
+        # Names outside the wallet: how many catalog cards have them, looked up once per name
+        self._catalog_counts = {}
+        self._catalog_loaded = False
+
+    def load_catalog(self):
+        """Count every catalog card name now, so resolving never queries (e.g. in a worker process)."""
+        from cards.models import Card
+
+        self._catalog_counts = Counter(name.casefold() for name in Card.objects.values_list('name', flat=True))
+        self._catalog_loaded = True
+
+    def resolve(self, value):
+        """Card for a CSV card column (id or name); None if blank. Raises ValidationError."""
+        from rest_framework import serializers
+        from cards.models import Card
+
+        card_value = value.strip() if value else ""
+        if not card_value:
+            return None
+        try:
+            card_id = int(card_value)
+        except ValueError:
+            pass
+        else:
+            if card_id not in self.by_id:
+                raise serializers.ValidationError(f"Card ID '{card_id}' not found in your wallet.")
+            return self.by_id[card_id]
+
+        name = card_value.casefold()
+        if name in self.ambiguous:
+            count = 2
+        elif name in self.by_name:
+            return self.by_name[name]
+        else:
+            if name not in self._catalog_counts and not self._catalog_loaded:
+                self._catalog_counts[name] = Card.objects.filter(name__iexact=card_value)[:2].count()
+            count = self._catalog_counts.get(name, 0)
+        if count > 1:
+            raise serializers.ValidationError(
+                f"Multiple cards found with name '{card_value}'. Please use card number instead."
+            )
+        if count:
+            raise serializers.ValidationError(f"Card '{card_value}' not found in your wallet.")
+        raise serializers.ValidationError(f"Card '{card_value}' not found.")
+
+
+def validate_chunk(chunk, user, wallet):
+    """
+    Validate parsed rows with TransactionCSVRowSerializer.
+    Runs no queries once the wallet's catalog names are loaded, so it can run in a worker process.
+
+    Returns:
+        list: (row number, validated data or None, errors or None) per row, in order
+    """
+    from .serializers import TransactionCSVRowSerializer
+
+    validated = []
+    for row_num, row_data in chunk:
+        serializer = TransactionCSVRowSerializer(data=row_data, context={"user": user, "wallet": wallet})
+        if serializer.is_valid():
+            validated.append((row_num, serializer.validated_data, None))
+        else:
+            validated.append((row_num, None, dict(serializer.errors)))
+    return validated
+
+
+def _init_validation_worker():
+    # Spawned (not forked) workers start without Django set up
+    import django
+    django.setup()
+
+
+class ImportPreview:
+    """
+    What an import would do, from a dry run: valid and failed rows, errors by
+    field, new vs already-imported rows, spend by category and the month range.
+    Holds only running totals, so memory doesn't grow with the file.
+    """
+
+    def __init__(self, tz):
+        self.tz = tz
+        self.valid_rows = 0
+        self.error_rows = 0
+        self.errors_by_field = Counter()
+        self.new_rows = 0
+        self.duplicate_rows = 0
+        self.spend_by_category = defaultdict(lambda: Decimal('0.00'))
+        self.first_month = None
+        self.last_month = None
+
+    def add_chunk(self, results, valid):
+        """Count one chunk: results by row number, and the Transactions built for its valid rows."""
+        for result in results.values():
+            if result["status"] == "error":
+                self.add_error(result["errors"])
+        for row_num, transaction in valid:
+            self.valid_rows += 1
+            if results[row_num]["status"] == "duplicate":
+                self.duplicate_rows += 1
+            else:
+                self.new_rows += 1
+            self.spend_by_category[transaction.category] += transaction.amount
+            year_month = transaction.created_at.astimezone(self.tz).strftime('%Y-%m')
+            self.first_month = min(self.first_month or year_month, year_month)
+            self.last_month = max(self.last_month or year_month, year_month)
+
+    def add_error(self, errors):
+        self.error_rows += 1
+        self.errors_by_field.update(errors.keys())
+
+    def as_dict(self):
+        return {
+            "valid_rows": self.valid_rows,
+            "error_rows": self.error_rows,
+            "errors_by_field": dict(self.errors_by_field),
+            "new_rows": self.new_rows,
+            "duplicate_rows": self.duplicate_rows,
+            "spend_by_category": {
+                category: float(spend) for category, spend in sorted(self.spend_by_category.items())
+            },
+            "first_month": self.first_month,
+            "last_month": self.last_month,
+        }
+
+
+class TransactionImporter:
+    """
+    Imports parsed CSV rows for one user. import_rows yields one result dict per
+    row, in order; call finish() afterwards (also after an error) to replay cap
+    usage and evaluate budgets for the months the import touched.
+    With workers, row chunks are validated by a pool of that many processes;
+    database writes stay in this process, in row order. The COLUMNAR engine
+    (import_file only) validates each chunk with pandas instead.
+    A dry run writes nothing: valid rows are reported as "new" or "duplicate"
+    and summed up in self.preview.
+    """
+
+    def __init__(self, user, chunk_rows=IMPORT_CHUNK_ROWS, workers=None, engine=SERIALIZER, dry_run=False):
+        from budgets.services import get_user_timezone
+
+        self.user = user
+        self.tz = get_user_timezone(user)
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        self.engine = engine
+        self.wallet = WalletLookup(user)
+        if workers:
+            self.wallet.load_catalog()
+        # Recommended card per category, looked up once per import
+        self.recommended_cards = {}
+        self.preview = ImportPreview(self.tz) if dry_run else None
+        # How many times each row (without occurrence) was seen so far in this file
+        self._occurrences = Counter()
+        self.year_months = set()
+        self.years = set()
+
+    def import_rows(self, rows):
+        for validated in self._validated_chunks(self._chunks(rows)):
+            yield from self._import_chunk(validated)
+
+    def import_file(self, file, skip_rows=0):
+        """Import an uploaded CSV file with the importer's engine, skipping its first skip_rows data rows."""
+        # All or nothing: a file that isn't UTF-8 is refused before any row is imported
+        check_encoding(file)
+        # Skipped rows still count toward the occurrence numbers of the rows after them
+        if self.engine != COLUMNAR:
+            rows = iter_csv_rows(file)
+            for validated in self._validated_chunks(self._chunks(islice(rows, skip_rows))):
+                self._skip_chunk(validated)
+            yield from self.import_rows(rows)
+            return
+        for frame in iter_csv_frames(file, self.chunk_rows):
+            skipped = frame.index - 1 <= skip_rows
+            if skipped.any():
+                self._skip_chunk(validate_frame(frame[skipped], self.wallet))
+            yield from self._import_chunk(validate_frame(frame[~skipped], self.wallet))
+
+    def _chunks(self, rows):
+        chunk = []
+        try:
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= self.chunk_rows:
+                    yield chunk
+                    chunk = []
+        except csv.Error:
+            # Rows read before the unreadable part are still imported
+            if chunk:
+                yield chunk
+            raise
+        if chunk:
+            yield chunk
+
+    def _validated_chunks(self, chunks):
+        if not self.workers:
+            for chunk in chunks:
+                yield validate_chunk(chunk, self.user, self.wallet)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_validation_worker,
+        ) as pool:
+            # A couple of chunks per worker in flight keeps the pool busy and memory bounded
+            in_flight = deque()
+            try:
+                for chunk in chunks:
+                    in_flight.append(pool.submit(validate_chunk, chunk, self.user, self.wallet))
+                    if len(in_flight) >= 2 * self.workers:
+                        yield in_flight.popleft().result()
+            except csv.Error:
+                while in_flight:
+                    yield in_flight.popleft().result()
+                raise
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def _skip_chunk(self, validated):
+        """Fingerprint a chunk's valid rows, without importing them, to advance the occurrence counter."""
+        from .serializers import TransactionCSVRowSerializer
+
+        builder = TransactionCSVRowSerializer(
+            context={"user": self.user, "wallet": self.wallet, "recommended_cards": self.recommended_cards}
+        )
+        for _row_num, validated_data, errors in validated:
+            if errors is None:
+                self._fingerprint(builder.build(validated_data))
+
+    def _import_chunk(self, validated):
+        from cards.rates import get_rate_table
+        from .models import Transaction
+        from .serializers import TransactionCSVRowSerializer
+
+        results = {}
+        pending = []
+        builder = TransactionCSVRowSerializer(
+            context={"user": self.user, "wallet": self.wallet, "recommended_cards": self.recommended_cards}
+        )
+        for row_num, validated_data, errors in validated:
+            if errors is None:
+                pending.append((row_num, builder.build(validated_data)))
+            else:
+                results[row_num] = {"row": row_num, "status": "error", "errors": errors}
+
+        valid = pending
+        if pending:
+            # Skip rows imported before: one indexed lookup for the whole chunk
+            for _row_num, transaction in pending:
+                transaction.fingerprint = self._fingerprint(transaction)
+            existing = dict(Transaction.objects.filter(
+                user=self.user, fingerprint__in=[transaction.fingerprint for _row_num, transaction in pending]
+            ).values_list('fingerprint', 'id'))
+            for row_num, transaction in pending:
+                if transaction.fingerprint in existing:
+                    results[row_num] = {
+                        "row": row_num, "status": "duplicate", "transaction_id": existing[transaction.fingerprint]
+                    }
+            pending = [(row_num, transaction) for row_num, transaction in pending if row_num not in results]
+
+        if self.preview is not None:
+            for row_num, transaction in pending:
+                results[row_num] = {"row": row_num, "status": "new"}
+            self.preview.add_chunk(results, valid)
+        elif pending:
+            table = get_rate_table(verify=True)
+            for _row_num, transaction in pending:
+                transaction.compute_rewards(table)
+            try:
+                self._bulk_insert([transaction for _row_num, transaction in pending])
+            except DatabaseError:
+                # Find the offending rows by saving one at a time (signals do the bookkeeping)
+                for row_num, transaction in pending:
+                    transaction.pk = None
+                    transaction._state.adding = True
+                    try:
+                        transaction.save(force_insert=True)
+                    except Exception as e:
+                        results[row_num] = {
+                            "row": row_num, "status": "error", "errors": {"non_field_errors": [str(e)]}
+                        }
+            for row_num, transaction in pending:
+                if row_num not in results:
+                    results[row_num] = {"row": row_num, "status": "imported", "transaction_id": transaction.id}
+
+        for row_num, _validated_data, _errors in validated:
+            yield results[row_num]
+
+    def _fingerprint(self, transaction):
+        row = (
+            transaction.created_at.astimezone(self.tz).date(), transaction.merchant, transaction.amount,
+            transaction.card_actually_used_id,
+        )
+        self._occurrences[row] += 1
+        return row_fingerprint(self.user.pk, *row, self._occurrences[row])
+
+    def _bulk_insert(self, transactions):
+        """Insert one chunk and move the user's rollups by the chunk's totals."""
+        from .models import Transaction
+        from .rollups import rollup_values, apply_rollup_delta, lock_user_rollups
+
+        totals = defaultdict(lambda: [Decimal('0.00'), Decimal('0.00'), 0])
+        for transaction in transactions:
+            key, spend, reward = rollup_values(transaction)
+            totals[key][0] += spend
+            totals[key][1] += reward
+            totals[key][2] += 1
+        with db_transaction.atomic():
+            lock_user_rollups(self.user.pk)
+            Transaction.objects.bulk_create(transactions)
+            for key, (spend, reward, count) in totals.items():
+                apply_rollup_delta(self.user.pk, key, spend, reward, count)
+        for transaction in transactions:
+            local = transaction.created_at.astimezone(self.tz)
+            self.year_months.add(local.strftime('%Y-%m'))
+            self.years.add(local.year)
+
+    def finish(self):
+        """Replay cap usage for the imported years and evaluate each touched month's budget once."""
+        from budgets.models import MonthlyBudget
+        from budgets.services import mtd_spend, evaluate_thresholds
+        from .cap_usage import rebuild_cap_usage
+
+        if self.years:
+            rebuild_cap_usage([self.user.pk], self.years)
+        for budget in MonthlyBudget.objects.filter(user=self.user, year_month__in=self.year_months):
+            evaluate_thresholds(budget, mtd_spend(self.user, budget.year_month))
+        self.year_months.clear()
+        self.years.clear()
+
+
+# Background jobs run here, off the request thread. The upload and the job's
+# progress are stored, so a job interrupted by a restart can be picked up again
+# with `manage.py run_import_jobs`.
+_import_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'CSV_IMPORT_WORKERS', 2), thread_name_prefix="csv-import"
+)
+ENCODING_ERROR = "File encoding error: {}. Please ensure the file is UTF-8 encoded."
+
+
+def validation_workers(parallel):
+    """Worker processes for an import: None validates in this process."""
+    return getattr(settings, 'CSV_IMPORT_VALIDATION_WORKERS', 4) if parallel else None
+
+
+def start_import_job(user, uploaded_file, parallel=False, engine=SERIALIZER):
+    """Store the upload as a CSVImportJob and start it once the current DB transaction commits."""
+    from .models import CSVImportJob
+
+    job = CSVImportJob.objects.create(user=user, file=uploaded_file, parallel=parallel, engine=engine)
+    db_transaction.on_commit(lambda: _import_executor.submit(_import_worker, job.pk))
+    return job
+
+
+def _count_rows(file):
+    """Data rows in the file; a row that can't be decoded counts as the last one."""
+    count = 0
+    try:
+        for _row in iter_csv_rows(file):
+            count += 1
+    except (CSVEncodingError, csv.Error):
+        count += 1
+    return count
+
+
+def run_import_job(job_id, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Process a pending job, or resume an interrupted one: rows an earlier run
+    already reported are skipped. Progress is saved after every chunk.
+
+    Returns:
+        CSVImportJob: The job, finished
+    """
+    from .models import CSVImportJob
+
+    job = CSVImportJob.objects.select_related('user').get(pk=job_id)
+    if job.status in (CSVImportJob.DONE, CSVImportJob.FAILED):
+        return job
+    job.status = CSVImportJob.RUNNING
+    job.save(update_fields=['status', 'updated_at'])
+
+    progress_fields = ['processed_rows', 'imported_count', 'duplicate_count', 'failed_count', 'failures', 'updated_at']
+    importer = TransactionImporter(
+        job.user, chunk_rows=chunk_rows, workers=validation_workers(job.parallel), engine=job.engine,
+    )
+    done = job.processed_rows
+    try:
+        with job.file.open('rb') as file:
+            if job.total_rows is None:
+                job.total_rows = _count_rows(file)
+                job.save(update_fields=['total_rows', 'updated_at'])
+            for result in importer.import_file(file, skip_rows=done):
+                job.processed_rows += 1
+                if result["status"] == "imported":
+                    job.imported_count += 1
+                elif result["status"] == "duplicate":
+                    job.duplicate_count += 1
+                else:
+                    job.failed_count += 1
+                    job.failures.append(result)
+                if job.processed_rows % chunk_rows == 0:
+                    job.save(update_fields=progress_fields)
+    except CSVEncodingError as e:
+        job.status, job.error = CSVImportJob.FAILED, ENCODING_ERROR.format(e)
+    except csv.Error as e:
+        _stop_at_unreadable_row(job, job.processed_rows + 2, f"CSV parsing error: {e}")
+    finally:
+        importer.finish()
+
+    if job.status == CSVImportJob.RUNNING:
+        job.status = CSVImportJob.DONE
+    job.total_rows = max(job.total_rows or 0, job.processed_rows)
+    job.finished_at = timezone.now()
+    job.save(update_fields=progress_fields + ['status', 'error', 'total_rows', 'finished_at'])
+    _delete_upload(job)
+    return job
+
+
+def _delete_upload(job):
+    """A finished job's upload is never read again; only its counts and failures are kept."""
+    if job.file:
+        job.file.delete(save=False)
+        job.save(update_fields=['file', 'updated_at'])
+
+
+def _stop_at_unreadable_row(job, row, message):
+    """Like a synchronous import: fail the job if nothing was read, else report the row."""
+    if not job.processed_rows:
+        job.status, job.error = job.FAILED, message
+        return
+    job.processed_rows += 1
+    job.failed_count += 1
+    job.failures.append({"row": row, "status": "error", "errors": {"non_field_errors": [message]}})
+
+
+def _import_worker(job_id):
+    from .models import CSVImportJob
+
+    try:
+        run_import_job(job_id)
+    except Exception:
+        logger.exception("CSV import job %s failed", job_id)
+        CSVImportJob.objects.filter(pk=job_id).update(
+            status=CSVImportJob.FAILED, error="Import failed unexpectedly.", finished_at=timezone.now(),
+        )
+        job = CSVImportJob.objects.filter(pk=job_id).first()
+        if job is not None:
+            _delete_upload(job)
+    finally:
+        # Worker threads get their own DB connection; don't leak it
+        connection.close()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from transactions.cap_usage import rebuild_cap_usage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the reward cap usage counters by replaying stored transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='Only rebuild counters for this user id (can be repeated)',
+        )
+        parser.add_argument(
+            '--year',
+            type=int,
+            action='append',
+            dest='years',
+            help='Only rebuild counters for this calendar year (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        scope = f"{len(user_ids)} user(s)" if user_ids else "all users"
+        self.stdout.write(f"Rebuilding reward cap usage for {scope}...")
+
+        written = rebuild_cap_usage(user_ids, options['years'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"\nCompleted! Wrote {written} cap usage rows")
+        )
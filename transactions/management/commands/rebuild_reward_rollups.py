@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from transactions.rollups import rebuild_reward_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly reward rollups from stored transactions (repairs drifted totals)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='Only rebuild rollups for this user id (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        scope = f"{len(user_ids)} user(s)" if user_ids else "all users"
+        self.stdout.write(f"Rebuilding reward rollups for {scope}...")
+
+        written = rebuild_reward_rollups(user_ids)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"\nCompleted! Wrote {written} rollup rows")
+        )
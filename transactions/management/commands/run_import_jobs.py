@@ -0,0 +1,29 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from transactions.csv_import import run_import_job
+from transactions.models import CSVImportJob
+
+
+class Command(BaseCommand):
+    help = 'Run queued CSV import jobs and resume the ones interrupted by a restart'
+
+    def handle(self, *args, **options):
+        # RUNNING jobs save progress after every chunk: one saved recently may still be
+        # live in a web process, so it's only taken over once its lease has run out
+        lease = timedelta(seconds=getattr(settings, 'CSV_IMPORT_JOB_LEASE', 600))
+        job_ids = list(
+            CSVImportJob.objects.filter(status__in=[CSVImportJob.PENDING, CSVImportJob.RUNNING])
+            .exclude(status=CSVImportJob.RUNNING, updated_at__gt=timezone.now() - lease)
+            .order_by('created_at').values_list('id', flat=True)
+        )
+        self.stdout.write(f"Running {len(job_ids)} CSV import job(s)...")
+
+        for job_id in job_ids:
+            job = run_import_job(job_id)
+            self.stdout.write(
+                f"Job {job.id}: {job.status}, {job.imported_count} imported, {job.failed_count} failed"
+            )
+
+        self.stdout.write(self.style.SUCCESS("\nCompleted!"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from transactions.models import RewardBackfillRequest
+from transactions.rewards import run_pending_backfill
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored transaction rewards for every queued reward backfill request'
+
+    def handle(self, *args, **options):
+        pending = RewardBackfillRequest.objects.count()
+        self.stdout.write(f"Running {pending} queued reward backfill request(s)...")
+
+        updated = run_pending_backfill()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"\nCompleted! Updated {updated} transactions")
+        )
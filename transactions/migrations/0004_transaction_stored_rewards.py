@@ -0,0 +1,65 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:21
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def populate_stored_rewards(apps, schema_editor):
+    """Fill the new reward columns for existing transactions."""
+    RewardRule = apps.get_model('cards', 'RewardRule')
+    Transaction = apps.get_model('transactions', 'Transaction')
+
+    best = {}
+    for card_id, categories, multiplier in RewardRule.objects.values_list('card_id', 'category', 'multiplier'):
+        if not multiplier:
+            continue
+        if isinstance(categories, str):
+            categories = [cat.strip() for cat in categories.split(',')]
+        for category in categories:
+            if multiplier > best.get((card_id, category), Decimal('0.00')):
+                best[(card_id, category)] = multiplier
+
+    def reward(tx, card_id):
+        if not card_id or not tx.category:
+            return Decimal('0.00')
+        multiplier = best.get((card_id, tx.category)) or best.get((card_id, 'OTHER'), Decimal('0.00'))
+        return (tx.amount * multiplier / Decimal('100')).quantize(Decimal('0.01'))
+
+    batch = []
+    for tx in Transaction.objects.all().iterator(chunk_size=1000):
+        tx.actual_reward = reward(tx, tx.card_actually_used_id)
+        tx.optimal_reward = reward(tx, tx.recommended_card_id)
+        tx.missed_reward = tx.optimal_reward - tx.actual_reward
+        batch.append(tx)
+        if len(batch) >= 1000:
+            Transaction.objects.bulk_update(batch, ['actual_reward', 'optimal_reward', 'missed_reward'])
+            batch = []
+    if batch:
+        Transaction.objects.bulk_update(batch, ['actual_reward', 'optimal_reward', 'missed_reward'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0017_alter_cardbenefit_benefits'),
+        ('transactions', '0003_rename_card_to_card_actually_used'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='actual_reward',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, help_text='Reward from the card actually used (0 if no card specified)', max_digits=10, verbose_name='Actual Reward ($)'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='missed_reward',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, help_text='Difference between optimal and actual rewards (positive = missed opportunity)', max_digits=10, verbose_name='Missed Reward ($)'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='optimal_reward',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, help_text='Reward from the recommended (optimal) card', max_digits=10, verbose_name='Optimal Reward ($)'),
+        ),
+        migrations.RunPython(populate_stored_rewards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:28
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_reward_rollups(apps, schema_editor):
+    """Build rollups for existing transactions (months in UTC, the default user timezone)."""
+    Transaction = apps.get_model('transactions', 'Transaction')
+    MonthlyRewardRollup = apps.get_model('transactions', 'MonthlyRewardRollup')
+
+    totals = {}
+    for tx in Transaction.objects.all().iterator(chunk_size=1000):
+        if tx.card_actually_used_id:
+            card_id, reward = tx.card_actually_used_id, tx.actual_reward
+        else:
+            card_id, reward = tx.recommended_card_id, tx.optimal_reward
+        key = (tx.user_id, tx.created_at.strftime('%Y-%m'), card_id, tx.category)
+        spend, total_reward, count = totals.get(key, (Decimal('0.00'), Decimal('0.00'), 0))
+        totals[key] = (spend + tx.amount, total_reward + reward, count + 1)
+
+    MonthlyRewardRollup.objects.bulk_create([
+        MonthlyRewardRollup(
+            user_id=user_id, year_month=year_month, card_id=card_id, category=category,
+            spend=spend, reward=reward, transaction_count=count,
+        )
+        for (user_id, year_month, card_id, category), (spend, reward, count) in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0017_alter_cardbenefit_benefits'),
+        ('transactions', '0004_transaction_stored_rewards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRewardRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year_month', models.CharField(max_length=7)),
+                ('category', models.CharField(choices=[('SELECTED_CATEGORIES', 'Selected Categories'), ('RENT', 'Rent'), ('ONLINE_SHOPPING', 'Online Shopping'), ('DINING', 'Dining'), ('GROCERIES', 'Groceries'), ('PHARMACY', 'Pharmacy'), ('GAS', 'Gas'), ('GENERAL_TRAVEL', 'General Travel'), ('AIRLINE_TRAVEL', 'Airline Travel'), ('HOTEL_TRAVEL', 'Hotel Travel'), ('TRANSIT', 'Transit'), ('ENTERTAINMENT', 'Entertainment'), ('OTHER', 'Other')], max_length=255)),
+                ('spend', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Spend ($)')),
+                ('reward', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Reward ($)')),
+                ('transaction_count', models.IntegerField(default=0)),
+                ('card', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='cards.card')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reward_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'year_month'], name='transaction_user_id_10af39_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'year_month', 'card', 'category'), name='uniq_reward_rollup')],
+            },
+        ),
+        migrations.RunPython(populate_reward_rollups, migrations.RunPython.noop),
+    ]
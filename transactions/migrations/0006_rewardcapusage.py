@@ -0,0 +1,100 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:57
+
+from collections import defaultdict
+from decimal import ROUND_HALF_EVEN
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_cap_usage(apps, schema_editor):
+    """Replay existing transactions into cap usage counters (years in UTC, the default user timezone)."""
+    RewardRule = apps.get_model('cards', 'RewardRule')
+    Transaction = apps.get_model('transactions', 'Transaction')
+    RewardCapUsage = apps.get_model('transactions', 'RewardCapUsage')
+
+    # (multiplier, cap in cents or None, rule_id) per (card, category), best multiplier first
+    matching = {}
+    for rule_id, card_id, categories, multiplier, cap_amount in RewardRule.objects.order_by('id').values_list(
+        'id', 'card_id', 'category', 'multiplier', 'cap_amount'
+    ):
+        if not multiplier:
+            continue
+        if isinstance(categories, str):
+            categories = [cat.strip() for cat in categories.split(',')]
+        cap_cents = int(cap_amount * 100) if cap_amount is not None else None
+        for category in categories:
+            matching.setdefault((card_id, category), []).append((multiplier, cap_cents, rule_id))
+    for rules in matching.values():
+        rules.sort(key=lambda rule: rule[0], reverse=True)
+
+    chains = {}
+
+    def rule_chain(card_id, category):
+        # The category's own rules, then the card's OTHER rules, up to the first uncapped one
+        key = (card_id, category)
+        if key not in chains:
+            candidates = matching.get(key, [])
+            if category != 'OTHER':
+                candidates = candidates + matching.get((card_id, 'OTHER'), [])
+            chain = []
+            for rule in candidates:
+                chain.append(rule)
+                if rule[1] is None:
+                    break
+            chains[key] = chain
+        return chains[key]
+
+    used = defaultdict(int)  # (user_id, card_id, rule_id, year) → capped spend in cents
+    transactions = Transaction.objects.order_by('created_at', 'id').values_list(
+        'user_id', 'created_at', 'amount', 'category', 'card_actually_used_id', 'recommended_card_id'
+    )
+    for user_id, created_at, amount, category, card_used, recommended in transactions.iterator(chunk_size=1000):
+        card_id = card_used or recommended
+        if not card_id or not category:
+            continue
+        remaining = int((amount * 100).to_integral_value(rounding=ROUND_HALF_EVEN))
+        for _multiplier, cap_cents, rule_id in rule_chain(card_id, category):
+            if cap_cents is None:
+                break
+            key = (user_id, card_id, rule_id, created_at.year)
+            portion = min(remaining, max(cap_cents - used[key], 0))
+            used[key] += portion
+            remaining -= portion
+            if not remaining:
+                break
+
+    RewardCapUsage.objects.bulk_create([
+        RewardCapUsage(user_id=user_id, card_id=card_id, rule_id=rule_id, year=year, used_cents=used_cents)
+        for (user_id, card_id, rule_id, year), used_cents in used.items()
+        if used_cents
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0018_rewardrulecategory'),
+        ('transactions', '0005_monthlyrewardrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RewardCapUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('used_cents', models.BigIntegerField(default=0)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cards.card')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cards.rewardrule')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reward_cap_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'year'], name='transaction_user_id_86ecaa_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'rule', 'year'), name='uniq_reward_cap_usage')],
+            },
+        ),
+        migrations.RunPython(populate_cap_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_rewardcapusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RewardBackfillRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card_id', models.BigIntegerField(unique=True)),
+                ('requested_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:12
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_no_card_rollups(apps, schema_editor):
+    """Fold rollup rows without a card that were created twice into one row."""
+    MonthlyRewardRollup = apps.get_model('transactions', 'MonthlyRewardRollup')
+
+    duplicates = (
+        MonthlyRewardRollup.objects.filter(card__isnull=True)
+        .values('user_id', 'year_month', 'category')
+        .annotate(rows=Count('id'), spend_total=Sum('spend'), reward_total=Sum('reward'),
+                  count_total=Sum('transaction_count'))
+        .filter(rows__gt=1)
+    )
+    for group in list(duplicates):
+        rows = MonthlyRewardRollup.objects.filter(
+            card__isnull=True, user_id=group['user_id'], year_month=group['year_month'], category=group['category'],
+        ).order_by('id')
+        keep = rows.first()
+        rows.exclude(pk=keep.pk).delete()
+        keep.spend, keep.reward = group['spend_total'], group['reward_total']
+        keep.transaction_count = group['count_total']
+        keep.save(update_fields=['spend', 'reward', 'transaction_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0019_rewardrateversion'),
+        ('transactions', '0007_rewardbackfillrequest'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(merge_duplicate_no_card_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='monthlyrewardrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('card__isnull', True)), fields=('user', 'year_month', 'category'), name='uniq_reward_rollup_no_card'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0010_transaction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvimportjob',
+            name='parallel',
+            field=models.BooleanField(default=False),
+        ),
+    ]
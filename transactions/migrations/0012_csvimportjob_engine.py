@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0011_csvimportjob_parallel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvimportjob',
+            name='engine',
+            field=models.CharField(choices=[('serializer', 'Serializer'), ('columnar', 'Columnar')], default='serializer', max_length=10),
+        ),
+    ]
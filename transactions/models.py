@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction as db_transaction
 from django.conf import settings
+from django.utils import timezone
 from cards.models import Card, RewardRule
+from cards.rates import get_rate_table
+from .cents import reward_cents, cents_to_decimal
 from decimal import Decimal
 
 # Create your models here.
@@ -29,69 +32,208 @@ class Transaction(models.Model):
     merchant = models.CharField(max_length=255)
     amount = models.DecimalField("Amount ($)", max_digits=10, decimal_places=2)
     category = models.CharField(max_length=255, choices=RewardRule.CATEGORY_CHOICES)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Defaults to now; imports pass the purchase date so backdated rows are a single insert
+    created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     notes = models.TextField(blank=True, null=True)
+    # Hash of an imported CSV row (user, date, merchant, amount, card), so re-imports
+    # skip rows that already exist; None for transactions not created by an import
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False, db_index=True)
+    
+    # Stored rewards, filled in on save and refreshed by the reward backfill
+    # (transactions.rewards.backfill_transaction_rewards) when reward rules change
+    actual_reward = models.DecimalField(
+        "Actual Reward ($)", max_digits=10, decimal_places=2, default=Decimal('0.00'), editable=False,
+        help_text="Reward from the card actually used (0 if no card specified)"
+    )
+    optimal_reward = models.DecimalField(
+        "Optimal Reward ($)", max_digits=10, decimal_places=2, default=Decimal('0.00'), editable=False,
+        help_text="Reward from the recommended (optimal) card"
+    )
+    missed_reward = models.DecimalField(
+        "Missed Reward ($)", max_digits=10, decimal_places=2, default=Decimal('0.00'), editable=False,
+        help_text="Difference between optimal and actual rewards (positive = missed opportunity)"
+    )
+
+    REWARD_FIELDS = ("actual_reward", "optimal_reward", "missed_reward")
+    # Stored values the rollup and cap usage signals depend on (transactions/signals.py)
+    TRACKED_FIELDS = (
+        "user_id", "created_at", "amount", "category", "card_actually_used_id", "recommended_card_id",
+        "actual_reward", "optimal_reward",
+    )
 
     def __str__(self):
         return f"{self.merchant} - ${self.amount} ({self.user.username})"
     
-    def _calculate_reward_for_card(self, card):
-        """Helper method to calculate reward for a specific card"""
-        if not card or not self.category:
-            return Decimal('0.00')
-        
-        # Get all reward rules for this card
-        reward_rules = RewardRule.objects.filter(card=card)
-        best_multiplier = Decimal('0.00')
-        best_other_multiplier = Decimal('0.00')  # Fallback for base rate
+    def _reward_cents_for_card(self, card_id, table=None):
+        """Reward for a specific card in integer cents"""
+        if not card_id or not self.category:
+            return 0
         
-        for rule in reward_rules:
-            # Check if transaction category matches rule category
-            categories = rule.category
-            if isinstance(categories, str):
-                categories = [cat.strip() for cat in categories.split(',')]
-            
-            # Track the best OTHER (base rate) multiplier as fallback
-            if 'OTHER' in categories:
-                if rule.multiplier and rule.multiplier > best_other_multiplier:
-                    best_other_multiplier = rule.multiplier
-            
-            # Check for exact category match
-            if self.category in categories:
-                if rule.multiplier and rule.multiplier > best_multiplier:
-                    best_multiplier = rule.multiplier
+        # Best rate for this card/category in basis points, OTHER fallback already applied
+        bps = (table or get_rate_table()).bps(card_id, self.category)
         
-        # If no specific category bonus found, fall back to OTHER (base rate)
-        if best_multiplier == Decimal('0.00') and best_other_multiplier > Decimal('0.00'):
-            best_multiplier = best_other_multiplier
-        
-        # Calculate reward: amount × multiplier ÷ 100
-        reward = (self.amount * best_multiplier) / Decimal('100')
-        return reward.quantize(Decimal('0.01'))
+        # reward = amount × multiplier ÷ 100, quantized to cents (see transactions/cents.py)
+        amount = self._meta.get_field('amount').to_python(self.amount)
+        return reward_cents(amount, bps)
     
-    @property
-    def actual_reward(self):
-        """Reward from card actually used (0 if no card specified)"""
-        if not self.card_actually_used:
-            return Decimal('0.00')  # No card used = no rewards earned
-        return self._calculate_reward_for_card(self.card_actually_used)
+    def _calculate_reward_for_card(self, card_id):
+        """Helper method to calculate reward for a specific card"""
+        return cents_to_decimal(self._reward_cents_for_card(card_id))
     
-    @property
-    def optimal_reward(self):
-        """Reward from the recommended (optimal) card"""
-        return self._calculate_reward_for_card(self.recommended_card)
+    def compute_rewards(self, table=None):
+        """Recompute actual/optimal/missed rewards from the current reward rules"""
+        # No card used = no rewards earned
+        actual = self._reward_cents_for_card(self.card_actually_used_id, table)
+        optimal = self._reward_cents_for_card(self.recommended_card_id, table)
+        self.actual_reward = cents_to_decimal(actual)
+        self.optimal_reward = cents_to_decimal(optimal)
+        self.missed_reward = cents_to_decimal(optimal - actual)
     
-    @property
-    def missed_reward(self):
-        """Difference between optimal and actual rewards (positive = missed opportunity)"""
-        return self.optimal_reward - self.actual_reward
+    def save(self, *args, **kwargs):
+        # Stored rewards are never revisited unless a rule changes again, so check
+        # the table against the database version (rules may have changed in another process)
+        self.compute_rewards(get_rate_table(verify=True))
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, *self.REWARD_FIELDS}
+        # The row and its signal-maintained rollups / cap usage commit together
+        with db_transaction.atomic():
+            super().save(*args, **kwargs)
     
     @property
     def used_optimal_card(self):
         """True only if user explicitly used the recommended card"""
-        if not self.card_actually_used:
+        if not self.card_actually_used_id:
             return False  # No card specified - can't verify optimization
-        if not self.recommended_card:
+        if not self.recommended_card_id:
             return True  # No recommendation available, so any card is fine
-        return self.card_actually_used.id == self.recommended_card.id
\ No newline at end of file
+        return self.card_actually_used_id == self.recommended_card_id
+
+
+class MonthlyRewardRollup(models.Model):
+    """Per-user monthly spend and reward totals by card and category.
+    Key is (user, year_month, card, category). Kept current by the Transaction
+    signals in transactions/signals.py; rebuild with `manage.py rebuild_reward_rollups`."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="reward_rollups")
+    year_month = models.CharField(max_length=7)  # YYYY-MM format, in the user's timezone
+    # Card the reward is credited to (card actually used, else recommended card).
+    # No FK constraint: rows for a deleted card are fixed up by the reward backfill.
+    card = models.ForeignKey(
+        Card,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+        null=True,
+        blank=True,
+    )
+    category = models.CharField(max_length=255, choices=RewardRule.CATEGORY_CHOICES)
+    spend = models.DecimalField("Spend ($)", max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    reward = models.DecimalField("Reward ($)", max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    transaction_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "year_month", "card", "category"],
+                name="uniq_reward_rollup",
+            ),
+            # NULLs are distinct in the constraint above, so rows without a card need their own
+            models.UniqueConstraint(
+                fields=["user", "year_month", "category"],
+                condition=models.Q(card__isnull=True),
+                name="uniq_reward_rollup_no_card",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "year_month"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.year_month} {self.category}: ${self.spend} / ${self.reward}"
+
+
+class RewardBackfillRequest(models.Model):
+    """A card whose stored transaction rewards must be recomputed.
+    Written in the same DB transaction as the RewardRule/Card change, so queued
+    backfills survive restarts; run with `manage.py run_reward_backfill`."""
+    card_id = models.BigIntegerField(unique=True)  # Plain id: the card may already be deleted
+    requested_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Backfill card {self.card_id} (requested {self.requested_at:%Y-%m-%d %H:%M})"
+
+
+class RewardCapUsage(models.Model):
+    """Capped-bonus spend used so far per (user, rule, year), in cents.
+    Mirrors CapLedger in transactions/rewards.py: kept current by the Transaction
+    signals in transactions/signals.py; rebuild with `manage.py rebuild_cap_usage`."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="reward_cap_usage")
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name="+")
+    rule = models.ForeignKey(RewardRule, on_delete=models.CASCADE, related_name="+")
+    year = models.PositiveIntegerField()  # Calendar year, in the user's timezone
+    used_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "rule", "year"],
+                name="uniq_reward_cap_usage",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "year"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.year} rule {self.rule_id}: {self.used_cents}¢ used"
+
+
+class CSVImportJob(models.Model):
+    """A CSV import running in the background (transactions/csv_import.py).
+    Progress and failed rows are saved after every chunk, so clients can poll the
+    status endpoint again after a disconnect; unfinished jobs are resumed by
+    `manage.py run_import_jobs`."""
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="csv_import_jobs")
+    file = models.FileField(upload_to="csv_imports/%Y/%m/")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    parallel = models.BooleanField(default=False)  # Validate rows in a process pool
+    # Validation engine (csv_import.SERIALIZER / COLUMNAR)
+    engine = models.CharField(
+        max_length=10, choices=[("serializer", "Serializer"), ("columnar", "Columnar")], default="serializer"
+    )
+    total_rows = models.PositiveIntegerField(null=True, blank=True)  # Known once the file has been counted
+    processed_rows = models.PositiveIntegerField(default=0)
+    imported_count = models.PositiveIntegerField(default=0)
+    duplicate_count = models.PositiveIntegerField(default=0)  # Rows already imported before
+    failed_count = models.PositiveIntegerField(default=0)
+    failures = models.JSONField(default=list)  # Result dicts of the rows that failed, in row order
+    error = models.TextField(blank=True, default="")  # Why the job stopped, if it couldn't finish
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status"]),
+        ]
+
+    @property
+    def remaining_rows(self):
+        if self.total_rows is None:
+            return None
+        return max(self.total_rows - self.processed_rows, 0)
+
+    def __str__(self):
+        return f"CSV import {self.pk} ({self.user.username}): {self.status}, {self.processed_rows} rows"
@@ -2,8 +2,24 @@
 Rewards calculation service for transactions.
 Calculates cashback/points based on card reward rules and transaction categories.
 """
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from decimal import Decimal
-from cards.models import RewardRule
+import numpy as np
+from django.db import connection, transaction as db_transaction
+from django.db.models import Case, When, Value, F, Q, Sum, IntegerField
+from django.db.models.functions import Coalesce, Floor, Mod, Round
+from django.db.models.lookups import Exact, GreaterThan
+from cards.rates import get_rate_table, invalidate_rate_table
+from .cents import (
+    round_half_even, round_half_even_array, to_cents, reward_cents, cents_to_decimal,
+    decimals_to_cents_array,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def calculate_transaction_reward(transaction):
@@ -19,48 +35,39 @@ def calculate_transaction_reward(transaction):
         Decimal: Reward amount earned (in dollars/cashback)
     """
     # Use recommended_card if card is not specified (recommendation scenario)
-    card_to_use = transaction.card_actually_used or transaction.recommended_card
+    card_id = transaction.card_actually_used_id or transaction.recommended_card_id
     
-    if not card_to_use or not transaction.category:
+    if not card_id or not transaction.category:
         return Decimal('0.00')
     
-    # Get all reward rules for this card
-    reward_rules = RewardRule.objects.filter(card=card_to_use)
-    
-    best_multiplier = Decimal('0.00')
-    best_other_multiplier = Decimal('0.00')  # Fallback for base rate
+    # Best rate from the compiled rate table (no per-transaction queries), in basis points
+    bps = get_rate_table().bps(card_id, transaction.category)
     
-    for rule in reward_rules:
-        # Check if transaction category matches rule category
-        # rule.category can be a string or comma-separated list from MultiSelectField
-        categories = rule.category
-        if isinstance(categories, str):
-            categories = [cat.strip() for cat in categories.split(',')]
-        
-        # Track the best OTHER (base rate) multiplier as fallback
-        if 'OTHER' in categories:
-            if rule.multiplier and rule.multiplier > best_other_multiplier:
-                best_other_multiplier = rule.multiplier
-        
-        # Check for exact category match
-        if transaction.category in categories:
-            if rule.multiplier and rule.multiplier > best_multiplier:
-                best_multiplier = rule.multiplier
+    # Calculate reward: amount × multiplier ÷ 100 (if multiplier is percentage)
+    # Most cards use percentage (e.g., 3% back = multiplier of 3.00),
+    # computed in integer cents and quantized like Decimal.quantize(Decimal('0.01'))
+    return cents_to_decimal(reward_cents(transaction.amount, bps))
+
+
+def _user_transactions(user, start_date=None, end_date=None):
+    from transactions.models import Transaction
     
-    # If no specific category bonus found, fall back to OTHER (base rate)
-    if best_multiplier == Decimal('0.00') and best_other_multiplier > Decimal('0.00'):
-        best_multiplier = best_other_multiplier
+    transactions = Transaction.objects.filter(user=user)
     
-    # Calculate reward: amount × multiplier ÷ 100 (if multiplier is percentage)
-    # Most cards use percentage (e.g., 3% back = multiplier of 3.00)
-    reward = (transaction.amount * best_multiplier) / Decimal('100')
+    if start_date:
+        transactions = transactions.filter(created_at__gte=start_date)
+    if end_date:
+        transactions = transactions.filter(created_at__lte=end_date)
     
-    return reward.quantize(Decimal('0.01'))
+    return transactions
 
 
-def calculate_total_rewards(user, start_date=None, end_date=None):
+def calculate_rewards_batch(user, start_date=None, end_date=None):
     """
-    Calculate total rewards earned by a user across all transactions.
+    Calculate total and per-card rewards for a user in one pass.
+    Pulls (amount, category, card) columns with a single values_list query and
+    computes every reward as NumPy array operations against the rate matrix.
+    Each row is rounded to cents exactly like calculate_transaction_reward.
     
     Args:
         user: User object
@@ -68,26 +75,250 @@ def calculate_total_rewards(user, start_date=None, end_date=None):
         end_date: Optional end date filter
     
     Returns:
-        Decimal: Total rewards earned
+        tuple: (total_rewards, {card_id: reward_amount})
     """
-    from transactions.models import Transaction
+    rows = list(
+        _user_transactions(user, start_date, end_date)
+        .annotate(reward_card_id=Coalesce('card_actually_used', 'recommended_card'))
+        .values_list('amount', 'category', 'reward_card_id')
+    )
+    if not rows:
+        return Decimal('0.00'), {}
     
-    transactions = Transaction.objects.filter(user=user)
+    amounts, categories, card_ids = zip(*rows)
+    row_index, column_index, matrix = get_rate_table().bps_matrix()
+    unknown_column = matrix.shape[1] - 1
+    
+    cents = decimals_to_cents_array(amounts)
+    columns = np.fromiter(
+        (column_index.get(category, unknown_column) for category in categories),
+        dtype=np.int64, count=len(rows),
+    )
+    has_category = np.fromiter((bool(category) for category in categories), dtype=bool, count=len(rows))
+    # Group rows by card once; transactions without a card land on id 0
+    unique_cards, card_positions = np.unique(
+        np.fromiter((card_id or 0 for card_id in card_ids), dtype=np.int64, count=len(rows)),
+        return_inverse=True,
+    )
+    card_rows = np.array([row_index.get(int(card_id), 0) for card_id in unique_cards], dtype=np.int64)
+    
+    # reward = amount × multiplier ÷ 100 → cents × bps ÷ 10000, rounded to cents
+    bps = np.where(has_category, matrix[card_rows[card_positions], columns], 0)
+    reward_cents = round_half_even_array(cents * bps, 10000)
+    
+    card_totals = np.zeros(len(unique_cards), dtype=np.int64)
+    np.add.at(card_totals, card_positions, reward_cents)
+    
+    rewards_by_card = {
+        int(card_id): cents_to_decimal(total)
+        for card_id, total in zip(unique_cards, card_totals)
+        if card_id  # Skip transactions without any card
+    }
+    return cents_to_decimal(reward_cents.sum()), rewards_by_card
+
+
+def _sql_rate_expression(table):
+    """
+    CASE expression acting as the per-(card, category) rate relation, in basis points.
+    Cards sharing a rate in a category are grouped into one WHEN ... IN (...) branch,
+    so the expression grows with the number of distinct rates, not with transactions.
+    """
+    groups = {}
+    for (card_id, category), multiplier in table.items():
+        if multiplier:
+            groups.setdefault((category, int(multiplier * 100)), []).append(card_id)
+    base_groups = {}
+    for card_id, multiplier in table.base_rates().items():
+        if multiplier:
+            base_groups.setdefault(int(multiplier * 100), []).append(card_id)
+    
+    whens = [When(category='', then=Value(0))]
+    whens += [
+        When(category=category, reward_card_id__in=card_ids, then=Value(bps))
+        for (category, bps), card_ids in groups.items()
+    ]
+    # Categories outside CATEGORY_CHOICES fall back to the base (OTHER) rate
+    whens += [
+        When(~Q(category__in=[category for category, _bps in groups]), reward_card_id__in=card_ids, then=Value(bps))
+        for bps, card_ids in base_groups.items()
+    ]
+    return Case(*whens, default=Value(0), output_field=IntegerField())
+
+
+def _annotate_reward_cents(transactions):
+    """
+    Annotate reward_cents = amount × rate ÷ 100, rounded half-even to cents in SQL,
+    so database sums match calculate_transaction_reward row by row.
+    """
+    transactions = transactions.annotate(
+        reward_card_id=Coalesce('card_actually_used', 'recommended_card'),
+    ).annotate(
+        reward_bps=_sql_rate_expression(get_rate_table()),
+    ).annotate(
+        # cents × bps is an exact integer; reward in cents = that ÷ 10000
+        reward_units=Round(F('amount') * 100, output_field=IntegerField()) * F('reward_bps'),
+    ).annotate(
+        reward_floor=Floor(F('reward_units') / Value(10000.0), output_field=IntegerField()),
+    ).annotate(
+        reward_remainder=F('reward_units') - F('reward_floor') * 10000,
+    )
+    return transactions.annotate(
+        reward_cents=F('reward_floor') + Case(
+            When(GreaterThan(F('reward_remainder'), 5000), then=Value(1)),
+            When(
+                Exact(F('reward_remainder'), 5000) & Exact(Mod('reward_floor', Value(2)), 1),
+                then=Value(1),
+            ),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+    )
+
+
+def calculate_total_rewards_in_database(user, start_date=None, end_date=None):
+    """
+    Total rewards computed by the database in a single aggregate query.
+    Returns the same value as calculate_total_rewards.
+    """
+    transactions = _annotate_reward_cents(_user_transactions(user, start_date, end_date))
+    total = transactions.aggregate(total=Sum('reward_cents'))['total']
+    return cents_to_decimal(round(total or 0))
+
+
+def calculate_rewards_by_card_in_database(user, start_date=None, end_date=None):
+    """
+    Per-card rewards computed by the database in a single grouped query.
+    Returns the same value as calculate_rewards_by_card.
+    """
+    transactions = _annotate_reward_cents(_user_transactions(user, start_date, end_date))
+    rows = (
+        transactions
+        .filter(reward_card_id__isnull=False)
+        .values('reward_card_id')
+        .annotate(total=Sum('reward_cents'))
+        .values_list('reward_card_id', 'total')
+    )
+    return {card_id: cents_to_decimal(round(total)) for card_id, total in rows}
+
+
+class CapLedger:
+    """
+    Running cap consumption for one user: capped-bonus spend used so far, in cents,
+    per (card_id, rule_id, year). Purchases must be charged in chronological order.
+    """
+    
+    def __init__(self, table=None):
+        self.table = table or get_rate_table()
+        self.used = defaultdict(int)
+    
+    def charge(self, card_id, category, cents, year, rule_ids=None):
+        """
+        Charge a purchase against the card's rule chain and return its reward in cents.
+        Spend fills each capped rule up to its annual cap, then falls through to the
+        next rule and finally to the base (OTHER) rate. With rule_ids, other rules are skipped.
+        """
+        # Round half-even to cents, like Decimal.quantize
+        return round_half_even(self._fill(card_id, category, cents, year, record=True, rule_ids=rule_ids), 10000)
+    
+    def quote(self, card_id, category, cents, year, rule_ids=None):
+        """
+        Reward a purchase would earn right now, in 1/10000 cents (cents × bps),
+        without consuming any cap headroom. With rule_ids, other rules are skipped.
+        """
+        return self._fill(card_id, category, cents, year, record=False, rule_ids=rule_ids)
+    
+    def _fill(self, card_id, category, cents, year, record, rule_ids=None):
+        remaining = cents
+        units = 0  # reward in 1/10000 cents (cents × bps)
+        for bps, cap_cents, rule_id in self.table.rule_chain(card_id, category):
+            if rule_ids is not None and rule_id not in rule_ids:
+                continue
+            if cap_cents is None:
+                portion = remaining
+            else:
+                key = (card_id, rule_id, year)
+                portion = min(remaining, max(cap_cents - self.used.get(key, 0), 0))
+                if record:
+                    self.used[key] += portion
+            units += portion * bps
+            remaining -= portion
+            if not remaining:
+                break
+        return units
+
+
+def calculate_capped_rewards(user, start_date=None, end_date=None):
+    """
+    Calculate rewards honoring each rule's annual cap_amount (a spend cap).
+    Walks the user's transactions once in chronological order with a CapLedger,
+    so each purchase only earns the bonus rate on the cap headroom left that year
+    and the rest at the base rate. Spend earlier in the year than start_date still
+    counts toward the caps.
+    
+    Args:
+        user: User object
+        start_date: Optional start date filter
+        end_date: Optional end date filter
     
+    Returns:
+        tuple: (total_rewards, {card_id: reward_amount})
+    """
+    from budgets.services import get_user_timezone
+    
+    tz = get_user_timezone(user)
+    transactions = _user_transactions(user, end_date=end_date)
     if start_date:
-        transactions = transactions.filter(created_at__gte=start_date)
-    if end_date:
-        transactions = transactions.filter(created_at__lte=end_date)
+        # Caps are annual, so replay from January 1st of start_date's year (in the
+        # user's timezone, like the ledger years)
+        transactions = transactions.filter(created_at__gte=datetime(start_date.year, 1, 1, tzinfo=tz)).annotate(
+            in_range=Case(When(created_at__gte=start_date, then=Value(True)), default=Value(False))
+        )
+    else:
+        transactions = transactions.annotate(in_range=Value(True))
+    rows = (
+        transactions
+        .annotate(reward_card_id=Coalesce('card_actually_used', 'recommended_card'))
+        .order_by('created_at', 'id')
+        .values_list('created_at', 'amount', 'category', 'reward_card_id', 'in_range')
+    )
+    
+    ledger = CapLedger()
+    total_cents = 0
+    cents_by_card = {}
+    for created_at, amount, category, card_id, in_range in rows.iterator(chunk_size=2000):
+        if not card_id or not category:
+            continue
+        reward_cents = ledger.charge(card_id, category, to_cents(amount), created_at.astimezone(tz).year)
+        if in_range:
+            total_cents += reward_cents
+            cents_by_card[card_id] = cents_by_card.get(card_id, 0) + reward_cents
     
-    total_rewards = Decimal('0.00')
+    return cents_to_decimal(total_cents), {
+        card_id: cents_to_decimal(cents) for card_id, cents in cents_by_card.items()
+    }
+
+
+def calculate_total_rewards(user, start_date=None, end_date=None, apply_caps=False):
+    """
+    Calculate total rewards earned by a user across all transactions.
     
-    for transaction in transactions:
-        total_rewards += calculate_transaction_reward(transaction)
+    Args:
+        user: User object
+        start_date: Optional start date filter
+        end_date: Optional end date filter
+        apply_caps: Stop paying bonus rates once a rule's annual cap is reached
     
-    return total_rewards.quantize(Decimal('0.01'))
+    Returns:
+        Decimal: Total rewards earned
+    """
+    if apply_caps:
+        total_rewards, _by_card = calculate_capped_rewards(user, start_date, end_date)
+    else:
+        total_rewards, _by_card = calculate_rewards_batch(user, start_date, end_date)
+    return total_rewards
 
 
-def calculate_rewards_by_card(user, start_date=None, end_date=None):
+def calculate_rewards_by_card(user, start_date=None, end_date=None, apply_caps=False):
     """
     Calculate rewards earned per card for a user.
     Uses recommended card if actual card is not specified.
@@ -96,35 +327,165 @@ def calculate_rewards_by_card(user, start_date=None, end_date=None):
         user: User object
         start_date: Optional start date filter
         end_date: Optional end date filter
+        apply_caps: Stop paying bonus rates once a rule's annual cap is reached
     
     Returns:
         dict: {card_id: reward_amount}
     """
-    from transactions.models import Transaction
+    if apply_caps:
+        _total, rewards_by_card = calculate_capped_rewards(user, start_date, end_date)
+    else:
+        _total, rewards_by_card = calculate_rewards_batch(user, start_date, end_date)
+    return rewards_by_card
+
+
+def backfill_transaction_rewards(card_ids=None, chunk_size=500):
+    """
+    Recompute the stored actual/optimal/missed rewards, one chunk at a time.
+    Only transactions on the given cards are visited (all transactions if None),
+    plus any whose card was deleted but still carry a non-zero stored reward.
     
-    transactions = Transaction.objects.filter(user=user)
+    Args:
+        card_ids: Optional iterable of card ids whose reward rules changed
+        chunk_size: Number of transactions loaded and updated per query
     
-    if start_date:
-        transactions = transactions.filter(created_at__gte=start_date)
-    if end_date:
-        transactions = transactions.filter(created_at__lte=end_date)
+    Returns:
+        int: Number of transactions whose stored rewards changed
+    """
+    from transactions.models import Transaction, MonthlyRewardRollup
+    from transactions.rollups import rebuild_reward_rollups
+    from transactions.cap_usage import rebuild_cap_usage
     
-    rewards_by_card = {}
+    transactions = Transaction.objects.all()
+    if card_ids is not None:
+        card_ids = list(card_ids)
+        transactions = transactions.filter(
+            Q(card_actually_used__in=card_ids)
+            | Q(recommended_card__in=card_ids)
+            | (Q(card_actually_used__isnull=True) & ~Q(actual_reward=0))
+            | (Q(recommended_card__isnull=True) & ~Q(optimal_reward=0))
+        )
+    transactions = transactions.values_list(
+        'id', 'user_id', 'amount', 'category', 'card_actually_used_id', 'recommended_card_id',
+        *Transaction.REWARD_FIELDS,
+    ).order_by('id')
+    table = get_rate_table()
     
-    for transaction in transactions:
-        # Use recommended_card if card is not specified
-        card_to_use = transaction.card_actually_used or transaction.recommended_card
+    updated = 0
+    last_id = 0
+    stale_users = set()
+    while True:
+        chunk = list(transactions.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+        ids, user_ids, amounts, categories, used, recommended, *stored = zip(*chunk)
         
-        if not card_to_use:
-            continue  # Skip transactions without any card
-            
-        card_id = card_to_use.id
-        reward = calculate_transaction_reward(transaction)
+        # Whole chunk in integer cents × basis points; Decimals only for changed rows
+        cents = decimals_to_cents_array(amounts)
+        actual = round_half_even_array(cents * _bps_array(table, used, categories), 10000)
+        optimal = round_half_even_array(cents * _bps_array(table, recommended, categories), 10000)
+        computed = np.stack([actual, optimal, optimal - actual])
+        changed = np.flatnonzero((computed != decimals_to_cents_array(stored)).any(axis=0))
         
-        if card_id in rewards_by_card:
-            rewards_by_card[card_id] += reward
-        else:
-            rewards_by_card[card_id] = reward
+        if len(changed):
+            Transaction.objects.bulk_update([
+                Transaction(
+                    id=ids[i],
+                    actual_reward=cents_to_decimal(actual[i]),
+                    optimal_reward=cents_to_decimal(optimal[i]),
+                    missed_reward=cents_to_decimal(optimal[i] - actual[i]),
+                )
+                for i in changed
+            ], Transaction.REWARD_FIELDS)
+            updated += len(changed)
+            stale_users.update(user_ids[i] for i in changed)
+        last_id = ids[-1]
     
-    return rewards_by_card
+    # bulk_update skips the rollup signals, so rebuild the affected users' rollups
+    # (plus anyone with rollup rows on these cards, in case a card was deleted).
+    # Rule caps may have changed too, so their cap usage counters are replayed as well.
+    if card_ids is not None:
+        stale_users.update(
+            MonthlyRewardRollup.objects.filter(card_id__in=card_ids).values_list('user_id', flat=True)
+        )
+    if stale_users or card_ids is None:
+        rebuild_reward_rollups(None if card_ids is None else stale_users)
+        rebuild_cap_usage(None if card_ids is None else stale_users)
+    return updated
+
+
+def _bps_array(table, card_ids, categories):
+    return np.fromiter(
+        (table.bps(card_id, category) for card_id, category in zip(card_ids, categories)),
+        dtype=np.int64, count=len(card_ids),
+    )
+
+
+# Backfills run off the request thread, one at a time. Requested card ids are
+# stored as RewardBackfillRequest rows, so a restart doesn't drop them: ids
+# requested while a backfill runs are picked up by the next run, and leftovers
+# from a stopped process by the next run or `manage.py run_reward_backfill`.
+_backfill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reward-backfill")
+_backfill_lock = threading.Lock()
+_backfill_queued = False
+
+
+def schedule_reward_backfill(card_ids):
+    """Record a backfill for the given cards and start it once the current DB transaction commits."""
+    from django.utils import timezone
+    from transactions.models import RewardBackfillRequest
+    
+    card_ids = {card_id for card_id in card_ids if card_id}
+    if not card_ids:
+        return
+    now = timezone.now()
+    RewardBackfillRequest.objects.bulk_create(
+        [RewardBackfillRequest(card_id=card_id, requested_at=now) for card_id in card_ids],
+        update_conflicts=True, unique_fields=['card_id'], update_fields=['requested_at'],
+    )
+    db_transaction.on_commit(_enqueue_backfill)
+
+
+def _enqueue_backfill():
+    global _backfill_queued
+    with _backfill_lock:
+        if _backfill_queued:
+            return
+        _backfill_queued = True
+    _backfill_executor.submit(_backfill_worker)
+
+
+def run_pending_backfill():
+    """
+    Run the backfill for every recorded request.
+    
+    Returns:
+        int: Number of transactions whose stored rewards changed
+    """
+    global _backfill_queued
+    from transactions.models import RewardBackfillRequest
+    
+    with _backfill_lock:
+        _backfill_queued = False
+    requests = list(RewardBackfillRequest.objects.values_list('card_id', 'requested_at'))
+    if not requests:
+        return 0
+    # Rebuild the rate table from committed rules before recomputing
+    invalidate_rate_table()
+    updated = backfill_transaction_rewards({card_id for card_id, _requested_at in requests})
+    # Requests renewed while this ran have a newer requested_at and stay queued
+    done = Q()
+    for card_id, requested_at in requests:
+        done |= Q(card_id=card_id, requested_at=requested_at)
+    RewardBackfillRequest.objects.filter(done).delete()
+    return updated
+
 
+def _backfill_worker():
+    try:
+        run_pending_backfill()
+    except Exception:
+        logger.exception("Reward backfill failed")
+    finally:
+        # Worker threads get their own DB connection; don't leak it
+        connection.close()
@@ -0,0 +1,150 @@
+"""
+Monthly reward rollups.
+Keeps MonthlyRewardRollup rows (spend and reward per user, month, card and
+category) in step with Transaction writes, so dashboards and budget history
+read a handful of rollup rows instead of every transaction.
+"""
+from decimal import Decimal
+from django.db import IntegrityError, connection, transaction as db_transaction
+from django.db.models import F, Sum
+
+
+def rollup_key(user, created_at, card_id, category):
+    """(year_month, card_id, category) bucket for a transaction, month in the user's timezone."""
+    from budgets.services import get_user_timezone
+
+    year_month = created_at.astimezone(get_user_timezone(user)).strftime('%Y-%m')
+    return year_month, card_id, category
+
+
+def rollup_values(transaction):
+    """Rollup key, spend and reward contribution of a saved transaction."""
+    # Reward goes to the card actually used, else to the recommended card
+    # (same rule as transactions.rewards.calculate_transaction_reward)
+    if transaction.card_actually_used_id:
+        card_id, reward = transaction.card_actually_used_id, transaction.actual_reward
+    else:
+        card_id, reward = transaction.recommended_card_id, transaction.optimal_reward
+    key = rollup_key(transaction.user, transaction.created_at, card_id, transaction.category)
+    amount = transaction._meta.get_field('amount').to_python(transaction.amount)
+    return key, amount, reward
+
+
+def lock_user_rollups(user_id):
+    """
+    Row lock on the user, held until the surrounding DB transaction commits.
+    Signal deltas and rebuilds both take it (transaction writes run inside
+    atomic blocks, see Transaction.save), so a rebuild never drops a delta
+    committed between its read and its rewrite. SQLite has no row locks but
+    already allows a single writer at a time.
+    """
+    from django.contrib.auth import get_user_model
+
+    if connection.features.has_select_for_update:
+        list(get_user_model().objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True))
+
+
+def apply_rollup_delta(user_id, key, spend, reward, count):
+    """Add spend/reward/count to one rollup row with F() expressions, creating it if needed."""
+    from transactions.models import MonthlyRewardRollup
+
+    year_month, card_id, category = key
+    rows = MonthlyRewardRollup.objects.filter(
+        user_id=user_id, year_month=year_month, card_id=card_id, category=category
+    )
+    delta = dict(
+        spend=F('spend') + spend,
+        reward=F('reward') + reward,
+        transaction_count=F('transaction_count') + count,
+    )
+    if rows.update(**delta) or count <= 0:
+        # Nothing to subtract from a missing row (e.g. already removed by a user cascade)
+        return
+    try:
+        with db_transaction.atomic():
+            MonthlyRewardRollup.objects.create(
+                user_id=user_id, year_month=year_month, card_id=card_id, category=category,
+                spend=spend, reward=reward, transaction_count=count,
+            )
+    except IntegrityError:
+        # Created concurrently; add to the existing row instead
+        rows.update(**delta)
+
+
+def rebuild_reward_rollups(user_ids=None):
+    """
+    Recompute rollups from scratch for the given users (all users if None).
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    from django.contrib.auth import get_user_model
+    from transactions.models import Transaction, MonthlyRewardRollup
+
+    users = get_user_model().objects.all()
+    if user_ids is not None:
+        users = users.filter(id__in=list(user_ids))
+
+    written = 0
+    for user in users.iterator():
+        with db_transaction.atomic():
+            # Read and rewrite under the user's lock (see lock_user_rollups)
+            lock_user_rollups(user.pk)
+            totals = {}
+            transactions = Transaction.objects.filter(user=user).only(
+                'created_at', 'amount', 'category', 'card_actually_used', 'recommended_card',
+                'actual_reward', 'optimal_reward',
+            )
+            for tx in transactions.iterator(chunk_size=2000):
+                tx.user = user
+                key, spend, reward = rollup_values(tx)
+                current = totals.get(key, (Decimal('0.00'), Decimal('0.00'), 0))
+                totals[key] = (current[0] + spend, current[1] + reward, current[2] + 1)
+
+            MonthlyRewardRollup.objects.filter(user=user).delete()
+            MonthlyRewardRollup.objects.bulk_create([
+                MonthlyRewardRollup(
+                    user=user, year_month=year_month, card_id=card_id, category=category,
+                    spend=spend, reward=reward, transaction_count=count,
+                )
+                for (year_month, card_id, category), (spend, reward, count) in totals.items()
+            ])
+        written += len(totals)
+    return written
+
+
+def monthly_spend(user, year_months):
+    """{year_month: total spend} for the given months (missing months → 0.00)."""
+    from transactions.models import MonthlyRewardRollup
+
+    totals = dict(
+        MonthlyRewardRollup.objects
+        .filter(user=user, year_month__in=list(year_months))
+        .values('year_month')
+        .annotate(total=Sum('spend'))
+        .values_list('year_month', 'total')
+    )
+    return {year_month: totals.get(year_month) or Decimal('0.00') for year_month in year_months}
+
+
+def month_totals(user, year_month):
+    """(total spend, total rewards) for one month."""
+    from transactions.models import MonthlyRewardRollup
+
+    totals = MonthlyRewardRollup.objects.filter(user=user, year_month=year_month).aggregate(
+        spend=Sum('spend'), reward=Sum('reward')
+    )
+    return totals['spend'] or Decimal('0.00'), totals['reward'] or Decimal('0.00')
+
+
+def month_rewards_by_card(user, year_month):
+    """{card_id: rewards} for one month, like transactions.rewards.calculate_rewards_by_card."""
+    from transactions.models import MonthlyRewardRollup
+
+    return dict(
+        MonthlyRewardRollup.objects
+        .filter(user=user, year_month=year_month, card__isnull=False)
+        .values('card')
+        .annotate(total=Sum('reward'))
+        .values_list('card', 'total')
+    )
@@ -3,7 +3,6 @@ from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from django.utils import timezone
 from datetime import datetime
 from cards.models import Card, RewardRule
-from cards.models import UserCard
 from .models import Transaction
 
 class CardBasicSerializer(serializers.ModelSerializer):
@@ -89,38 +88,16 @@ class TransactionCSVRowSerializer(serializers.Serializer):
         if not user:
             raise serializers.ValidationError("User context is required.")
         
-        card_value = value.strip() if value else ""
-        if not card_value:
+        if not (value and value.strip()):
             # Card is optional now - return None
             return None
         
-        try:
-            card_id = int(card_value)
-            try:
-                user_card = UserCard.objects.select_related('card').get(
-                    user=user,
-                    card_id=card_id,
-                    is_active=True
-                )
-                return user_card.card
-            except UserCard.DoesNotExist:
-                raise serializers.ValidationError(f"Card ID '{card_id}' not found in your wallet.")
-        except ValueError:
-            try:
-                card = Card.objects.get(name__iexact=card_value)
-                try:
-                    UserCard.objects.get(
-                        user=user,
-                        card=card,
-                        is_active=True
-                    )
-                    return card
-                except UserCard.DoesNotExist:
-                    raise serializers.ValidationError(f"Card '{card_value}' not found in your wallet.")
-            except Card.DoesNotExist:
-                raise serializers.ValidationError(f"Card '{card_value}' not found.")
-            except Card.MultipleObjectsReturned:
-                raise serializers.ValidationError(f"Multiple cards found with name '{card_value}'. Please use card number instead.")
+        # Imports pass one wallet lookup for all their rows; a single row loads its own
+        wallet = self.context.get("wallet")
+        if wallet is None:
+            from .csv_import import WalletLookup
+            wallet = WalletLookup(user)
+        return wallet.resolve(value)
     
     def validate_date(self, value):
         if not value or not value.strip():
@@ -138,7 +115,8 @@ class TransactionCSVRowSerializer(serializers.Serializer):
     def validate_notes(self, value):
         return value if value else None
     
-    def create(self, validated_data):
+    def build(self, validated_data):
+        """Unsaved Transaction for a validated row (the bulk import inserts these in batches)."""
         from optimizer.services import best_cards_for_category
         
         user = self.context["user"]
@@ -149,30 +127,43 @@ class TransactionCSVRowSerializer(serializers.Serializer):
         notes = validated_data.get("notes")
         date = validated_data.get("date")
         
-        # Get recommended card if no card specified
-        recommended_card = None
-        if category:
-            recommendation = best_cards_for_category(category, user)
-            if recommendation.get('best_card'):
-                try:
-                    recommended_card = Card.objects.get(id=recommendation['best_card']['card_id'])
-                except Card.DoesNotExist:
-                    pass
+        # Get recommended card if no card specified (imports memoize it per category)
+        recommended = self.context.get("recommended_cards", {})
+        if category not in recommended:
+            recommended_card_id = None
+            if category:
+                recommendation = best_cards_for_category(category, user)
+                if recommendation.get('best_card'):
+                    recommended_card_id = recommendation['best_card']['card_id']
+            recommended[category] = recommended_card_id
+        recommended_card_id = recommended[category]
         
-        transaction = Transaction.objects.create(
+        return Transaction(
             user=user,
             card_actually_used=card,
-            recommended_card=recommended_card,
+            recommended_card_id=recommended_card_id,
             merchant=merchant,
             amount=amount,
             category=category,
-            notes=notes
+            notes=notes,
+            # Backdated rows are inserted with their date, so the signal-maintained
+            # rollups and budget alerts land in the right month in one write
+            created_at=date or timezone.now(),
         )
-        
-        if date:
-            Transaction.objects.filter(id=transaction.id).update(created_at=date)
-            transaction.refresh_from_db()
-            from budgets.signals import recompute_budget_for_transaction
-            recompute_budget_for_transaction(transaction)
-        
-        return transaction
\ No newline at end of file
+    
+    def create(self, validated_data):
+        transaction = self.build(validated_data)
+        transaction.save(force_insert=True)
+        return transaction
+
+
+class RecommendationItemSerializer(serializers.Serializer):
+    category = serializers.ChoiceField(choices=RewardRule.CATEGORY_CHOICES)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False, default=Decimal('0'))
+    merchant = serializers.CharField(required=False, allow_blank=True, default="")
+
+
+class BatchRecommendationSerializer(serializers.Serializer):
+    MAX_ITEMS = 500
+
+    items = serializers.ListField(child=RecommendationItemSerializer(), allow_empty=False, max_length=MAX_ITEMS)
@@ -0,0 +1,93 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from cards.models import Card, RewardRule
+from .models import Transaction
+from .rewards import schedule_reward_backfill
+from .rollups import rollup_values, apply_rollup_delta, lock_user_rollups
+from .cap_usage import usage_year, cap_inputs_changed, record_cap_usage, schedule_cap_usage_rebuild
+
+
+@receiver(post_save, sender=RewardRule)
+@receiver(post_delete, sender=RewardRule)
+def reward_rule_changed(sender, instance, **kwargs):
+    """When a reward rule changes, recompute stored rewards for that card's transactions."""
+    schedule_reward_backfill([instance.card_id])
+
+
+@receiver(post_delete, sender=Card)
+def card_deleted(sender, instance, **kwargs):
+    """Transactions on a deleted card lose it (SET_NULL), so their stored rewards drop to 0."""
+    schedule_reward_backfill([instance.id])
+
+
+@receiver(pre_save, sender=Transaction)
+def transaction_pre_save(sender, instance, raw=False, **kwargs):
+    """
+    Remember the stored values of an updated transaction, so post_save can move its
+    rollup totals (_previous_row stays None if nothing the rollups track changed).
+    The row is read back inside the save's atomic block, after the user's rollup
+    lock: a copy loaded earlier may be stale if another save moved the row since.
+    """
+    instance._previous_row = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    lock_user_rollups(instance.user_id)
+    previous = Transaction.objects.select_for_update().select_related('user').filter(pk=instance.pk).first()
+    if previous is None:
+        return
+    if all(getattr(instance, name) == getattr(previous, name) for name in Transaction.TRACKED_FIELDS):
+        return
+    instance._previous_row = previous
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_rollup_saved(sender, instance, created, raw=False, **kwargs):
+    """Add the transaction to its monthly rollup (and take the old values out on update)."""
+    if raw:
+        return
+    previous = getattr(instance, '_previous_row', None)
+    if not created and previous is None:
+        return
+    lock_user_rollups(instance.user_id)
+    key, spend, reward = rollup_values(instance)
+    if created:
+        apply_rollup_delta(instance.user_id, key, spend, reward, 1)
+        return
+
+    old_key, old_spend, old_reward = rollup_values(previous)
+    if old_key == key and previous.user_id == instance.user_id:
+        if (old_spend, old_reward) != (spend, reward):
+            apply_rollup_delta(instance.user_id, key, spend - old_spend, reward - old_reward, 0)
+        return
+    apply_rollup_delta(previous.user_id, old_key, -old_spend, -old_reward, -1)
+    apply_rollup_delta(instance.user_id, key, spend, reward, 1)
+
+
+@receiver(post_delete, sender=Transaction)
+def transaction_rollup_deleted(sender, instance, **kwargs):
+    """Take a deleted transaction out of its monthly rollup."""
+    lock_user_rollups(instance.user_id)
+    key, spend, reward = rollup_values(instance)
+    apply_rollup_delta(instance.user_id, key, -spend, -reward, -1)
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_cap_usage_saved(sender, instance, created, raw=False, **kwargs):
+    """Charge a new transaction against its caps; replay the affected years after a relevant edit."""
+    if raw:
+        return
+    if created:
+        record_cap_usage(instance)
+        return
+    previous = getattr(instance, '_previous_row', None)
+    if previous is None or not cap_inputs_changed(previous, instance):
+        return
+    # An edit can shift every later charge of the year, so replay those years after commit
+    schedule_cap_usage_rebuild(previous.user_id, [usage_year(previous.user, previous.created_at)])
+    schedule_cap_usage_rebuild(instance.user_id, [usage_year(instance.user, instance.created_at)])
+
+
+@receiver(post_delete, sender=Transaction)
+def transaction_cap_usage_deleted(sender, instance, **kwargs):
+    """Replay the deleted transaction's year after commit (nothing is left after a user cascade)."""
+    schedule_cap_usage_rebuild(instance.user_id, [usage_year(instance.user, instance.created_at)])
@@ -0,0 +1,126 @@
+from datetime import datetime, timezone as dt_timezone
+from unittest.mock import patch
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+from cards.models import RewardRule
+from cards.rates import invalidate_rate_table
+from transactions.cap_usage import rebuild_cap_usage, cap_usage
+from transactions.models import RewardCapUsage, Transaction
+from transactions.rewards import backfill_transaction_rewards
+from transactions.tests.test_rewards import RewardsTestMixin
+
+'''
+Expectations
+------------
+RewardCapUsage
+- One row per (user, rule, year): capped-bonus spend used so far, in cents.
+- Creating a transaction charges its card's capped rules in place (F() increments),
+  filling each cap before falling through to the next rule, like CapLedger.
+- A backdated insert (later purchases on the same card exist that year) replays its year instead.
+- Updates that change the date, amount, category or card, and deletes, replay the
+  affected years once the DB transaction commits, once per (user, year) per commit;
+  other updates don't.
+- Cap changes (reward backfills) replay the holders' counters.
+- rebuild_cap_usage / `manage.py rebuild_cap_usage` repair drifted counters.
+'''
+
+
+class TestCapUsage(RewardsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.gas = RewardRule.objects.create(
+            card=self.freedom, multiplier=Decimal("5.00"), category=["GAS"], cap_amount=Decimal("100")
+        )
+        self.year = timezone.now().year
+
+    def usage(self):
+        return cap_usage(self.user, self.year)
+
+    def test_create_fills_cap(self):
+        self._tx("60.00", "GAS", card=self.freedom)
+        self.assertEqual(self.usage(), {self.gas.id: 6000})
+        self._tx("60.00", "GAS", recommended=self.freedom)  # only $40 of headroom left
+        self.assertEqual(self.usage(), {self.gas.id: 10000})
+        self._tx("10.00", "GAS", card=self.freedom)
+        self._tx("10.00", "DINING", card=self.freedom)  # uncapped rule: no counter
+        self.assertEqual(self.usage(), {self.gas.id: 10000})
+
+    def test_update_and_delete_replay_the_year(self):
+        first = self._tx("80.00", "GAS", card=self.freedom)
+        self._tx("50.00", "GAS", card=self.freedom)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.amount = Decimal("30.00")
+            first.save()
+        self.assertEqual(self.usage(), {self.gas.id: 8000})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.created_at = datetime(2020, 6, 1, tzinfo=dt_timezone.utc)
+            first.save(update_fields=["created_at"])
+        self.assertEqual(self.usage(), {self.gas.id: 5000})
+        self.assertEqual(cap_usage(self.user, 2020), {self.gas.id: 3000})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(cap_usage(self.user, 2020), {})
+        self.assertEqual(self.usage(), {self.gas.id: 5000})
+
+    def test_replays_only_relevant_edits_once_per_commit(self):
+        tx = self._tx("80.00", "GAS", card=self.freedom)
+        with patch("transactions.cap_usage.rebuild_cap_usage") as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                tx.notes = "fill-up"
+                tx.save()
+            rebuild.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for amount in ("70.00", "60.00", "50.00"):
+                        tx.amount = Decimal(amount)
+                        tx.save()
+            rebuild.assert_called_once_with([self.user.id], {self.year})
+
+    def test_backdated_insert_replays_year(self):
+        def gas(amount, month):
+            return Transaction.objects.create(
+                user=self.user, card_actually_used=self.freedom, merchant="Gas", amount=Decimal(amount),
+                category="GAS", created_at=datetime(2024, month, 1, tzinfo=dt_timezone.utc),
+            )
+
+        gas("80.00", 6)
+        self.assertEqual(cap_usage(self.user, 2024), {self.gas.id: 8000})
+        with patch("transactions.cap_usage._add_cap_usage") as add:
+            with self.captureOnCommitCallbacks(execute=True):
+                gas("50.00", 3)  # earlier than the June purchase
+        add.assert_not_called()
+        self.assertEqual(cap_usage(self.user, 2024), {self.gas.id: 10000})
+
+    def test_backfill_replays_cap_changes(self):
+        self._tx("80.00", "GAS", card=self.freedom)
+        RewardRule.objects.filter(pk=self.gas.pk).update(cap_amount=Decimal("50"))
+        invalidate_rate_table()
+        backfill_transaction_rewards([self.freedom.id])
+        self.assertEqual(self.usage(), {self.gas.id: 5000})
+
+    def test_rebuild_repairs_drift(self):
+        self._tx("60.00", "GAS", card=self.freedom)
+        RewardCapUsage.objects.filter(user=self.user).update(used_cents=1)
+        RewardCapUsage.objects.create(user=self.user, card=self.freedom, rule=self.gas, year=2020, used_cents=5)
+
+        self.assertEqual(rebuild_cap_usage([self.user.id]), 1)
+        self.assertEqual(self.usage(), {self.gas.id: 6000})
+        self.assertEqual(cap_usage(self.user, 2020), {})
+
+        RewardCapUsage.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_cap_usage", "--user", str(self.user.id), stdout=out)
+        self.assertIn("Wrote 1 cap usage rows", out.getvalue())
+        self.assertEqual(self.usage(), {self.gas.id: 6000})
+
+
+# To run the tests:
+# python manage.py test transactions.tests.test_cap_usage
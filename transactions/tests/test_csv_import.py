@@ -0,0 +1,374 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import ValidationError
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from budgets.models import MonthlyBudget
+from cards.models import Card, UserCard, RewardRule
+from transactions.cap_usage import cap_usage, rebuild_cap_usage
+from transactions.csv_import import (
+    iter_csv_rows, check_encoding, CSVEncodingError, TransactionImporter, WalletLookup, run_import_job, COLUMNAR,
+)
+from transactions.models import Transaction, MonthlyRewardRollup, CSVImportJob
+from transactions.rollups import rebuild_reward_rollups
+
+'''
+Expectations
+------------
+iter_csv_rows
+- Decodes and parses the upload chunk by chunk; rows come out the same whatever the chunk size,
+  including multi-byte characters and quoted newlines split across chunks.
+- Row numbers count the header as row 1.
+- Invalid UTF-8 raises CSVEncodingError with the first row that could not be read.
+- check_encoding decodes the whole upload without parsing it, raising CSVEncodingError with the
+  line of the first invalid byte.
+
+WalletLookup
+- Loads the active wallet once; card ids and names (any case) resolve in memory.
+- load_catalog() counts every catalog name up front, after which resolving never queries.
+- Same errors as the old per-row queries: id not in wallet, name not found, name not in wallet,
+  and names shared by several catalog cards (detected up front, even for wallet cards).
+
+TransactionImporter
+- Valid rows are inserted with one bulk_create per chunk, dated rows with their date.
+- Stored rewards, rollups and cap usage end up as if every row had been saved on its own.
+- finish() evaluates each touched month's budget once, however many rows landed in it.
+- If a chunk's bulk insert fails, its rows are saved one at a time and failures reported per row.
+- Every imported row stores a fingerprint (user, date, merchant, amount, card, nth identical row
+  in the file); re-imports report rows already stored as "duplicate", checked with one query per chunk.
+- Recommendations are looked up once per category per import.
+- A dry run writes nothing and sums up an ImportPreview: valid / failed rows, errors by field,
+  new vs already-imported rows, spend by category and month range.
+- With workers, chunks are validated in a process pool (no queries there); results and the rows
+  written are the same as validating in-process, in row order.
+
+Columnar engine (iter_csv_frames / validate_frame)
+- Reads the file as DataFrame chunks indexed by row number and validates each column at once.
+- Same row numbers, statuses, error dicts and stored transactions as the serializer engine,
+  except that the missing fields of a short row read as blank rather than null.
+
+CSVImportJob / run_import_job
+- Counts the rows, imports them in chunks and saves progress (processed, imported, failed rows,
+  failures) as it goes; DONE when finished. The upload is deleted once the job is DONE or FAILED.
+- Resuming an interrupted job skips the rows already reported.
+- A file that can't be read at all fails the job with the same message as a synchronous 400.
+- `manage.py run_import_jobs` runs pending jobs and resumes interrupted ones, but leaves
+  RUNNING jobs that saved progress within CSV_IMPORT_JOB_LEASE seconds (they may still be live).
+'''
+
+
+def upload(content):
+    return SimpleUploadedFile("transactions.csv", content, content_type="text/csv")
+
+
+class TestIterCSVRows(SimpleTestCase):
+    CONTENT = (
+        "card,merchant,amount,category\r\n"
+        "1,Café Ümlaut,12.50,DINING\r\n"
+        '1,"Multi\nline",3.00,OTHER\n'
+        "1,Store,4.00,GAS"
+    ).encode("utf-8")
+
+    def test_same_rows_for_any_chunk_size(self):
+        expected = list(iter_csv_rows(upload(self.CONTENT)))
+        self.assertEqual([row for row, _data in expected], [2, 3, 4])
+        self.assertEqual(expected[0][1]["merchant"], "Café Ümlaut")
+        self.assertEqual(expected[1][1]["merchant"], "Multi\nline")
+        self.assertEqual(expected[2][1]["category"], "GAS")
+        for chunk_size in (1, 2, 3, 7, 16):
+            self.assertEqual(list(iter_csv_rows(upload(self.CONTENT), chunk_size=chunk_size)), expected)
+
+    def test_encoding_error_reports_row(self):
+        content = b"card,merchant,amount,category\n1,A,1.00,GAS\n1,B\xff,1.00,GAS\n"
+        rows = iter_csv_rows(upload(content), chunk_size=len("card,merchant,amount,category\n1,A,1.00,GAS\n"))
+        self.assertEqual(next(rows)[0], 2)
+        with self.assertRaises(CSVEncodingError) as ctx:
+            next(rows)
+        self.assertEqual(ctx.exception.row, 3)
+
+    def test_check_encoding_reports_line(self):
+        check_encoding(upload(self.CONTENT), chunk_size=1)
+        content = b"card,merchant,amount,category\n1,A,1.00,GAS\n1,\xc3\xa9\xff,1.00,GAS\n"
+        for chunk_size in (1, 2, 5, 64):
+            with self.assertRaises(CSVEncodingError) as ctx:
+                check_encoding(upload(content), chunk_size=chunk_size)
+            self.assertEqual(ctx.exception.row, 3)
+
+
+class TestWalletLookup(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="w", email="w@example.com", password="pw")
+        self.freedom = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.gold = Card.objects.create(name="Gold", issuer="AMEX", annual_fee=250)
+        Card.objects.create(name="gold", issuer="CITI", annual_fee=0)
+        self.other = Card.objects.create(name="Other Card", issuer="CITI", annual_fee=0)
+        UserCard.objects.create(user=self.user, card=self.freedom)
+        UserCard.objects.create(user=self.user, card=self.gold)
+        UserCard.objects.create(user=self.user, card=self.other, is_active=False)
+
+    def error(self, wallet, value):
+        with self.assertRaises(ValidationError) as ctx:
+            wallet.resolve(value)
+        return str(ctx.exception.detail[0])
+
+    def test_resolves_in_memory(self):
+        with self.assertNumQueries(2):  # wallet + ambiguous names
+            wallet = WalletLookup(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(wallet.resolve(f" {self.freedom.id} "), self.freedom)
+            self.assertEqual(wallet.resolve("FREEDOM"), self.freedom)
+            self.assertIsNone(wallet.resolve(""))
+            self.assertEqual(self.error(wallet, "Gold"),
+                             "Multiple cards found with name 'Gold'. Please use card number instead.")
+            self.assertEqual(self.error(wallet, str(self.other.id)), f"Card ID '{self.other.id}' not found in your wallet.")
+        with self.assertNumQueries(2):  # once per unknown name
+            for _ in range(3):
+                self.assertEqual(self.error(wallet, "other card"), "Card 'other card' not found in your wallet.")
+                self.assertEqual(self.error(wallet, "Nope"), "Card 'Nope' not found.")
+
+        with self.assertNumQueries(1):
+            wallet.load_catalog()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.error(wallet, "Missing"), "Card 'Missing' not found.")
+            self.assertEqual(self.error(wallet, "OTHER CARD"), "Card 'OTHER CARD' not found in your wallet.")
+
+
+class TestTransactionImporter(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="bulk", email="bulk@example.com", password="pw")
+        self.card = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.gas = RewardRule.objects.create(card=self.card, multiplier=Decimal("5.00"), category=["GAS"],
+                                             cap_amount=Decimal("100"))
+        UserCard.objects.create(user=self.user, card=self.card)
+        MonthlyBudget.objects.create(user=self.user, year_month="2024-03", amount=Decimal("100"))
+        MonthlyBudget.objects.create(user=self.user, year_month="2024-04", amount=Decimal("100"))
+
+    def rows(self, count):
+        for i in range(count):
+            month = 3 if i % 2 else 4
+            yield i + 2, {"card": str(self.card.id), "merchant": f"Gas {i}", "amount": "30.00", "category": "GAS",
+                          "date": f"2024-0{month}-{i % 28 + 1:02d}"}
+        yield count + 2, {"card": "", "merchant": "Bad", "amount": "x", "category": "GAS"}
+
+    def import_rows(self, rows, chunk_rows=4):
+        importer = TransactionImporter(self.user, chunk_rows=chunk_rows)
+        results = list(importer.import_rows(rows))
+        importer.finish()
+        return results
+
+    def test_bulk_import_matches_per_row_saves(self):
+        with patch("budgets.services.evaluate_thresholds") as evaluate, CaptureQueriesContext(connection) as queries:
+            results = self.import_rows(self.rows(10))
+        self.assertEqual([r["row"] for r in results], list(range(2, 13)))
+        self.assertEqual([r["status"] for r in results], ["imported"] * 10 + ["error"])
+        self.assertIn("amount", results[-1]["errors"])
+        inserts = [q for q in queries.captured_queries if q["sql"].startswith('INSERT INTO "transactions_transaction"')]
+        self.assertEqual(len(inserts), 3)  # 10 rows in chunks of 4
+        self.assertEqual(sorted(call.args[0].year_month for call in evaluate.call_args_list), ["2024-03", "2024-04"])
+
+        tx = Transaction.objects.get(pk=results[0]["transaction_id"])
+        self.assertEqual(tx.created_at.strftime("%Y-%m-%d"), "2024-04-01")
+        self.assertEqual(tx.actual_reward, Decimal("1.50"))
+        rollups = set(MonthlyRewardRollup.objects.values_list("year_month", "card", "category", "spend", "reward",
+                                                              "transaction_count"))
+        self.assertEqual(rollups, {("2024-03", self.card.id, "GAS", Decimal("150.00"), Decimal("7.50"), 5),
+                                   ("2024-04", self.card.id, "GAS", Decimal("150.00"), Decimal("7.50"), 5)})
+        usage = cap_usage(self.user, 2024)
+        self.assertEqual(usage, {self.gas.id: 10000})
+        rebuild_reward_rollups([self.user.id])
+        rebuild_cap_usage([self.user.id])
+        self.assertEqual(set(MonthlyRewardRollup.objects.values_list("year_month", "card", "category", "spend",
+                                                                     "reward", "transaction_count")), rollups)
+        self.assertEqual(cap_usage(self.user, 2024), usage)
+
+    def test_reimport_skips_existing_rows(self):
+        self.import_rows(self.rows(100), chunk_rows=50)
+        self.assertEqual(Transaction.objects.filter(fingerprint__isnull=True).count(), 0)
+        with CaptureQueriesContext(connection) as queries:
+            results = self.import_rows(self.rows(100), chunk_rows=50)
+        self.assertEqual([r["status"] for r in results], ["duplicate"] * 100 + ["error"])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 100)
+        self.assertLess(len(queries.captured_queries), 15)
+        self.assertFalse([q for q in queries.captured_queries if q["sql"].startswith("INSERT")])
+
+    def test_identical_rows_in_a_file_are_kept(self):
+        row = {"card": "", "merchant": "Coffee", "amount": "3.50", "category": "DINING", "date": "2024-03-01"}
+        self.assertEqual([r["status"] for r in self.import_rows([(2, row), (3, row)])], ["imported"] * 2)
+        results = self.import_rows([(2, row), (3, row), (4, row)])
+        self.assertEqual([r["status"] for r in results], ["duplicate", "duplicate", "imported"])
+        self.assertEqual(Transaction.objects.filter(merchant="Coffee").count(), 3)
+
+    def test_process_pool_validation_matches_serial(self):
+        rows = list(self.rows(30)) + [(33, {"card": "Unknown", "merchant": "X", "amount": "1", "category": "GAS"}),
+                                      (34, {"card": "", "merchant": " ", "amount": "1", "category": "NOPE"})]
+        importer = TransactionImporter(self.user, chunk_rows=4, workers=2)
+        parallel = list(importer.import_rows(iter(rows)))
+        importer.finish()
+        imported = list(Transaction.objects.order_by("id").values_list("merchant", "amount", "created_at"))
+        Transaction.objects.all().delete()
+        serial = self.import_rows(iter(rows))
+        self.assertEqual([r["row"] for r in parallel], [row_num for row_num, _row in rows])
+        self.assertEqual([(r["status"], r.get("errors")) for r in parallel],
+                         [(r["status"], r.get("errors")) for r in serial])
+        self.assertEqual(list(Transaction.objects.order_by("id").values_list("merchant", "amount", "created_at")),
+                         imported)
+
+    def test_dry_run_previews_without_writing(self):
+        self.import_rows(self.rows(4))
+        before = (Transaction.objects.count(), list(MonthlyRewardRollup.objects.values_list("spend", flat=True)))
+        importer = TransactionImporter(self.user, chunk_rows=4, dry_run=True)
+        with patch("optimizer.services.best_cards_for_category", return_value={}) as recommend:
+            results = list(importer.import_rows(self.rows(10)))
+        importer.finish()
+        recommend.assert_called_once()  # one category in the file
+        self.assertEqual([r["status"] for r in results], ["duplicate"] * 4 + ["new"] * 6 + ["error"])
+        self.assertEqual(importer.preview.as_dict(), {
+            "valid_rows": 10, "error_rows": 1, "errors_by_field": {"amount": 1},
+            "new_rows": 6, "duplicate_rows": 4, "spend_by_category": {"GAS": 300.0},
+            "first_month": "2024-03", "last_month": "2024-04",
+        })
+        self.assertEqual((Transaction.objects.count(), list(MonthlyRewardRollup.objects.values_list("spend", flat=True))),
+                         before)
+
+    def test_failed_bulk_insert_falls_back_to_single_rows(self):
+        with patch.object(TransactionImporter, "_bulk_insert", side_effect=DatabaseError("boom")):
+            results = self.import_rows(self.rows(3))
+        self.assertEqual([r["status"] for r in results], ["imported"] * 3 + ["error"])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(MonthlyRewardRollup.objects.get(year_month="2024-04").transaction_count, 2)
+
+
+class TestColumnarEngine(TestCase):
+    CONTENT = (
+        "card,merchant,amount,category,date,notes\n"
+        "{id},Store,12.345,DINING,2024-03-01,\n"
+        "freedom,  Cafe ,1e2,GAS,2024-1-5,note\n"
+        ',"Multi\nline",-0,GROCERIES,,\n'
+        "Unknown,,abc,DINNING,01-15-2024,\n"
+        "{id},Shop,-5,GAS,2024-02-30,\n"
+        "Nope,Shop,+7.5,OTHER,2024-02-29,x\n"
+        "{id},Shop,,,,\n"
+    )
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="col", email="col@example.com", password="pw")
+        self.card = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        UserCard.objects.create(user=self.user, card=self.card)
+
+    def run_engine(self, engine):
+        content = self.CONTENT.format(id=self.card.id).encode()
+        importer = TransactionImporter(self.user, chunk_rows=3, engine=engine)
+        results = list(importer.import_file(upload(content)))
+        importer.finish()
+        stored = [
+            # Undated rows are stamped with the import time
+            row[:4] + (row[4] if row[4].year == 2024 else "now",) + row[5:]
+            for row in Transaction.objects.order_by("id").values_list(
+                "card_actually_used", "merchant", "amount", "category", "created_at", "notes"
+            )
+        ]
+        Transaction.objects.all().delete()
+        return [
+            (r["row"], r["status"], {field: [str(m) for m in messages] for field, messages in r.get("errors", {}).items()})
+            for r in results
+        ], stored
+
+    def test_matches_serializer_engine(self):
+        columnar = self.run_engine(COLUMNAR)
+        serializer = self.run_engine("serializer")
+        self.assertEqual(columnar, serializer)
+        results, stored = columnar
+        self.assertEqual([status for _row, status, _errors in results],
+                         ["imported", "imported", "imported", "error", "error", "error", "error"])
+        self.assertEqual(set(results[3][2]), {"card", "merchant", "amount", "category", "date"})
+        self.assertEqual(stored[1][1:3], ("Cafe", Decimal("100.00")))
+
+    def test_short_row_reads_as_blank(self):
+        importer = TransactionImporter(self.user, chunk_rows=3, engine=COLUMNAR)
+        results = list(importer.import_file(upload(b"card,merchant,amount,category\n,Store,1.00\n")))
+        importer.finish()
+        self.assertEqual([str(message) for message in results[0]["errors"]["category"]], ["This field may not be blank."])
+
+
+class TestCSVImportJobs(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings_override = override_settings(MEDIA_ROOT=self.media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = get_user_model().objects.create_user(username="job", email="job@example.com", password="pw")
+
+    def job(self, content, **fields):
+        return CSVImportJob.objects.create(user=self.user, file=upload(content), **fields)
+
+    def test_runs_in_chunks_and_saves_progress(self):
+        content = "merchant,amount,category\n" + "Store,1.00,GAS\nBad,x,GAS\n" * 5
+        job = self.job(content.encode())
+        saved = []
+        original_save = CSVImportJob.save
+
+        def save(instance, *args, **kwargs):
+            saved.append(instance.processed_rows)
+            original_save(instance, *args, **kwargs)
+
+        with patch.object(CSVImportJob, "save", save):
+            run_import_job(job.id, chunk_rows=4)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total_rows, job.remaining_rows), (CSVImportJob.DONE, 10, 0))
+        self.assertEqual((job.imported_count, job.failed_count), (5, 5))
+        run_import_job(self.job(content.encode()).id)
+        self.assertEqual(CSVImportJob.objects.latest("id").duplicate_count, 5)
+        self.assertEqual([failure["row"] for failure in job.failures], [3, 5, 7, 9, 11])
+        self.assertIn("amount", job.failures[0]["errors"])
+        self.assertEqual(saved, [0, 0, 4, 8, 10, 10])  # running, counted, per chunk, finished, upload deleted
+        self.assertFalse(job.file)
+        self.assertEqual(os.listdir(os.path.join(self.media, "csv_imports", job.created_at.strftime("%Y/%m"))), [])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 5)
+
+    def test_resume_skips_reported_rows(self):
+        job = self.job(b"merchant,amount,category\nA,1.00,GAS\nB,1.00,GAS\nC,1.00,GAS\n",
+                       status=CSVImportJob.RUNNING, total_rows=3, processed_rows=2, imported_count=2)
+        out = StringIO()
+        call_command("run_import_jobs", stdout=out)
+        self.assertIn("Running 0 CSV import job(s)", out.getvalue())  # may still be live in a web process
+
+        CSVImportJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(minutes=11))
+        out = StringIO()
+        call_command("run_import_jobs", stdout=out)
+        self.assertIn(f"Job {job.id}: DONE, 3 imported, 0 failed", out.getvalue())
+        self.assertEqual(list(Transaction.objects.values_list("merchant", flat=True)), ["C"])
+
+    def test_resume_counts_rows_before_resume_point(self):
+        content = b"merchant,amount,category,date\nA,1.00,GAS,2024-03-01\nB,1.00,GAS,2024-03-01\nA,1.00,GAS,2024-03-01\n"
+        for engine in ("serializer", COLUMNAR):
+            with self.subTest(engine=engine):
+                Transaction.objects.all().delete()
+                # Interrupted after its first two rows
+                run_import_job(self.job(content[:content.rindex(b"A,")], engine=engine).id)
+                job = self.job(content, engine=engine, status=CSVImportJob.RUNNING, total_rows=3,
+                               processed_rows=2, imported_count=2)
+                job = run_import_job(job.id)
+                self.assertEqual((job.imported_count, job.duplicate_count), (3, 0))
+                self.assertEqual(sorted(Transaction.objects.values_list("merchant", flat=True)), ["A", "A", "B"])
+
+    def test_unreadable_file_fails_job(self):
+        job = run_import_job(self.job(b"merchant,amount,category\nCaf\xe9,1.00,GAS\n").id)
+        self.assertEqual(job.status, CSVImportJob.FAILED)
+        self.assertIn("File encoding error", job.error)
+        self.assertEqual(job.processed_rows, 0)
+        self.assertFalse(job.file)
+
+
+# To run the tests:
+# python manage.py test transactions.tests.test_csv_import
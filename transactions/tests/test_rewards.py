@@ -0,0 +1,307 @@
+import random
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from cards.models import Card, RewardRule
+from cards.rates import get_rate_table, bump_version
+from transactions.models import Transaction, RewardBackfillRequest
+from transactions.rewards import (
+    calculate_transaction_reward,
+    calculate_rewards_batch,
+    calculate_total_rewards_in_database,
+    calculate_rewards_by_card_in_database,
+    calculate_total_rewards,
+    calculate_rewards_by_card,
+    calculate_capped_rewards,
+    backfill_transaction_rewards,
+    run_pending_backfill,
+)
+from transactions import rewards
+from transactions.cents import reward_cents, cents_to_decimal, to_cents
+
+'''
+Expectations
+------------
+calculate_transaction_reward
+- Uses card_actually_used, else recommended_card; 0.00 without a card.
+- Uses the best matching multiplier, falling back to the card's OTHER rate.
+- reward = amount × multiplier ÷ 100, quantized to cents.
+- Does not query RewardRule per transaction.
+
+Fixed-point arithmetic (transactions/cents.py)
+- reward_cents(amount, bps) matches (amount × multiplier ÷ 100).quantize(0.01) bit-for-bit.
+- cents_to_decimal returns two-place Decimals (0 → 0.00).
+
+calculate_total_rewards / calculate_rewards_by_card
+- Sum the per-transaction rewards for the user (total and per card).
+
+calculate_rewards_batch
+- One values_list query; NumPy computation against the rate matrix.
+- Matches the per-row quantize(0.01) results exactly, half-cent ties included.
+
+calculate_total_rewards_in_database / calculate_rewards_by_card_in_database
+- One aggregate query each, same results as the Python paths.
+
+calculate_capped_rewards (apply_caps=True)
+- Bonus rates apply only until the rule's annual spend cap is used up, then the base rate.
+- Caps reset every calendar year; spend before start_date in the same year still counts.
+- Without caps it matches the uncapped totals.
+
+Stored transaction rewards
+- actual_reward, optimal_reward, missed_reward are columns filled in on save.
+- backfill_transaction_rewards recomputes them in chunks, only for the given cards.
+- A RewardRule change schedules a background backfill for its card after commit.
+- Backfill requests are stored (RewardBackfillRequest) until a backfill has run them.
+- Saving checks the rate table against the database version, so rule changes
+  made by another process are used even before this process's table expires.
+- Deleting a card zeroes the stored rewards of the transactions that used it.
+'''
+
+User = get_user_model()
+
+
+class RewardsTestMixin:
+    def setUp(self):
+        self.user = User.objects.create_user(username="u1", email="u1@example.com", password="pw")
+        self.freedom = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.gold = Card.objects.create(name="Gold", issuer="AMEX", annual_fee=250)
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("3.00"), category=["DINING", "PHARMACY"])
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("1.50"), category=["OTHER"])
+        RewardRule.objects.create(card=self.gold, multiplier=Decimal("4.00"), category=["DINING", "GROCERIES"])
+        RewardRule.objects.create(card=self.gold, multiplier=Decimal("1.00"), category=["OTHER"])
+
+    def _tx(self, amount, category, card=None, recommended=None):
+        return Transaction.objects.create(
+            user=self.user,
+            card_actually_used=card,
+            recommended_card=recommended,
+            merchant="Store",
+            amount=Decimal(amount),
+            category=category,
+        )
+
+
+class TestCalculateTransactionReward(RewardsTestMixin, TestCase):
+    def test_category_bonus_and_fallback(self):
+        self.assertEqual(calculate_transaction_reward(self._tx("10.00", "DINING", self.freedom)), Decimal("0.30"))
+        self.assertEqual(calculate_transaction_reward(self._tx("10.00", "GAS", self.freedom)), Decimal("0.15"))
+        self.assertEqual(calculate_transaction_reward(self._tx("10.00", "DINING", self.gold)), Decimal("0.40"))
+
+    def test_uses_recommended_card_when_no_card(self):
+        tx = self._tx("20.00", "GROCERIES", recommended=self.gold)
+        self.assertEqual(calculate_transaction_reward(tx), Decimal("0.80"))
+        self.assertEqual(calculate_transaction_reward(self._tx("20.00", "GROCERIES")), Decimal("0.00"))
+
+    def test_quantizes_to_cents(self):
+        # 12.34 × 1.5% = 0.1851 → 0.19
+        self.assertEqual(calculate_transaction_reward(self._tx("12.34", "RENT", self.freedom)), Decimal("0.19"))
+
+    def test_no_queries_per_transaction(self):
+        txs = [self._tx("5.00", "DINING", self.freedom) for _ in range(3)]
+        get_rate_table()
+        with self.assertNumQueries(0):
+            for tx in txs:
+                calculate_transaction_reward(tx)
+
+    def test_model_properties(self):
+        tx = self._tx("10.00", "DINING", card=self.freedom, recommended=self.gold)
+        self.assertEqual(tx.actual_reward, Decimal("0.30"))
+        self.assertEqual(tx.optimal_reward, Decimal("0.40"))
+        self.assertEqual(tx.missed_reward, Decimal("0.10"))
+        self.assertFalse(tx.used_optimal_card)
+
+
+class TestFixedPoint(TestCase):
+    def test_matches_decimal_quantize(self):
+        rng = random.Random(11)
+        amounts = ["0.00", "0.01", "0.05", "0.50", "1.25", "2.50", "12.345", "0.125", "999999.99"]
+        amounts += [f"{rng.randint(0, 10**8)}.{rng.randint(0, 99):02d}" for _ in range(500)]
+        multipliers = ["0.00", "0.50", "1.00", "1.25", "1.50", "2.00", "3.00", "4.50", "5.00", "12.00"]
+        for amount in map(Decimal, amounts):
+            for multiplier in map(Decimal, multipliers):
+                expected = ((amount * multiplier) / Decimal("100")).quantize(Decimal("0.01"))
+                result = cents_to_decimal(reward_cents(amount, int(multiplier * 100)))
+                self.assertEqual(str(result), str(expected), (amount, multiplier))
+
+    def test_conversions(self):
+        self.assertEqual(to_cents(Decimal("12.34")), 1234)
+        self.assertEqual(to_cents(7), 700)
+        self.assertEqual(str(cents_to_decimal(0)), "0.00")
+        self.assertEqual(str(cents_to_decimal(-5)), "-0.05")
+        self.assertEqual(str(cents_to_decimal(123456)), "1234.56")
+
+
+class TestRewardTotals(RewardsTestMixin, TestCase):
+    def test_totals_and_by_card(self):
+        self._tx("10.00", "DINING", self.freedom)
+        self._tx("12.34", "RENT", self.freedom)
+        self._tx("25.00", "GROCERIES", recommended=self.gold)
+        self._tx("99.00", "GAS")
+
+        self.assertEqual(calculate_total_rewards(self.user), Decimal("1.49"))
+        self.assertEqual(
+            calculate_rewards_by_card(self.user),
+            {self.freedom.id: Decimal("0.49"), self.gold.id: Decimal("1.00")},
+        )
+
+    def test_batch_matches_per_row_rounding(self):
+        # Half-cent ties (x.xx5) exercise ROUND_HALF_EVEN, as Decimal.quantize does
+        amounts = ["0.50", "1.50", "2.50", "0.05", "12.34", "999.99", "0.01", "33.33", "100.00"]
+        categories = ["DINING", "GAS", "GROCERIES", "PHARMACY", "OTHER"]
+        cards = [self.freedom, self.gold, None]
+        txs = []
+        for i, amount in enumerate(amounts * 3):
+            card = cards[i % 3]
+            recommended = cards[(i + 1) % 3]
+            txs.append(self._tx(amount, categories[i % len(categories)], card, recommended))
+
+        expected_total = sum((calculate_transaction_reward(tx) for tx in txs), Decimal("0.00"))
+        expected_by_card = {}
+        for tx in txs:
+            card_id = tx.card_actually_used_id or tx.recommended_card_id
+            if card_id:
+                expected_by_card[card_id] = expected_by_card.get(card_id, Decimal("0.00")) + calculate_transaction_reward(tx)
+
+        total, by_card = calculate_rewards_batch(self.user)
+        self.assertEqual(total, expected_total)
+        self.assertEqual(by_card, expected_by_card)
+        self.assertEqual(str(total), str(expected_total))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(calculate_total_rewards_in_database(self.user), expected_total)
+        with self.assertNumQueries(1):
+            self.assertEqual(calculate_rewards_by_card_in_database(self.user), expected_by_card)
+
+    def test_batch_single_query(self):
+        self._tx("10.00", "DINING", self.freedom)
+        self._tx("10.00", "DINING", self.gold)
+        get_rate_table()
+        with self.assertNumQueries(1):
+            calculate_rewards_batch(self.user)
+
+    def test_batch_empty(self):
+        self.assertEqual(calculate_rewards_batch(self.user), (Decimal("0.00"), {}))
+        self.assertEqual(calculate_total_rewards_in_database(self.user), Decimal("0.00"))
+        self.assertEqual(calculate_rewards_by_card_in_database(self.user), {})
+
+class TestCappedRewards(RewardsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.blue = Card.objects.create(name="Blue Cash", issuer="AMEX", annual_fee=95)
+        RewardRule.objects.create(card=self.blue, multiplier=Decimal("6.00"), category=["GROCERIES"], cap_amount=Decimal("100"))
+        RewardRule.objects.create(card=self.blue, multiplier=Decimal("1.00"), category=["OTHER"])
+
+    def _dated_tx(self, amount, when, category="GROCERIES"):
+        tx = self._tx(amount, category, self.blue)
+        Transaction.objects.filter(id=tx.id).update(created_at=when)
+        return tx
+
+    def test_cap_then_base_rate(self):
+        from datetime import datetime, timezone as dt_timezone
+        self._dated_tx("60.00", datetime(2025, 1, 10, tzinfo=dt_timezone.utc))  # 6% → 3.60
+        self._dated_tx("60.00", datetime(2025, 2, 10, tzinfo=dt_timezone.utc))  # 40 @ 6% + 20 @ 1% → 2.60
+        self._dated_tx("10.00", datetime(2025, 3, 10, tzinfo=dt_timezone.utc))  # 1% → 0.10
+        self._dated_tx("10.00", datetime(2026, 1, 5, tzinfo=dt_timezone.utc))   # new year, 6% → 0.60
+
+        total, by_card = calculate_capped_rewards(self.user)
+        self.assertEqual(total, Decimal("6.90"))
+        self.assertEqual(by_card, {self.blue.id: Decimal("6.90")})
+        # The uncapped engines pay 6% on everything
+        self.assertEqual(calculate_total_rewards(self.user), Decimal("8.40"))
+
+        # Spend before start_date in the same year still consumes the cap
+        since_feb = datetime(2025, 2, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual(calculate_total_rewards(self.user, start_date=since_feb, apply_caps=True), Decimal("3.30"))
+        self.assertEqual(
+            calculate_rewards_by_card(self.user, start_date=since_feb, apply_caps=True),
+            {self.blue.id: Decimal("3.30")},
+        )
+
+    def test_cap_year_follows_user_timezone(self):
+        from datetime import datetime, timezone as dt_timezone
+        from zoneinfo import ZoneInfo
+        # 2025-01-01 00:30 in Tokyo is still 2024 in UTC, but it uses the 2025 cap
+        self._dated_tx("100.00", datetime(2024, 12, 31, 15, 30, tzinfo=dt_timezone.utc))
+        self._dated_tx("10.00", datetime(2025, 3, 10, tzinfo=dt_timezone.utc))  # cap used up → 1%
+        with patch("budgets.services.get_user_timezone", return_value=ZoneInfo("Asia/Tokyo")):
+            total = calculate_total_rewards(
+                self.user, start_date=datetime(2025, 2, 1, tzinfo=dt_timezone.utc), apply_caps=True
+            )
+        self.assertEqual(total, Decimal("0.10"))
+
+    def test_matches_uncapped_without_caps(self):
+        self._tx("10.00", "DINING", self.freedom)
+        self._tx("0.50", "DINING", self.freedom)
+        self._tx("25.00", "GROCERIES", recommended=self.gold)
+        self.assertEqual(calculate_capped_rewards(self.user), calculate_rewards_batch(self.user))
+
+
+class TestStoredRewards(RewardsTestMixin, TestCase):
+    def test_rewards_stored_on_save(self):
+        tx = self._tx("10.00", "DINING", card=self.freedom, recommended=self.gold)
+        stored = Transaction.objects.filter(id=tx.id).values_list("actual_reward", "optimal_reward", "missed_reward").get()
+        self.assertEqual(stored, (Decimal("0.30"), Decimal("0.40"), Decimal("0.10")))
+
+        tx.amount = Decimal("20.00")
+        tx.save(update_fields=["amount"])
+        tx.refresh_from_db()
+        self.assertEqual(tx.actual_reward, Decimal("0.60"))
+
+    def test_backfill_only_touches_affected_cards(self):
+        on_freedom = self._tx("10.00", "GAS", card=self.freedom)
+        on_gold = self._tx("10.00", "GAS", card=self.gold)
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("5.00"), category=["GAS"])
+        RewardRule.objects.create(card=self.gold, multiplier=Decimal("5.00"), category=["GAS"])
+
+        self.assertEqual(backfill_transaction_rewards([self.freedom.id], chunk_size=1), 1)
+        on_freedom.refresh_from_db()
+        on_gold.refresh_from_db()
+        self.assertEqual(on_freedom.actual_reward, Decimal("0.50"))
+        self.assertEqual(on_gold.actual_reward, Decimal("0.10"))  # not recomputed yet
+
+    def test_rule_change_schedules_backfill_after_commit(self):
+        tx = self._tx("10.00", "GAS", card=self.freedom)
+        with patch.object(rewards._backfill_executor, "submit") as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                RewardRule.objects.create(card=self.freedom, multiplier=Decimal("5.00"), category=["GAS"])
+        submit.assert_called_once()
+        run_pending_backfill()
+        tx.refresh_from_db()
+        self.assertEqual(tx.actual_reward, Decimal("0.50"))
+
+    def test_backfill_requests_survive_until_run(self):
+        tx = self._tx("10.00", "GAS", card=self.freedom)
+        RewardBackfillRequest.objects.all().delete()  # queued by the setUp rules
+        with patch.object(rewards._backfill_executor, "submit"):
+            RewardRule.objects.create(card=self.freedom, multiplier=Decimal("5.00"), category=["GAS"])
+        # The process "restarts" before the worker ran: the request is still stored
+        self.assertEqual(list(RewardBackfillRequest.objects.values_list("card_id", flat=True)), [self.freedom.id])
+        out = StringIO()
+        call_command("run_reward_backfill", stdout=out)
+        self.assertIn("Updated 1 transactions", out.getvalue())
+        self.assertFalse(RewardBackfillRequest.objects.exists())
+        tx.refresh_from_db()
+        self.assertEqual(tx.actual_reward, Decimal("0.50"))
+
+    def test_save_uses_rules_changed_by_another_process(self):
+        get_rate_table()
+        # Another process edits the rule: no local invalidation, only the version bump
+        RewardRule.objects.filter(card=self.freedom, category__contains="DINING").update(multiplier=Decimal("6.00"))
+        bump_version()
+        tx = self._tx("10.00", "DINING", card=self.freedom)
+        self.assertEqual(tx.actual_reward, Decimal("0.60"))
+
+    def test_card_delete_zeroes_rewards(self):
+        tx = self._tx("10.00", "DINING", card=self.freedom, recommended=self.gold)
+        self.freedom.delete()
+        backfill_transaction_rewards([self.freedom.id])
+        tx.refresh_from_db()
+        self.assertEqual(tx.actual_reward, Decimal("0.00"))
+        self.assertEqual(tx.missed_reward, Decimal("0.40"))
+
+
+# To run the tests:
+# python manage.py test transactions.tests.test_rewards
@@ -0,0 +1,185 @@
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from cards.models import RewardRule, UserCard
+from transactions.models import MonthlyRewardRollup, Transaction
+from transactions.rewards import backfill_transaction_rewards
+from transactions.rollups import rebuild_reward_rollups, monthly_spend, month_totals, month_rewards_by_card
+from transactions.serializers import TransactionCSVRowSerializer
+from transactions.tests.test_rewards import RewardsTestMixin
+
+'''
+Expectations
+------------
+MonthlyRewardRollup
+- One row per (user, year_month, card, category) with spend, reward and transaction count.
+- The reward is credited to the card actually used, else to the recommended card.
+- Transaction create/update/delete adjust the rows in place; an update that moves
+  a transaction to another month or card moves its totals.
+- Backdated CSV rows land in the month of their date, in a single insert.
+- Rows without a card are unique per (user, month, category) as well.
+- Updates diff against the row as stored when they save (read under the rollup lock),
+  not as it was loaded, and don't touch the rollups if nothing they track changed.
+- Reward backfills (bulk_update) rebuild the rollups of the affected users.
+- rebuild_reward_rollups / `manage.py rebuild_reward_rollups` repair drifted rows.
+
+Views
+- DashboardView, CardRewardsView and BudgetsHistoryView read the rollups.
+'''
+
+
+class RollupTestMixin(RewardsTestMixin):
+    def rollups(self):
+        return {
+            (row.year_month, row.card_id, row.category): (row.spend, row.reward, row.transaction_count)
+            for row in MonthlyRewardRollup.objects.filter(user=self.user)
+        }
+
+    def month(self, tx):
+        return tx.created_at.strftime('%Y-%m')
+
+
+class TestRollupMaintenance(RollupTestMixin, TestCase):
+    def test_create_accumulates(self):
+        first = self._tx("10.00", "DINING", card=self.freedom, recommended=self.gold)
+        self._tx("20.00", "DINING", card=self.freedom)
+        self._tx("5.00", "GAS", recommended=self.gold)
+        month = self.month(first)
+        self.assertEqual(self.rollups(), {
+            (month, self.freedom.id, "DINING"): (Decimal("30.00"), Decimal("0.90"), 2),
+            (month, self.gold.id, "GAS"): (Decimal("5.00"), Decimal("0.05"), 1),
+        })
+
+    def test_update_and_delete(self):
+        tx = self._tx("10.00", "DINING", card=self.freedom)
+        month = self.month(tx)
+
+        tx.amount = Decimal("20.00")
+        tx.save()
+        self.assertEqual(self.rollups(), {(month, self.freedom.id, "DINING"): (Decimal("20.00"), Decimal("0.60"), 1)})
+
+        tx.card_actually_used = self.gold
+        tx.save()
+        self.assertEqual(self.rollups(), {
+            (month, self.freedom.id, "DINING"): (Decimal("0.00"), Decimal("0.00"), 0),
+            (month, self.gold.id, "DINING"): (Decimal("20.00"), Decimal("0.80"), 1),
+        })
+
+        tx.created_at = datetime(2025, 1, 15, tzinfo=dt_timezone.utc)
+        tx.save(update_fields=["created_at"])
+        self.assertEqual(self.rollups()[("2025-01", self.gold.id, "DINING")], (Decimal("20.00"), Decimal("0.80"), 1))
+        self.assertEqual(self.rollups()[(month, self.gold.id, "DINING")], (Decimal("0.00"), Decimal("0.00"), 0))
+
+        tx.delete()
+        self.assertEqual(self.rollups()[("2025-01", self.gold.id, "DINING")], (Decimal("0.00"), Decimal("0.00"), 0))
+
+    def test_csv_backdated_row(self):
+        UserCard.objects.create(user=self.user, card=self.freedom)
+        serializer = TransactionCSVRowSerializer(
+            data={"card": str(self.freedom.id), "merchant": "Cafe", "amount": "10.00",
+                  "category": "DINING", "date": "2025-03-10"},
+            context={"user": self.user},
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with CaptureQueriesContext(connection) as queries:
+            serializer.save()
+        self.assertFalse([q for q in queries if q["sql"].startswith('UPDATE "transactions_transaction"')])
+        self.assertEqual(month_totals(self.user, "2025-03"), (Decimal("10.00"), Decimal("0.30")))
+        self.assertEqual(sum(row[2] for row in self.rollups().values()), 1)
+
+    def test_untracked_update_skips_rollups(self):
+        self._tx("10.00", "DINING", card=self.freedom)
+        tx = Transaction.objects.get(user=self.user)
+        expected = self.rollups()
+        tx.notes = "lunch"
+        with CaptureQueriesContext(connection) as queries:
+            tx.save()
+        sql = [q["sql"] for q in queries]
+        self.assertEqual(len([q for q in sql if q.startswith('SELECT') and 'FROM "transactions_transaction"' in q]), 1)
+        self.assertFalse([q for q in sql if "transactions_monthlyrewardrollup" in q])
+        self.assertEqual(self.rollups(), expected)
+
+    def test_update_from_stale_copy(self):
+        self._tx("10.00", "DINING", card=self.freedom)
+        first = Transaction.objects.get(user=self.user)
+        second = Transaction.objects.get(user=self.user)
+        second.amount = Decimal("20.00")
+        second.save()
+
+        first.amount = Decimal("30.00")  # loaded before the $20 save
+        first.save()
+        self.assertEqual(self.rollups()[(self.month(first), self.freedom.id, "DINING")][0], Decimal("30.00"))
+
+        second.refresh_from_db()
+        second.amount = Decimal("40.00")
+        second.save()
+        expected = self.rollups()
+        self.assertEqual(expected[(self.month(first), self.freedom.id, "DINING")][:2], (Decimal("40.00"), Decimal("1.20")))
+        rebuild_reward_rollups([self.user.id])
+        self.assertEqual(self.rollups(), expected)
+
+    def test_no_card_rows_are_unique(self):
+        self._tx("5.00", "GAS")
+        with self.assertRaises(IntegrityError):
+            MonthlyRewardRollup.objects.create(
+                user=self.user, year_month=self.month(Transaction.objects.get()), category="GAS",
+            )
+
+    def test_backfill_rebuilds_rollups(self):
+        tx = self._tx("10.00", "GAS", card=self.freedom)
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("5.00"), category=["GAS"])
+        backfill_transaction_rewards([self.freedom.id])
+        self.assertEqual(month_rewards_by_card(self.user, self.month(tx)), {self.freedom.id: Decimal("0.50")})
+
+    def test_rebuild_repairs_drift(self):
+        tx = self._tx("10.00", "DINING", card=self.freedom)
+        self._tx("4.00", "GAS", recommended=self.gold)
+        expected = self.rollups()
+        MonthlyRewardRollup.objects.filter(user=self.user).update(spend=Decimal("999.00"))
+        MonthlyRewardRollup.objects.create(user=self.user, year_month="2020-01", category="GAS", transaction_count=3)
+
+        self.assertEqual(rebuild_reward_rollups([self.user.id]), 2)
+        self.assertEqual(self.rollups(), expected)
+
+        MonthlyRewardRollup.objects.filter(user=self.user).delete()
+        out = StringIO()
+        call_command("rebuild_reward_rollups", "--user", str(self.user.id), stdout=out)
+        self.assertIn("Wrote 2 rollup rows", out.getvalue())
+        self.assertEqual(self.rollups(), expected)
+        self.assertEqual(monthly_spend(self.user, [self.month(tx), "2020-01"]), {
+            self.month(tx): Decimal("14.00"), "2020-01": Decimal("0.00"),
+        })
+
+
+class TestRollupViews(RollupTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        UserCard.objects.create(user=self.user, card=self.freedom)
+        self.client.force_authenticate(user=self.user)
+
+    def test_views_read_rollups(self):
+        for _ in range(3):
+            self._tx("10.00", "DINING", card=self.freedom)
+        # Drift the rollups on purpose: the views must report the rollup values
+        MonthlyRewardRollup.objects.filter(user=self.user).update(spend=Decimal("50.00"), reward=Decimal("7.00"))
+
+        summary = self.client.get(reverse("analytics-dashboard")).data["data"]["summary"]
+        self.assertEqual(summary["total_spent_this_month"], 50.0)
+        self.assertEqual(summary["total_rewards_this_month"], 7.0)
+
+        cards = self.client.get(reverse("card-rewards")).data["data"]
+        self.assertEqual(cards[0]["rewards_earned"], 7.0)
+
+        history = self.client.get("/api/budgets/history/?limit=2").data
+        self.assertEqual(Decimal(history[0]["actual_spend"]), Decimal("50.00"))
+        self.assertEqual(Decimal(history[1]["actual_spend"]), Decimal("0.00"))
+
+
+# To run the tests:
+# python manage.py test transactions.tests.test_rollups
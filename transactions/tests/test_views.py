@@ -1,3 +1,4 @@
+import json
 from decimal import Decimal
 from datetime import timedelta
 from django.contrib.auth import get_user_model
@@ -5,10 +6,18 @@ from rest_framework import status
 from rest_framework.test import APIRequestFactory, force_authenticate
 from django.test import TestCase
 from django.utils import timezone
-from transactions.models import Transaction
-from transactions.views import HealthCheckView, TransactionViewSet, TransactionCSVImportView
-from cards.models import Card, UserCard
+from transactions.models import Transaction, CSVImportJob
+from transactions import csv_import
+from transactions.views import (
+    HealthCheckView, TransactionViewSet, TransactionCSVImportView, BatchCardRecommendationView, CSVImportJobView,
+)
+from cards.models import Card, UserCard, RewardRule
+from cards.rates import get_rate_table
 from io import StringIO
+import shutil
+import tempfile
+from unittest.mock import patch
+from django.test import override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 '''
@@ -33,9 +42,31 @@ TransactionCSVImportView
 - Processes each row with TransactionCSVRowSerializer.
 - Card can be specified by ID (must be in user's wallet) or name.
 - Date field optional, format: YYYY-MM-DD.
-- Returns response with imported_count, failed_count, and results array.
-- Each result includes row number, status ("imported" or "error"), and errors if it fails.
+- Returns response with imported_count, duplicate_count, failed_count, and results array.
+- Each result includes row number, status ("imported", "duplicate" or "error"), and errors if it fails.
+- Re-uploading rows that were already imported skips them (status "duplicate").
 - Handles invalid CSV, missing columns, encoding errors properly.
+- The upload is decoded and parsed chunk by chunk; a file that isn't UTF-8 anywhere is a 400 and
+  nothing is imported (the whole file is decoded before the first row is written).
+- Valid rows are inserted in bulk (TransactionImporter); budget alerts run once per imported month.
+- With background=true the upload is stored as a CSVImportJob, started after commit, and a 202
+  with the job id is returned right away.
+- With parallel=true, row chunks are validated in a process pool (CSV_IMPORT_VALIDATION_WORKERS).
+- report=ndjson streams application/x-ndjson: one line per failed row, then a {"summary": counts}
+  line; imported rows are not listed.
+- dry_run=true validates without writing and returns aggregate counts instead of per-row results.
+- engine=columnar validates with pandas column by column (same results); unknown engines are a 400.
+
+CSVImportJobView
+- GET import-csv/jobs/<id>/ reports the job's status, processed / remaining / failed rows and failures.
+- Other users' jobs are 404.
+
+BatchCardRecommendationView
+- Requires authentication.
+- POST {"items": [{"category", "amount", "merchant"?}, ...]} returns one recommendation per item, in order.
+- The wallet, rules and cap usage counters are loaded once per request (query count independent of item count).
+- Items with an amount are ranked by the blended rate left after bonus caps.
+- Empty or invalid item lists (including unknown categories) are rejected with a 400.
 '''
 
 
@@ -307,5 +338,174 @@ class TestTransactionCSVImportView(TestCase):
             elif result["status"] == "error":
                 self.assertIn("errors", result)
 
+    def test_csv_import_encoding_errors(self):
+        """Test invalid UTF-8 is a 400, and nothing is imported even if it comes after valid rows."""
+        view = TransactionCSVImportView.as_view()
+        req = self.rf.post("/api/transactions/import-csv/", {"file": SimpleUploadedFile(
+            "transactions.csv", b"card,merchant,amount,category\n1,Caf\xe9,10.00,DINING\n", content_type="text/csv"
+        )}, format="multipart")
+        force_authenticate(req, user=self.user)
+        resp = view(req)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("encoding", resp.data["error"])
+
+        header = b"card,merchant,amount,category\n"
+        content = header + b"1,Store M,10.00,GROCERIES\n" * 5000 + b"1,Caf\xe9,10.00,DINING\n"
+        req = self.rf.post("/api/transactions/import-csv/", {"file": SimpleUploadedFile(
+            "transactions.csv", content, content_type="text/csv"
+        )}, format="multipart")
+        force_authenticate(req, user=self.user)
+        resp = view(req)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("encoding", resp.data["error"])
+        self.assertFalse(Transaction.objects.filter(user=self.user).exists())
+
+    def test_csv_import_ndjson_report(self):
+        """Test report=ndjson streams only the failed rows and a summary."""
+        csv_content = "card,merchant,amount,category\n1,Store T,10.00,GROCERIES\n1,U,x,GAS\n1,V,5.00,NOPE\n"
+        view = TransactionCSVImportView.as_view()
+        reports = []
+        for _ in range(2):
+            req = self.rf.post("/api/transactions/import-csv/", {
+                "file": self._create_csv_file(csv_content), "report": "ndjson",
+            }, format="multipart")
+            force_authenticate(req, user=self.user)
+            resp = view(req)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+            reports.append([json.loads(line) for line in b"".join(resp.streaming_content).splitlines()])
+        first, second = reports
+        self.assertEqual([line.get("row") for line in first], [3, 4, None])
+        self.assertIn("amount", first[0]["errors"])
+        self.assertEqual(first[-1], {"summary": {"imported_count": 1, "duplicate_count": 0, "failed_count": 2}})
+        self.assertEqual(second[-1], {"summary": {"imported_count": 0, "duplicate_count": 1, "failed_count": 2}})
+
+        req = self.rf.post("/api/transactions/import-csv/", {"file": SimpleUploadedFile(
+            "transactions.csv", b"card,merchant,amount,category\n1,Caf\xe9,1.00,GAS\n", content_type="text/csv"
+        ), "report": "ndjson"}, format="multipart")
+        force_authenticate(req, user=self.user)
+        self.assertEqual(view(req).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_csv_import_dry_run(self):
+        """Test dry_run returns a preview and writes nothing."""
+        csv_content = "card,merchant,amount,category,date\n1,Store R,10.00,GROCERIES,2024-05-02\n1,S,x,GAS,bad\n"
+        req = self.rf.post("/api/transactions/import-csv/", {
+            "file": self._create_csv_file(csv_content), "dry_run": "true",
+        }, format="multipart")
+        force_authenticate(req, user=self.user)
+        resp = TransactionCSVImportView.as_view()(req)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.data["data"]
+        self.assertTrue(data["dry_run"])
+        self.assertEqual((data["valid_rows"], data["new_rows"], data["error_rows"]), (1, 1, 1))
+        self.assertEqual(data["errors_by_field"], {"amount": 1, "date": 1})
+        self.assertEqual(data["spend_by_category"], {"GROCERIES": 10.0})
+        self.assertEqual((data["first_month"], data["last_month"]), ("2024-05", "2024-05"))
+        self.assertNotIn("results", data)
+        self.assertFalse(Transaction.objects.filter(user=self.user).exists())
+
+    def test_csv_import_engine(self):
+        """Test the columnar engine is selectable per request and unknown engines are rejected."""
+        view = TransactionCSVImportView.as_view()
+        for engine, expected in (("columnar", status.HTTP_200_OK), ("turbo", status.HTTP_400_BAD_REQUEST)):
+            csv_file = self._create_csv_file("card,merchant,amount,category\n1,Store P,10.00,GROCERIES\n1,Q,x,GAS\n")
+            req = self.rf.post("/api/transactions/import-csv/", {"file": csv_file, "engine": engine}, format="multipart")
+            force_authenticate(req, user=self.user)
+            resp = view(req)
+            self.assertEqual(resp.status_code, expected)
+        self.assertEqual((resp.data["success"], Transaction.objects.filter(user=self.user).count()), (False, 1))
+        tx = Transaction.objects.get(user=self.user)
+        self.assertEqual((tx.merchant, tx.card_actually_used), ("Store P", self.card))
+
+    def test_csv_import_background_job(self):
+        """Test background=true stores a job and the status endpoint reports its progress."""
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        csv_content = "card,merchant,amount,category\n1,Store N,10.00,GROCERIES\n1,Store O,bad,GROCERIES\n"
+        req = self.rf.post("/api/transactions/import-csv/", {
+            "file": self._create_csv_file(csv_content), "background": "true",
+        }, format="multipart")
+        force_authenticate(req, user=self.user)
+        with override_settings(MEDIA_ROOT=media), patch.object(csv_import._import_executor, "submit") as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                resp = TransactionCSVImportView.as_view()(req)
+            self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+            job_id = resp.data["data"]["job_id"]
+            submit.assert_called_once_with(csv_import._import_worker, job_id)
+            self.assertFalse(Transaction.objects.filter(user=self.user).exists())
+            csv_import.run_import_job(job_id)
+
+        req = self.rf.get(f"/api/transactions/import-csv/jobs/{job_id}/")
+        force_authenticate(req, user=self.user)
+        resp = CSVImportJobView.as_view()(req, pk=job_id)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.data["data"]
+        self.assertEqual(data["status"], CSVImportJob.DONE)
+        self.assertEqual((data["total_rows"], data["processed_rows"], data["remaining_rows"]), (2, 2, 0))
+        self.assertEqual((data["imported_count"], data["failed_count"]), (1, 1))
+        self.assertEqual(data["failures"][0]["row"], 3)
+
+        other = User.objects.create_user(username="other", email="other@e.com", password="pw")
+        req = self.rf.get(f"/api/transactions/import-csv/jobs/{job_id}/")
+        force_authenticate(req, user=other)
+        self.assertEqual(CSVImportJobView.as_view()(req, pk=job_id).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestBatchCardRecommendationView(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = get_user_model().objects.create_user(username="batch", email="batch@example.com", password="pw")
+        self.freedom = Card.objects.create(name="Freedom", issuer="CHASE", annual_fee=0)
+        self.gold = Card.objects.create(name="Gold", issuer="AMEX", annual_fee=250)
+        RewardRule.objects.create(card=self.freedom, multiplier=Decimal("1.50"), category=["OTHER"])
+        RewardRule.objects.create(card=self.gold, multiplier=Decimal("4.00"), category=["DINING", "GROCERIES"])
+        UserCard.objects.create(user=self.user, card=self.freedom)
+        UserCard.objects.create(user=self.user, card=self.gold)
+
+    def _post(self, payload, user=None):
+        request = self.factory.post("/api/transactions/recommend-cards/", payload, format="json")
+        if user:
+            force_authenticate(request, user=user)
+        return BatchCardRecommendationView.as_view()(request)
+
+    def test_requires_authentication(self):
+        response = self._post({"items": [{"category": "DINING"}]})
+        self.assertIn(response.status_code, [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
+    def test_recommends_every_item(self):
+        items = [
+            {"category": "DINING", "amount": "25.00", "merchant": "Cafe"},
+            {"category": "GAS", "amount": "40.10"},
+            {"category": "GROCERIES"},
+        ]
+        response = self._post({"items": items}, user=self.user)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data["data"]["items"]
+        self.assertEqual([item["category"] for item in data], ["DINING", "GAS", "GROCERIES"])
+        self.assertEqual([item["recommendation"]["best_card"]["card_id"] for item in data],
+                         [self.gold.id, self.freedom.id, self.gold.id])
+        self.assertEqual(data[0]["merchant"], "Cafe")
+        self.assertEqual(data[1]["amount"], 40.1)
+        self.assertEqual(data[2]["amount"], 0.0)
+
+    def test_query_count_independent_of_items(self):
+        with self.assertNumQueries(2):  # active cards + reward rules
+            self._post({"items": [{"category": "DINING"}]}, user=self.user)
+        UserCard.objects.get(card=self.gold).save()  # clear the cached wallet
+        items = [{"category": category, "amount": "10"} for category in ["DINING", "GAS", "RENT", "TRANSIT"] * 10]
+        get_rate_table()  # built once per process, not per request
+        with self.assertNumQueries(3):  # active cards + reward rules + cap usage counters
+            response = self._post({"items": items}, user=self.user)
+        self.assertEqual(len(response.data["data"]["items"]), 40)
+
+    def test_invalid_payload(self):
+        self.assertEqual(self._post({"items": []}, user=self.user).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self._post({"items": [{"amount": "-1"}]}, user=self.user)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.data["success"])
+        response = self._post({"items": [{"category": "DINNING"}]}, user=self.user)  # typo → 400, not OTHER
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 #To run tests:
 # python manage.py test transactions
\ No newline at end of file
@@ -10,6 +10,8 @@ urlpatterns = [
     path('', include(router.urls)),
     path('health/', views.HealthCheckView.as_view(), name='health'),
     path('import-csv/', views.TransactionCSVImportView.as_view(), name='csv-import'),
+    path('import-csv/jobs/<int:pk>/', views.CSVImportJobView.as_view(), name='csv-import-job'),
     path('recommend-card/', views.CardRecommendationView.as_view(), name='recommend-card'),
+    path('recommend-cards/', views.BatchCardRecommendationView.as_view(), name='recommend-cards'),
     path('optimization-stats/', views.OptimizationStatsView.as_view(), name='optimization-stats'),
 ]
\ No newline at end of file
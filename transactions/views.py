@@ -4,16 +4,24 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
-from .models import Transaction
-from .serializers import TransactionSerializer, TransactionCSVRowSerializer
+from .models import Transaction, CSVImportJob
+from .serializers import TransactionSerializer, BatchRecommendationSerializer
+from .csv_import import (
+    CSVEncodingError, TransactionImporter, ENCODING_ERROR, SERIALIZER, ENGINES, start_import_job,
+    validation_workers,
+)
 from rest_framework import viewsets, permissions
 import csv
-import io
+import itertools
+import json
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from budgets.models import MonthlyBudget
 from budgets.services import mtd_spend, evaluate_thresholds
-from optimizer.services import best_cards_for_category
-from cards.models import Card
+from optimizer.services import best_cards_for_category, best_cards_for_purchases
+from django.db.models import Count, F, Q, Sum
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
 
 
 class HealthCheckView(APIView):
@@ -71,15 +79,8 @@ class TransactionViewSet(viewsets.ModelViewSet):
             if recommendation.get('best_card'):
                 recommended_card_id = recommendation['best_card']['card_id']
         
-        # Save transaction with recommended card
-        if recommended_card_id:
-            try:
-                recommended_card = Card.objects.get(id=recommended_card_id)
-                serializer.save(user=self.request.user, recommended_card=recommended_card)
-            except Card.DoesNotExist:
-                serializer.save(user=self.request.user)
-        else:
-            serializer.save(user=self.request.user)
+        # Save transaction with recommended card (id from the cached recommendation, no lookup)
+        serializer.save(user=self.request.user, recommended_card_id=recommended_card_id)
         
         # After creating transaction, check if we need to fire budget alerts
         now = datetime.now()
@@ -108,7 +109,15 @@ class CardRecommendationView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        recommendation = best_cards_for_category(category, request.user)
+        try:
+            purchase_amount = Decimal(str(amount))
+        except (InvalidOperation, ValueError):
+            purchase_amount = None  # Unparseable amount: rank by category only
+        if purchase_amount is not None and purchase_amount.is_finite() and purchase_amount > 0:
+            # Ranks by the blended rate this amount earns given the cap headroom left
+            recommendation = best_cards_for_purchases([(category, purchase_amount)], request.user)[0]
+        else:
+            recommendation = best_cards_for_category(category, request.user)
         
         return Response({
             "success": True,
@@ -120,10 +129,51 @@ class CardRecommendationView(APIView):
         })
 
 
+class BatchCardRecommendationView(APIView):
+    """Get card recommendations for many line items (category, amount, optional merchant) at once"""
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        serializer = BatchRecommendationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "success": False,
+                    "errors": serializer.errors
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        items = serializer.validated_data['items']
+        # Wallet, rules and cap usage are loaded once; every item is ranked in memory
+        recommendations = best_cards_for_purchases(
+            [(item['category'], item['amount']) for item in items], request.user
+        )
+        
+        return Response({
+            "success": True,
+            "data": {
+                "items": [
+                    {
+                        "category": item['category'],
+                        "amount": float(item['amount']),
+                        "merchant": item['merchant'],
+                        "recommendation": recommendation
+                    }
+                    for item, recommendation in zip(items, recommendations)
+                ]
+            }
+        })
+
+
 class TransactionCSVImportView(APIView):
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     
+    @staticmethod
+    def _flag(request, name):
+        return str(request.data.get(name, '')).lower() in ('1', 'true', 'yes')
+    
     def post(self, request):
         if 'file' not in request.FILES:
             return Response(
@@ -136,79 +186,210 @@ class TransactionCSVImportView(APIView):
         
         uploaded_file = request.FILES['file']
         
-        try:
-            file_content = uploaded_file.read().decode('utf-8')
-        except UnicodeDecodeError as e:
+        # Very large files: validate row chunks in a process pool
+        parallel = self._flag(request, 'parallel')
+        # Validation engine: per-row serializer (default) or pandas columns
+        engine = request.data.get('engine') or SERIALIZER
+        if engine not in ENGINES:
             return Response(
                 {
                     "success": False,
-                    "error": f"File encoding error: {str(e)}. Please ensure the file is UTF-8 encoded."
+                    "error": f"Unknown engine '{engine}'. Valid: {', '.join(ENGINES)}"
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            csv_reader = csv.DictReader(io.StringIO(file_content))
-        except Exception as e:
-            return Response(
-                {"detail": f"CSV parsing error: {str(e)}"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # Preview: validate and summarize the file without writing anything
+        if self._flag(request, 'dry_run'):
+            return self._preview(request, uploaded_file, parallel, engine)
+        
+        # Compact report: summary counts plus only the failed rows, streamed as NDJSON
+        if request.data.get('report') == 'ndjson':
+            return self._ndjson_report(request, uploaded_file, parallel, engine)
+        
+        # Big files: store the upload and return a job to poll instead of importing in the request
+        if self._flag(request, 'background'):
+            job = start_import_job(request.user, uploaded_file, parallel=parallel, engine=engine)
+            return Response({
+                "success": True,
+                "data": {
+                    "job_id": job.id,
+                    "status": job.status
+                }
+            }, status=status.HTTP_202_ACCEPTED)
         
         imported_count = 0
+        duplicate_count = 0
         failed_count = 0
         results = []
         
-        for row_num, row_data in enumerate(csv_reader, start=2):
-            serializer = TransactionCSVRowSerializer(
-                data=row_data,
-                context={"user": request.user}
-            )
-            
-            if serializer.is_valid():
-                try:
-                    transaction = serializer.save()
-                    results.append({
-                        "row": row_num,
-                        "status": "imported",
-                        "transaction_id": transaction.id
-                    })
+        # Rows are decoded and parsed chunk by chunk as the loop consumes them,
+        # and inserted with one bulk_create per chunk of rows
+        importer = TransactionImporter(request.user, workers=validation_workers(parallel), engine=engine)
+        try:
+            for result in importer.import_file(uploaded_file):
+                results.append(result)
+                if result["status"] == "imported":
                     imported_count += 1
-                except Exception as e:
-                    results.append({
-                        "row": row_num,
-                        "status": "error",
-                        "errors": {"non_field_errors": [str(e)]}
-                    })
+                elif result["status"] == "duplicate":
+                    duplicate_count += 1
+                else:
                     failed_count += 1
-            else:
-                results.append({
-                    "row": row_num,
-                    "status": "error",
-                    "errors": serializer.errors
-                })
-                failed_count += 1
-        
-        # After importing, check if we need to fire budget alerts
-        if imported_count > 0:
-            now = datetime.now()
-            current_month = now.strftime('%Y-%m')
-            try:
-                budget = MonthlyBudget.objects.get(user=request.user, year_month=current_month)
-                mtd = mtd_spend(request.user, current_month)
-                evaluate_thresholds(budget, mtd)
-            except MonthlyBudget.DoesNotExist:
-                pass  # No budget set for this month
+        except CSVEncodingError as e:
+            # Raised before any row is imported (the whole file is decoded first)
+            return Response(
+                {
+                    "success": False,
+                    "error": ENCODING_ERROR.format(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except csv.Error as e:
+            if not results:
+                return Response(
+                    {"detail": f"CSV parsing error: {str(e)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            results.append({
+                "row": results[-1]["row"] + 1,
+                "status": "error",
+                "errors": {"non_field_errors": [f"CSV parsing error: {str(e)}"]}
+            })
+            failed_count += 1
+        finally:
+            # Cap usage and budget alerts once per imported year / month, not per row
+            importer.finish()
         
         return Response({
             "success": True,
             "data": {
                 "imported_count": imported_count,
+                "duplicate_count": duplicate_count,
                 "failed_count": failed_count,
                 "results": results
             }
         }, status=status.HTTP_200_OK)
 
+    
+    def _ndjson_report(self, request, uploaded_file, parallel, engine):
+        """
+        One JSON line per failed row as the import reaches it, then a summary line
+        ({"summary": {...counts}}); imported rows aren't listed, and nothing holds the full report.
+        """
+        importer = TransactionImporter(request.user, workers=validation_workers(parallel), engine=engine)
+        results = importer.import_file(uploaded_file)
+        # Read the first row before answering, so an unreadable file is still a 400
+        try:
+            first = next(results, None)
+        except CSVEncodingError as e:
+            importer.finish()
+            return Response(
+                {
+                    "success": False,
+                    "error": ENCODING_ERROR.format(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except csv.Error as e:
+            importer.finish()
+            return Response(
+                {"detail": f"CSV parsing error: {str(e)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        def lines():
+            counts = {"imported": 0, "duplicate": 0, "error": 0}
+            last_row = 1
+            try:
+                for result in itertools.chain([first] if first else [], results):
+                    counts[result["status"]] += 1
+                    last_row = result["row"]
+                    if result["status"] == "error":
+                        yield json.dumps(result, cls=DjangoJSONEncoder) + "\n"
+            except csv.Error as e:
+                # Rows before the unparseable part are already imported; report where reading stopped
+                counts["error"] += 1
+                yield json.dumps({
+                    "row": last_row + 1,
+                    "status": "error",
+                    "errors": {"non_field_errors": [f"CSV parsing error: {str(e)}"]}
+                }) + "\n"
+            finally:
+                importer.finish()
+            yield json.dumps({"summary": {
+                "imported_count": counts["imported"],
+                "duplicate_count": counts["duplicate"],
+                "failed_count": counts["error"]
+            }}) + "\n"
+        
+        return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+    
+    def _preview(self, request, uploaded_file, parallel, engine):
+        importer = TransactionImporter(
+            request.user, workers=validation_workers(parallel), engine=engine, dry_run=True
+        )
+        preview = importer.preview
+        try:
+            for _result in importer.import_file(uploaded_file):
+                pass  # Only the running totals in importer.preview are kept
+        except CSVEncodingError as e:
+            return Response(
+                {
+                    "success": False,
+                    "error": ENCODING_ERROR.format(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except csv.Error as e:
+            if not preview.valid_rows + preview.error_rows:
+                return Response(
+                    {"detail": f"CSV parsing error: {str(e)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            preview.add_error({"non_field_errors": [f"CSV parsing error: {str(e)}"]})
+        
+        return Response({
+            "success": True,
+            "data": {
+                "dry_run": True,
+                **preview.as_dict()
+            }
+        }, status=status.HTTP_200_OK)
+
+
+class CSVImportJobView(APIView):
+    """Progress of a background CSV import job"""
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, pk):
+        job = CSVImportJob.objects.filter(user=request.user, pk=pk).first()
+        if job is None:
+            return Response(
+                {
+                    "success": False,
+                    "error": "Import job not found."
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        return Response({
+            "success": True,
+            "data": {
+                "job_id": job.id,
+                "status": job.status,
+                "total_rows": job.total_rows,
+                "processed_rows": job.processed_rows,
+                "remaining_rows": job.remaining_rows,
+                "imported_count": job.imported_count,
+                "duplicate_count": job.duplicate_count,
+                "failed_count": job.failed_count,
+                "failures": job.failures,
+                "error": job.error,
+                "created_at": job.created_at,
+                "finished_at": job.finished_at
+            }
+        })
+
 
 class OptimizationStatsView(APIView):
     """Get user's card optimization statistics"""
@@ -239,10 +420,18 @@ class OptimizationStatsView(APIView):
                 }
             })
         
-        optimal_count = sum(1 for t in transactions if t.used_optimal_card)
+        # Read the stored reward columns instead of recomputing per transaction
+        stats = transactions.aggregate(
+            optimal_count=Count('id', filter=Q(card_actually_used__isnull=False) & (
+                Q(recommended_card__isnull=True) | Q(card_actually_used=F('recommended_card'))
+            )),
+            actual=Sum('actual_reward'),
+            optimal=Sum('optimal_reward'),
+        )
+        optimal_count = stats['optimal_count']
         
-        total_actual_rewards = sum(float(t.actual_reward) for t in transactions)
-        total_optimal_rewards = sum(float(t.optimal_reward) for t in transactions)
+        total_actual_rewards = float(stats['actual'] or 0)
+        total_optimal_rewards = float(stats['optimal'] or 0)
         total_missed = total_optimal_rewards - total_actual_rewards
         
         return Response({